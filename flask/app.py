@@ -1,16 +1,18 @@
 """
 	Flask and GraphQL endpoints
 """
-from uuid import uuid4
 import pandas as pd
 import datetime
 import random
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
+import fcntl
 import logging
 import os
+import re
 import shutil
+import threading
 import math
 from PIL import Image
 
@@ -18,12 +20,21 @@ from PIL import Image
 from graphql_server.flask import GraphQLView
 
 # https://docs.graphene-python.org/en/latest/
-from graphene import Interface, ObjectType, InputObjectType, Mutation, Field, ID, String, Int, Boolean, Schema, List, JSONString
+from graphene import Interface, ObjectType, InputObjectType, Mutation, Field, ID, String, Int, Float, Boolean, Schema, List, JSONString
 
 # https://docs.python-arango.com/en/main/
 from arango import ArangoClient
 
 import transversal as tv
+import loaders
+import lookahead
+import queries
+import images
+import indexes
+import ingest
+import jobs
+import odds
+import rolls
 from imagegen import generate_image
 
 app = Flask(__name__)
@@ -33,6 +44,9 @@ logging.getLogger("werkzeug").setLevel(logging.WARNING)
 
 app.config['UPLOAD_FOLDER'] = '/media/uploads'
 app.config['IMAGEN_FOLDER'] = '/media/imagens'
+app.config['OWNER_LOCK'] = '/media/.ingest.lock' # held by the one process that ingests and provisions
+
+portraits = images.Manifest(app.config['UPLOAD_FOLDER'])
 
 arango_host = "tv_adb"
 arango_port = "8529"
@@ -40,17 +54,10 @@ arango_username = "root"
 arango_password = os.environ.get("ARANGO_ROOT_PASSWORD")
 arango_db = "transversal"
 
-# session variables
-dicepool_limit = -1
-result_limit = 2
-effect_limit = 1
-session_characters = []
-session_rev = uuid4()
-scene_rev = uuid4()
-beat_rev = uuid4()
-resolutions_rev = uuid4()
-resolutions = []
-complication_pool = []
+# session variables, the session state of every table is kept by `tv.tables`
+long_poll_limit = 30 # seconds a get-resolutions request is held at most
+keep_alive_interval = 15 # seconds between keep-alive comments on the resolutions stream
+
 RATINGS = {
 	'd4': {'value': 4},
 	'd6': {'value': 6},
@@ -59,8 +66,6 @@ RATINGS = {
 	'd12': {'value': 12},
 }
 
-session = tv.Session()
-
 # GraphQL API
 
 client = ArangoClient(hosts=f"http://{arango_host}:{arango_port}")
@@ -75,17 +80,72 @@ class Player(ObjectType):
 	uuid = ID()
 	name = String()
 	is_gm = Boolean()
+	table = String() # the table the player sits at
 	character = Field(lambda: Character)
 
 	def resolve_character(parent, info):
-		return next((char for char in session_characters if char['uuid'] == parent.uuid), None)
+		player = tv.tables[parent.table].current().players.get(parent.uuid)
+		if player is None or player.get('character') is None:
+			return None
+		return Character(id='Entities/' + player.get('character'), table=parent.table)
+
+class Odds(ObjectType):
+	"""exact outcome probabilities of a dicepool, by die ratings"""
+	dice = List(String)
+	result_limit = Int()
+	effect_limit = Int()
+	totals = List(Float)
+	hitches = List(Float)
+	effects = List(Float)
+	mean = Float()
+	botch = Float()
+	beat = Float(target=Int(required=True))
+	beat_pool = Float(dice=List(String, required=True))
+
+	@staticmethod
+	def _odds(parent):
+		return odds.odds(parent.dice or [], parent.result_limit, parent.effect_limit)
+
+	def resolve_totals(parent, info):
+		return Odds._odds(parent).totals.tolist()
+
+	def resolve_hitches(parent, info):
+		return Odds._odds(parent).hitches.tolist()
+
+	def resolve_effects(parent, info):
+		return Odds._odds(parent).effects.tolist()
+
+	def resolve_mean(parent, info):
+		return Odds._odds(parent).mean()
+
+	def resolve_botch(parent, info):
+		return Odds._odds(parent).botch()
+
+	def resolve_beat(parent, info, target):
+		return Odds._odds(parent).beat(target)
+
+	def resolve_beat_pool(parent, info, dice):
+		return Odds._odds(parent).beat_pool(odds.odds(dice, parent.result_limit, parent.effect_limit))
+
+class ImageJob(ObjectType):
+	"""an image that's being made into its derivatives by the worker pool"""
+	id = ID()
+	entity_key = String()
+	state = String()
+	error = String()
+	sizes = JSONString()
+	submitted = Float()
+	finished = Float()
 
 class Dicepool(ObjectType):
+	table = String()
 	dice = List(JSONString)
 	phase = String()
 	player = Field(lambda: Player)
+	odds = Field(lambda: Odds)
 
 class Session(ObjectType):
+	table = String()
 	dicepool_limit = Int()
 	result_limit = Int()
 	effect_limit = Int()
@@ -95,34 +155,54 @@ class Session(ObjectType):
 	characters = List(lambda: Character)
 	dicepools = List(lambda: Dicepool)
 
+	@staticmethod
+	def _snapshot(parent, info):
+		"""the session snapshot of the table used for the whole request, so all fields agree with each other"""
+		table = parent.table or tv.Tables.DEFAULT
+		sessions = info.context.setdefault('sessions', {})
+		if table not in sessions:
+			sessions[table] = tv.tables[table].current()
+		return sessions[table]
+
+	def resolve_table(parent, info):
+		return parent.table or tv.Tables.DEFAULT
+
 	def resolve_dicepool_limit(parent, info):
-		global dicepool_limit
-		return dicepool_limit
+		return Session._snapshot(parent, info).dicepool_limit
 
 	def resolve_result_limit(parent, info):
-		return result_limit
+		return Session._snapshot(parent, info).result_limit
 
 	def resolve_effect_limit(parent, info):
-		return effect_limit
+		return Session._snapshot(parent, info).effect_limit
 
 	def resolve_session(parent, info):
-		return session_rev
+		return Session._snapshot(parent, info).session
 
 	def resolve_scene(parent, info):
-		return scene_rev
+		return Session._snapshot(parent, info).scene
 
 	def resolve_beat(parent, info):
-		return beat_rev
+		return Session._snapshot(parent, info).beat
 
 	def resolve_characters(parent, info):
-		return [Character(id='Entities/' + char.get('character')) for char in session_characters]
+		players = Session._snapshot(parent, info).players.values()
+		loaders.want(info, [player.get('character') for player in players], 'Entities')
+		return [Character(id='Entities/' + player.get('character'), table=parent.table) for player in players]
 
 	def resolve_dicepools(parent, info):
+		session = Session._snapshot(parent, info)
 		return [Dicepool(
+			table=parent.table,
 			dice=resolution.get('dice'),
 			phase=resolution.get('phase'),
-			player=Player(uuid=resolution.get('player').get('uuid'))
-		) for resolution in resolutions]
+			player=Player(uuid=resolution.get('player').get('uuid'), table=parent.table),
+			odds=Odds(
+				dice=[die.get('rating') for die in resolution.get('dice')],
+				result_limit=session.result_limit,
+				effect_limit=session.effect_limit
+			)
+		) for resolution in map(session.dicepool.resolution, session.dicepool.resolutions)]
 
 class SessionInput(InputObjectType):
 	dicepool_limit = Int()
@@ -135,49 +215,37 @@ class SessionInput(InputObjectType):
 class UpdateSession(Mutation):
 	class Arguments:
 		session_input = SessionInput(required=True)
+		table = String(required=False)
 
 	message = String()
 	session = Field(lambda: Session)
 
-	def mutate(self, info, session_input):
-		global session_characters
-		global dicepool_limit
-		global session_rev, scene_rev, beat_rev
-		global resolutions, resolutions_rev
-		dicepool_limit = session_input.dicepool_limit
-		
-		if session_input.new_session:
-			session_rev = uuid4()
-			session_characters = []
+	def mutate(self, info, session_input, table=None):
+		table = table or tv.Tables.DEFAULT
+		# a new session is the only way a table is created
+		state = tv.tables.create(table) if session_input.new_session else tv.tables[table]
+		session = state.update(
+			dicepool_limit=session_input.dicepool_limit,
+			new_session=session_input.new_session,
+			next_scene=session_input.next_scene,
+			next_beat=session_input.next_beat
+		)
+		info.context.setdefault('sessions', {})[table] = session
 
-			active_entities = db.collection('Entities').find({'active': True, 'type': 'character'})
-			for entity in active_entities:
-				entity['active'] = False
-				db.collection('Entities').update(entity)
+		# only the entities activated at this table are reset, entities without a table belong to the default table
+		default = table == tv.Tables.DEFAULT
+		if session_input.new_session:
+			for entity in tv.query(queries.ACTIVE_TABLE_ENTITIES, entity_type='character', table=table, default=default):
+				db.collection('Entities').update({ '_id': entity.get('_id'), 'active': False })
 
-			stuck_on_imagening = db.collection('Entities').find({'imagening': True})
-			for entity in stuck_on_imagening:
-				entity['imagening'] = False
-				db.collection('Entities').update(entity)
+			for entity in tv.query(queries.IMAGENING_TABLE_ENTITIES, table=table, default=default):
+				db.collection('Entities').update({ '_id': entity.get('_id'), 'imagening': False })
 
 		if session_input.new_session or session_input.next_scene:
-			scene_rev = uuid4()
-			
-			active_entities = db.collection('Entities').find({'active': True, 'type': 'npc'})
-			for entity in active_entities:
-				entity['active'] = False
-				db.collection('Entities').update(entity)
-
-		if session_input.new_session or session_input.next_scene or session_input.next_beat:
-			beat_rev = uuid4()
-			resolutions = []
-			resolutions_rev = uuid4()
-
-		return UpdateSession(message="Session updated", session=Session(
-			dicepool_limit=dicepool_limit,
-			result_limit=result_limit,
-			effect_limit=effect_limit
-		))
+			for entity in tv.query(queries.ACTIVE_TABLE_ENTITIES, entity_type='npc', table=table, default=default):
+				db.collection('Entities').update({ '_id': entity.get('_id'), 'active': False })
+
+		return UpdateSession(message="Session updated", session=Session(table=table))
 
 class SFX(ObjectType):
 	id = ID()
@@ -185,10 +253,10 @@ class SFX(ObjectType):
 	description = String()
 
 	def resolve_name(parent, info):
-		return db.collection('SFXs').get(parent.id)['name']
+		return loaders.load(info, parent.id, 'SFXs')['name']
 
 	def resolve_description(parent, info):
-		return db.collection('SFXs').get(parent.id)['description']
+		return loaders.load(info, parent.id, 'SFXs')['description']
 
 class CreateSFX(Mutation):
 	class Arguments:
@@ -230,10 +298,7 @@ class DeleteSFX(Mutation):
 
 	def mutate(self, info, id):
 		try:
-			query = f"""FOR ts IN TraitSettings
-				FILTER '{ id }' IN ts.sfxs
-				RETURN ts"""
-			results = db.aql.execute(query)
+			results = tv.query(queries.TRAIT_SETTINGS_WITH_SFX, sfx=id)
 			for result in results:
 				new_sfxs = result.get('sfxs')
 				new_sfxs.remove(id)
@@ -267,11 +332,25 @@ class TraitSetting(ObjectType):
 	known_to = List(lambda: Character) # characters who have learned about this trait
 	hidden = Boolean()
 
+	@classmethod
+	def from_document(cls, document):
+		"""creates a trait setting from a TraitSettings document that was already retrieved"""
+		trait_setting = cls(id=document.get('_id'))
+		trait_setting._document = document
+		return trait_setting
+
+	@classmethod
+	def _hydrate(cls, parent, info):
+		"""returns the TraitSettings document, reading it at most once per object"""
+		if getattr(parent, '_document', None) is None:
+			parent._document = (loaders.load(info, parent.id, 'TraitSettings') if parent.id else None) or {}
+		return parent._document
+
 	def resolve_trait(parent, info):
 		if parent.trait:
 			return parent.trait
 		elif parent.id:
-			return Trait(id=db.collection('TraitSettings').get(parent.id)['_to'])
+			return Trait(id=TraitSetting._hydrate(parent, info)['_to'])
 		else:
 			return None
 
@@ -279,9 +358,9 @@ class TraitSetting(ObjectType):
 		if parent.from_entity and parent.from_entity.id is not None:
 			return parent.from_entity
 		elif parent.id:
-			entity_id = db.collection('TraitSettings').get(parent.id).get('_from')
+			entity_id = TraitSetting._hydrate(parent, info).get('_from')
 			if entity_id.startswith('Entities/'):
-				entity_type = db.collection('Entities').get(entity_id).get('type')
+				entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 				if entity_type == 'character':
 					return Character(id=entity_id)
 				elif entity_type == 'npc':
@@ -293,9 +372,9 @@ class TraitSetting(ObjectType):
 				elif entity_type == 'faction':
 					return Faction(id=entity_id)
 			elif entity_id.startswith('Relations/'):
-				entity_id = db.collection('Relations').get(entity_id).get('_from')
+				entity_id = loaders.load(info, entity_id, 'Relations').get('_from')
 				if entity_id.startswith('Entities/'):
-					entity_type = db.collection('Entities').get(entity_id).get('type')
+					entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 					if entity_type in ['character', 'gm']:
 						return Character(id=entity_id)
 					elif entity_type == 'npc':
@@ -314,77 +393,60 @@ class TraitSetting(ObjectType):
 	def resolve_statement(parent, info):
 		if parent.statement:
 			return parent.statement
-		if parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('statement')
-		else:
-			return None
+		return TraitSetting._hydrate(parent, info).get('statement')
 
 	def resolve_notes(parent, info):
 		if parent.notes:
 			return parent.notes
-		elif parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('notes')
-		else:
-			return None
+		return TraitSetting._hydrate(parent, info).get('notes')
 
 	def resolve_rating_type(parent, info):
 		if parent.rating_type:
 			return parent.rating_type
-		if parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('rating_type')
-		else:
-			return None
+		return TraitSetting._hydrate(parent, info).get('rating_type')
 
 	def resolve_rating(parent, info):
 		if parent.rating != None:
 			return parent.rating
-		if parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('rating')
-		else:
-			return None
+		return TraitSetting._hydrate(parent, info).get('rating')
 
 	def resolve_locations_enabled(parent, info):
 		if parent.locations_enabled != None:
 			return parent.locations_enabled
-		if parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('locations_enabled')
-		else:
-			return None
-		
+		return TraitSetting._hydrate(parent, info).get('locations_enabled')
+
 	def resolve_locations_disabled(parent, info):
 		if parent.locations_disabled != None:
 			return parent.locations_disabled
-		if parent.id:
-			return db.collection('TraitSettings').get(parent.id).get('locations_disabled')
-		else:
-			return None
+		return TraitSetting._hydrate(parent, info).get('locations_disabled')
 
 	def resolve_sfxs(parent, info):
 		if parent.sfxs != None:
 			return parent.sfxs
 		if parent.id:
-			sfxs = db.collection('TraitSettings').get(parent.id).get('sfxs')
+			sfxs = TraitSetting._hydrate(parent, info).get('sfxs')
 			if sfxs is not None:
+				loaders.want(info, sfxs, 'SFXs')
 				return [SFX(id=sfx) for sfx in sfxs]
 		else:
 			return []
 
 	def resolve_sfxs_ids(parent, info):
-		if db.collection('TraitSettings').get(parent.id).get('sfxs') is not None:
-			return db.collection('TraitSettings').get(parent.id).get('sfxs')
+		return TraitSetting._hydrate(parent, info).get('sfxs')
 
 	def resolve_known_to(parent, info):
 		if parent.id:
-			characters = db.collection('TraitSettings').get(parent.id).get('known_to')
+			characters = TraitSetting._hydrate(parent, info).get('known_to')
 			if characters is None:
 				return []
+			loaders.want(info, characters, 'Entities')
 			return [Character(id=character) for character in characters]
 		else:
 			return []
 
 	def resolve_hidden(parent, info):
 		if parent.id and parent.hidden is None:
-			return db.collection('TraitSettings').get(parent.id).get('hidden')
+			return TraitSetting._hydrate(parent, info).get('hidden')
 		else:
 			return False
 
@@ -466,14 +528,12 @@ class MutateTraitSetting(Mutation):
 						trait_setting = { **trait_setting, 'rating': new_rating }
 
 						# needed query to compare "" statement with null statement
-						query = f"""FOR setting IN TraitSettings
-						FILTER setting._from == '{ entity_id }'
-						FILTER setting._to == '{ trait_setting.get('_to') }'
-						FILTER TRIM(setting.statement) == TRIM('{ trait_setting.get('statement') }')
-						RETURN setting"""
-						pockets = db.aql.execute(query)
-						if not pockets.empty():
-							to_pocket = [doc for doc in pockets][0]
+						pockets = tv.query(queries.RESOURCE_POCKETS,
+							entity=entity_id,
+							trait=trait_setting.get('_to'),
+							statement=trait_setting.get('statement'))
+						if len(pockets) > 0:
+							to_pocket = pockets[0]
 							to_pocket['rating'] = to_pocket.get('rating') + [die_type]
 							# print(f"MutateTraitSetting:\tto_pocket: { to_pocket }")
 							db.collection('TraitSettings').update(to_pocket)
@@ -515,6 +575,8 @@ class MutateTraitSetting(Mutation):
 				if trait_setting_input is not None:
 					trait_setting = {**trait_setting, **trait_setting_input}
 				db.collection('TraitSettings').update(trait_setting)
+				if trait_setting.get('_to') == 'Traits/1':
+					tv.default_settings.invalidate(trait_setting.get('_from'))
 			return MutateTraitSetting(trait=Trait(trait_setting_id=trait_setting.get('_id')))
 		except Exception as e:
 			# print(e)
@@ -571,29 +633,35 @@ class Trait(ObjectType):
 	# returns all entities that have this trait
 	entities = List(lambda: Entity)
 
+	@classmethod
+	def from_document(cls, document):
+		"""creates a generic trait from a Traits document that was already retrieved"""
+		trait = cls(id=document.get('_id'))
+		trait._trait = document
+		return trait
+
+	@classmethod
+	def from_trait_setting(cls, document):
+		"""creates an entity's trait from a TraitSettings document that was already retrieved"""
+		trait = cls(id=document.get('_to'), trait_setting_id=document.get('_id'))
+		trait._trait_setting = document
+		return trait
+
 	@classmethod
 	def _hydrate_trait(cls, parent, info):
-		if parent.id:
-			trait = db.collection('Traits').get(parent.id)
-		if parent.trait_setting_id:
-			trait_id = db.collection('TraitSettings').get(parent.trait_setting_id).get('_to')
-			trait = db.collection('Traits').get(trait_id)
-		parent.traitset_id = trait.get('traitset')
-		parent.id = trait.get('_id')
-		parent.name = trait.get('name')
-		parent.explanation = trait.get('explanation')
-		parent.location_restricted = trait.get('location_restricted')
-		parent.inheritable = trait.get('inheritable')
-	
+		"""returns the Traits document, reading it at most once per object"""
+		if getattr(parent, '_trait', None) is None:
+			if not parent.id and parent.trait_setting_id:
+				parent.id = Trait._hydrate_traitsetting(parent, info).get('_to')
+			parent._trait = (loaders.load(info, parent.id, 'Traits') if parent.id else None) or {}
+		return parent._trait
+
 	@classmethod
 	def _hydrate_traitsetting(cls, parent, info):
-		if parent.trait_setting_id:
-			traitsetting = db.collection('TraitSettings').get(parent.trait_setting_id)
-			parent.statement = traitsetting.get('statement')
-			parent.notes = traitsetting.get('notes')
-			parent.rating_type = traitsetting.get('rating_type')
-			parent.rating = traitsetting.get('rating')
-		
+		"""returns the TraitSettings document, reading it at most once per object"""
+		if getattr(parent, '_trait_setting', None) is None:
+			parent._trait_setting = (loaders.load(info, parent.trait_setting_id, 'TraitSettings') if parent.trait_setting_id else None) or {}
+		return parent._trait_setting
 
 	def resolve_id(parent, info):
 		if parent.id:
@@ -601,39 +669,35 @@ class Trait(ObjectType):
 			return parent.id
 		elif parent.trait_setting_id:
 			# Trait initialized with traitsetting
-			parent.id = db.collection('TraitSettings').get(parent.trait_setting_id).get('_to')
+			parent.id = Trait._hydrate_traitsetting(parent, info).get('_to')
 			return parent.id
 		else:
 			raise Exception("trait_setting is None 1")
 
 	def resolve_name(parent, info):
 		# print(f"resolve_name:\ttrait: '{ parent.id }'")
-		result = db.collection('Traits').get(parent.id).get('name')
-		return result
+		return Trait._hydrate_trait(parent, info).get('name')
 
 	def resolve_explanation(parent, info):
 		# print(f"resolve_explanation:\ttrait: '{ parent.id }'")
-		result = db.collection('Traits').get(parent.id).get('explanation')
-		return result
+		return Trait._hydrate_trait(parent, info).get('explanation')
 
 	def resolve_traitset_id(parent, info):
-		return db.collection('Traits').get(parent.id).get('traitset')
+		return Trait._hydrate_trait(parent, info).get('traitset')
 
 	def resolve_traitset(parent, info):
 		# print("resolving traitset for trait: ", parent.id)
-		return Traitset(id=db.collection('Traits').get(parent.id).get('traitset'))
+		return Traitset(id=Trait._hydrate_trait(parent, info).get('traitset'))
 
 	def resolve_required_traits(parent, info):
 		# print("resolve_required_traits:\ttrait: ", parent.id)
-		if parent.id is None and parent.trait_setting_id:
-			parent.id = db.collection('TraitSettings').get(parent.trait_setting_id).get('_to')
-		required_traits = db.collection('Traits').get(parent.id).get('required_traits') or []
+		required_traits = Trait._hydrate_trait(parent, info).get('required_traits') or []
+		loaders.want(info, required_traits, 'Traits')
 		return [Trait(id=trait) for trait in required_traits]
 
 	def resolve_location_restricted(parent, info):
-		if not parent.location_restricted:
-			Trait._hydrate_trait(parent, info)
-		return parent.location_restricted or db.collection('Traitsets').get(parent.traitset_id).get('location_restricted')
+		trait = Trait._hydrate_trait(parent, info)
+		return trait.get('location_restricted') or (loaders.load(info, trait.get('traitset'), 'Traitsets') or {}).get('location_restricted')
 
 	def resolve_trait_setting(parent, info):
 		if parent.trait_setting_id:
@@ -643,7 +707,7 @@ class Trait(ObjectType):
 			cursor = db.collection('TraitSettings').find({'_from': info.context.get('entity_id'), '_to': parent.id})
 			# print("cursor count: ", cursor.count())
 			if cursor.count() > 0:
-				return TraitSetting(id=[doc.get('_id') for doc in cursor][0])
+				return TraitSetting.from_document(loaders.prime(info, [doc for doc in cursor])[0])
 		else:
 			raise Exception("trait_setting is None 2")
 
@@ -651,19 +715,17 @@ class Trait(ObjectType):
 		if parent.trait_setting_id:
 			return [TraitSetting(id=parent.trait_setting_id)]
 		elif parent.id is not None and info.context.get('entity_id') is not None:
-			return [TraitSetting(id=doc.get('_id')) for doc in db.collection('TraitSettings').find({'_from': info.context.get('entity_id'), '_to': parent.id})]
+			trait_settings = loaders.prime(info, list(db.collection('TraitSettings').find({'_from': info.context.get('entity_id'), '_to': parent.id})))
+			return [TraitSetting.from_document(doc) for doc in trait_settings]
 		else:
-			return [TraitSetting(id=doc.get('_id')) for doc in db.collection('TraitSettings').find({'_to': parent.id})]
+			trait_settings = loaders.prime(info, list(db.collection('TraitSettings').find({'_to': parent.id})))
+			return [TraitSetting.from_document(doc) for doc in trait_settings]
 
 	def resolve_statement(parent, info):
 		if parent.statement:
 			return parent.statement
 		elif parent.trait_setting_id:
-			trait_setting = db.collection('TraitSettings').get(parent.trait_setting_id)
-			parent.statement = trait_setting.get('statement')
-			parent.rating_type = trait_setting.get('rating_type')
-			parent.rating = trait_setting.get('rating')
-			return parent.statement
+			return Trait._hydrate_traitsetting(parent, info).get('statement')
 		elif parent.id is not None and info.context.get('entity_id') is not None:
 			# print("resolve_statement:\ttrait: ", parent.id, "\tentity_id: ", info.context.get('entity_id'))
 			cursor = db.collection('TraitSettings').find({'_from': info.context.get('entity_id'), '_to': parent.id})
@@ -694,23 +756,13 @@ class Trait(ObjectType):
 		if parent.notes:
 			return parent.notes
 		elif parent.trait_setting_id:
-			trait_setting = db.collection('TraitSettings').get(parent.trait_setting_id)
-			parent.statement = trait_setting.get('statement')
-			parent.notes = trait_setting.get('notes')
-			parent.rating_type = trait_setting.get('rating_type')
-			parent.rating = trait_setting.get('rating')
-			return parent.notes
+			return Trait._hydrate_traitsetting(parent, info).get('notes')
 
 	def resolve_rating_type(parent, info):
 		if parent.rating_type:
 			return parent.rating_type
 		elif parent.trait_setting_id:
-			trait_setting = db.collection('TraitSettings').get(parent.trait_setting_id)
-			parent.statement = trait_setting.get('statement')
-			parent.notes = trait_setting.get('notes')
-			parent.rating_type = trait_setting.get('rating_type')
-			parent.rating = trait_setting.get('rating')
-			return parent.rating_type
+			return Trait._hydrate_traitsetting(parent, info).get('rating_type')
 		else:
 			raise Exception("trait_setting is None 4")
 
@@ -718,60 +770,43 @@ class Trait(ObjectType):
 		if parent.rating:
 			return parent.rating
 		elif parent.trait_setting_id:
-			trait_setting = db.collection('TraitSettings').get(parent.trait_setting_id)
-			parent.statement = trait_setting.get('statement')
-			parent.rating_type = trait_setting.get('rating_type')
-			parent.rating = trait_setting.get('rating')
-			return parent.rating
+			return Trait._hydrate_traitsetting(parent, info).get('rating')
 		else:
 			raise Exception("trait_setting is None 5")
 
 	def resolve_sfxs(parent, info):
 		if parent.trait_setting_id:
 			# print("resolve_sfxs:\ttrait_setting: ", parent.trait_setting_id)
-			sfxs = db.collection('TraitSettings').get(parent.trait_setting_id).get('sfxs')
+			sfxs = Trait._hydrate_traitsetting(parent, info).get('sfxs')
 			if sfxs is not None:
+				loaders.want(info, sfxs, 'SFXs')
 				return [SFX(id=sfx) for sfx in sfxs]
 		return []
 
 	def resolve_possible_sfxs(parent, info):
-		trait = db.collection('Traits').get(parent.id)
+		trait = Trait._hydrate_trait(parent, info)
+		loaders.want(info, trait.get('possible_sfxs') or [], 'SFXs')
 		return [SFX(id=sfx) for sfx in trait.get('possible_sfxs') or []]
 
 	def resolve_inheritable(parent, info):
-		return db.collection('Traits').get(parent.id).get('inheritable')
+		return Trait._hydrate_trait(parent, info).get('inheritable')
 
 	def resolve_default_trait_setting(parent, info):
 		global absolute_default_trait_setting
 		if parent.id:
-			default_trait_settings = db.collection('TraitSettings').find({'_from': parent.id, '_to': 'Traits/1'})
-			default_trait_setting = [doc for doc in default_trait_settings][0] if default_trait_settings.count() == 1 else None
-			if default_trait_setting:
-				return TraitSetting(id=default_trait_setting.get('_id'))
-			else:
-				traitset_id = db.collection('Traits').get(parent.id).get('traitset')
-				default_traitset_settings = db.collection('TraitSettings').find({'_from': traitset_id, '_to': 'Traits/1'})
-				default_trait_setting = [doc for doc in default_traitset_settings][0] if default_traitset_settings.count() == 1 else None
-				if default_trait_setting:
-					return TraitSetting(id=default_trait_setting.get('_id'))
-				else:
-					default_settings = db.collection('TraitSettings').find({'_from': 'Traits/1', '_to': 'Traits/1'})
-					default_setting = [doc for doc in default_settings][0] if default_settings.count() == 1 else None
-					if default_setting:
-						return TraitSetting(id=default_setting.get('_id'))
+			default_setting = tv.default_settings.resolve(parent.id)
 		else:
-			default_settings = db.collection('TraitSettings').find({'_from': 'Traits/1', '_to': 'Traits/1'})
-			default_setting = [doc for doc in default_settings][0] if default_settings.count() == 1 else None
-			if default_setting:
-				return TraitSetting(id=default_setting.get('_id'))
-			else:
-				return absolute_default_trait_setting
+			default_setting = tv.default_settings.global_default()
+		if default_setting:
+			return TraitSetting.from_document(default_setting)
+		elif not parent.id:
+			return absolute_default_trait_setting
 
 	def resolve_entities(parent, info):
 		if parent.trait_setting_id:
-			entity_id = db.collection('TraitSettings').get(parent.trait_setting_id).get('_from')
+			entity_id = Trait._hydrate_traitsetting(parent, info).get('_from')
 			if entity_id.startswith('Entities/'):
-				entity_type = db.collection('Entities').get(entity_id).get('type')
+				entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 				if entity_type == 'character':
 					return [Character(id=entity_id)]
 				elif entity_type == 'npc':
@@ -787,11 +822,12 @@ class Trait(ObjectType):
 		else:
 			# return all entities that have this trait
 			entities = []
-			traitsettings = db.collection('TraitSettings').find({'_to': parent.id})
+			traitsettings = list(db.collection('TraitSettings').find({'_to': parent.id}))
+			loaders.want(info, [setting.get('_from') for setting in traitsettings if setting.get('_from').startswith('Entities/')])
 			for setting in traitsettings:
 				entity_id = setting.get('_from')
 				if entity_id.startswith('Entities/'):
-					entity_type = db.collection('Entities').get(entity_id).get('type')
+					entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 					if entity_type == 'character':
 						entities.append(Character(id=entity_id))
 					elif entity_type == 'npc':
@@ -812,43 +848,31 @@ class Trait(ObjectType):
 		if not parent.trait_setting_id:
 			raise Exception("trait_setting is None 7")
 		# sub_traits = db.collection('TraitSettings').find({'_from': parent.trait_setting_id})
-		query = f"""FOR subtraits IN TraitSettings
-			FILTER subtraits._from == '{ parent.trait_setting_id }'
-			FOR trait IN Traits
-			FILTER trait._id == subtraits._to
-			SORT trait.traitset ASC, SUM(ABS(subtraits.rating)), trait._id ASC
-			RETURN subtraits"""
-		sub_traits = list(db.aql.execute(query))
-		query = f"""FOR setting IN TraitSettings
-			FILTER setting._id == '{ parent.trait_setting_id }'
-			FOR shortcut_trait IN setting.shortcut_traits OR []
-			FOR trait_setting IN TraitSettings
-			FILTER shortcut_trait == trait_setting._id
-			RETURN trait_setting"""
-		shortcuts = list(db.aql.execute(query))
-		result = sub_traits + shortcuts
-		return [Trait(id=doc.get('_to'), trait_setting_id=doc.get('_id')) for doc in result]
+		result = loaders.prime(info, lookahead.fetch(info, lookahead.SUB_TRAITS, setting=parent.trait_setting_id))
+		loaders.want(info, [doc.get('_to') for doc in result], 'Traits')
+		return [Trait.from_trait_setting(doc) for doc in result]
 
 	def resolve_possible_sub_traits(parent, info):
-		if possible_sub_traits := db.collection('Traits').get(parent.id).get('possible_sub_traits'):
+		if possible_sub_traits := Trait._hydrate_trait(parent, info).get('possible_sub_traits'):
+			loaders.want(info, possible_sub_traits, 'Traits')
 			result = []
 			for sub_trait in possible_sub_traits:
-				traitset_id = db.collection('Traits').get(sub_trait).get('traitset')
+				traitset_id = loaders.load(info, sub_trait, 'Traits').get('traitset')
 				# sub-traitsets
-				if 'subtrait' in db.collection('Traitsets').get(traitset_id).get('entity_types'):
+				if 'subtrait' in loaders.load(info, traitset_id, 'Traitsets').get('entity_types'):
 					result.append(Trait(id=sub_trait))
 				# entity traits
 				elif info.context.get('entity_id'):
 					traits = db.collection('TraitSettings').find({ '_from': info.context.get('entity_id'), '_to': sub_trait })
-					entity = db.collection('Entities').get(info.context.get('entity_id'))
-					traits = filter_trait_settings_by_location(traits, retrieve_location(entity).get('_id'))
+					entity = loaders.load(info, info.context.get('entity_id'), 'Entities')
+					traits = filter_trait_settings_by_location(traits, retrieve_location(entity, info).get('_id'))
 					for trait in traits:
-						result.append(Trait(id=trait.get('_to'), trait_setting_id=trait.get('_id')))
+						result.append(Trait.from_trait_setting(trait))
 				elif info.context.get('trait_setting_id'):
-					entity_id = db.collection('TraitSettings').get(info.context.get('trait_setting_id')).get('_from')
+					entity_id = loaders.load(info, info.context.get('trait_setting_id'), 'TraitSettings').get('_from')
 					traits = db.collection('TraitSettings').find({ '_from': entity_id, '_to': sub_trait })
 					for trait in traits:
-						result.append(Trait(id=trait.get('_to'), trait_setting_id=trait.get('_id')))
+						result.append(Trait.from_trait_setting(trait))
 				else:
 					result.append(Trait(id=sub_trait))
 			return result
@@ -882,24 +906,14 @@ class CreateTrait(Mutation):
 		})
 
 		# now also create the trait default, based on the traitset default if it exists or the absolute default
-		traitset_default = db.collection('TraitSettings').find({'_from': trait_input.get('traitset_id'), '_to': 'Traits/1'})
-		
-		if not traitset_default.empty():
-			traitset_default = [doc for doc in traitset_default][0]
+		default_setting = tv.default_settings.traitset_default(trait_input.get('traitset_id')) or tv.default_settings.global_default()
+		if default_setting:
 			db.collection('TraitSettings').insert({
 				'_from': new_trait.get('_id'),
 				'_to': 'Traits/1',
-				**{k: v for k, v in traitset_default.items() if v is not None and not k.startswith('_')}
+				**{k: v for k, v in default_setting.items() if v is not None and not k.startswith('_')}
 			})
-		else:
-			absolute_default = db.collection('TraitSettings').find({'_from': 'Traits/1', '_to': 'Traits/1'})
-			if not absolute_default.empty():
-				absolute_default = [doc for doc in absolute_default][0]
-				db.collection('TraitSettings').insert({
-					'_from': new_trait.get('_id'),
-					'_to': 'Traits/1',
-					**{k: v for k, v in absolute_default.items() if v is not None and not k.startswith('_')}
-				})
+		tv.default_settings.invalidate(new_trait.get('_id'))
 
 		return CreateTrait(trait=Trait(id=new_trait['_id']))
 
@@ -927,6 +941,7 @@ class UpdateTraitDefault(Mutation):
 					**default_settings
 				}
 			)
+		tv.default_settings.invalidate(trait_id)
 		# if default_settings.get('locations_disabled') is not None:
 		# 	db.collection('TraitSettings').update_match(
 		# 		{ '_to': trait_id },
@@ -961,6 +976,8 @@ class MutateTrait(Mutation):
 			trait = {**trait, **trait_input}
 
 		db.collection('Traits').update(trait)
+		if trait_input is not None and trait_input.get('traitset') is not None:
+			tv.default_settings.invalidate(trait.get('_id'))
 		return MutateTrait(trait=Trait(id=trait.get('_id')))
 
 class AssignTrait(Mutation):
@@ -986,76 +1003,29 @@ class AssignTrait(Mutation):
 			locations_enabled = [location_id]
 			locations_disabled = ['Entities/2']
 
-		# retrieving default trait setting
-		query = f"""FOR traitsetting IN TraitSettings
-				FILTER traitsetting._from == '{ trait_id }'
-				FILTER traitsetting._to == 'Traits/1'
-				RETURN {{
-					'_id': traitsetting._id,
-					'rating_type': traitsetting.rating_type,
-					'rating': traitsetting.rating,
-					{
-						"'locations_enabled': ['" + "', '".join(locations_enabled) + "'], 'locations_disabled':['" + "', '".join(locations_disabled) + "'],"
-						if location_id is not None else "'locations_enabled': traitsetting.locations_enabled, 'locations_disabled': traitsetting.locations_disabled,"
-					}
-					'sfxs': traitsetting.sfxs,
-					'hidden': traitsetting.hidden,
-					{
-						"'known_to': ['" + "', '".join(trait_setting_input.get('known_to', [])) + "']" if trait_setting_input.get('known_to') else ''
-					}
-				}}"""
-		cursor = db.aql.execute(query)
-		# retrieving default traitset setting
-		if cursor.empty():
-			query = f"""FOR traitsetting IN TraitSettings
-				FILTER traitsetting._from == '{ db.collection('Traits').get(trait_id)['traitset'] }'
-				FILTER traitsetting._to == 'Traits/1'
-				RETURN {{
-					'_id': traitsetting._id,
-					'rating_type': traitsetting.rating_type,
-					'rating': traitsetting.rating,
-					{
-						"'locations_enabled':['" + "', '".join(locations_enabled) + "'], 'locations_disabled':['" + "', '".join(locations_disabled) + "'],"
-						if location_id is not None else "'locations_enabled': traitsetting.locations_enabled, 'locations_disabled': traitsetting.locations_disabled,"
-					}
-					'sfxs': traitsetting.sfxs,
-					'hidden': traitsetting.hidden,
-					{
-						"'known_to': ['" + "', '".join(trait_setting_input.get('known_to', [])) + "']" if trait_setting_input.get('known_to') else ''
-					}
-				}}"""
-			cursor = db.aql.execute(query)
-		# retrieving global default setting
-		if cursor.empty():
-			query = f"""FOR traitsetting IN TraitSettings
-					FILTER traitsetting._id == 'TraitSettings/1'
-					RETURN {{
-						'_id': traitsetting._id,
-						'rating_type': traitsetting.rating_type,
-						'rating': traitsetting.rating,
-						{
-							"'locations_enabled':['" + "', '".join(locations_enabled) + "'], 'locations_disabled':['" + "', '".join(locations_disabled) + "'],"
-							if location_id is not None else "'locations_enabled': traitsetting.locations_enabled, 'locations_disabled': traitsetting.locations_disabled,"
-						}
-						'sfxs': traitsetting.sfxs,
-						'hidden': traitsetting.hidden,
-						{
-							"'known_to': ['" + "', '".join(trait_setting_input.get('known_to', [])) + "']" if trait_setting_input.get('known_to') else ''
-						}
-					}}"""
-			cursor = db.aql.execute(query)
-		if not cursor.empty():
-			traitsetting = [doc for doc in cursor][0]
-			old_traitsetting_id = traitsetting.get('_id')
+		# retrieving the default setting of the trait, its traitset or the global default
+		default_setting = tv.default_settings.resolve(trait_id)
+		if default_setting:
+			old_traitsetting_id = default_setting.get('_id')
+			traitsetting = {
+				'rating_type': default_setting.get('rating_type'),
+				'rating': default_setting.get('rating'),
+				'locations_enabled': locations_enabled if location_id is not None else default_setting.get('locations_enabled'),
+				'locations_disabled': locations_disabled if location_id is not None else default_setting.get('locations_disabled'),
+				'sfxs': default_setting.get('sfxs'),
+				'hidden': default_setting.get('hidden')
+			}
+			if trait_setting_input.get('known_to'):
+				traitsetting['known_to'] = list(trait_setting_input.get('known_to'))
 			traitsetting = {
 				**absolute_default_trait_setting,
-				**{k: v for k, v in traitsetting.items() if v is not None and not k.startswith('_')}
+				**{k: v for k, v in traitsetting.items() if v is not None}
 			}
 		else:
 			traitsetting = {
 				**absolute_default_trait_setting,
-				'locations_enabled': { locations_enabled },
-				'locations_disabled': { locations_disabled },
+				'locations_enabled': locations_enabled,
+				'locations_disabled': locations_disabled,
 			}
 
 		# use the defaults found to assign the trait
@@ -1068,12 +1038,7 @@ class AssignTrait(Mutation):
 
 		# also assign the subtraits
 		# print(f"AssignTrait:\tassigning subtraits for { new_traitsetting.get('_id') } from { old_traitsetting_id }")
-		query = f"""FOR setting IN TraitSettings
-			FILTER setting._from == '{ old_traitsetting_id }'
-			FILTER setting._to != 'Traits/1'
-			RETURN setting"""
-		cursor = db.aql.execute(query)
-		for subtrait in cursor:
+		for subtrait in tv.query(queries.SUB_TRAIT_SETTINGS, setting=old_traitsetting_id):
 			db.collection('TraitSettings').insert({
 				'_from': new_traitsetting.get('_id'),
 				'_to': subtrait.get('_to'),
@@ -1134,25 +1099,11 @@ class AssignSubTrait(Mutation):
 		traitset = db.collection('Traitsets').get(traitset_id)
 
 		if 'subtrait' in traitset.get('entity_types'):
-			default_trait_setting = absolute_default_trait_setting
-
-			default_trait_settings = db.collection('TraitSettings').find({ '_from': subtrait_id, '_to': 'Traits/1' })
-			if not default_trait_settings.empty():
-				default_trait_setting = [doc for doc in default_trait_settings][0]
+			default_trait_setting = tv.default_settings.resolve(subtrait_id)
+			if default_trait_setting:
 				default_trait_setting = {k: v for k, v in default_trait_setting.items() if not k.startswith('_')}
 			else:
-				traitset_id = db.collection('Traits').get(subtrait_id).get('traitset')
-				traitset_settings = db.collection('TraitsetSettings').find({ '_from': traitset_id, '_to': 'Traits/1' })
-				if not traitset_settings.empty():
-					default_trait_setting = [doc for doc in traitset_settings][0]
-					default_trait_setting = {k: v for k, v in default_trait_setting.items() if not k.startswith('_')}
-				else:
-					default_trait_settings = db.collection('TraitSettings').find({ '_from': 'Traits/1', '_to': 'Traits/1' })
-					if not default_trait_settings.empty():
-						default_trait_setting = [doc for doc in default_trait_settings][0]
-						default_trait_setting = {k: v for k, v in default_trait_setting.items() if not k.startswith('_')}
-					else:
-						default_trait_setting = absolute_default_trait_setting
+				default_trait_setting = absolute_default_trait_setting
 
 			if db.collection('TraitSettings').find({
 				'_from': trait_setting_id,
@@ -1297,6 +1248,7 @@ class DeleteTrait(Mutation):
 			settings = db.collection('TraitSettings').find({'_from': trait_id})
 			for setting in settings:
 				db.collection('TraitSettings').delete(setting.get('_id'))
+			tv.default_settings.invalidate(trait_id)
 			return DeleteTrait(success=True)
 		except Exception as e:
 			return DeleteTrait(success=False, error=str(e))
@@ -1320,52 +1272,36 @@ class Traitset(ObjectType):
 	score = Int()
 	traitset_setting = Field(lambda: TraitsetSetting)
 
+	@classmethod
+	def from_document(cls, document):
+		"""creates a traitset from a Traitsets document that was already retrieved"""
+		traitset = cls(id=document.get('_id'))
+		traitset._document = document
+		return traitset
+
 	@classmethod
 	def _hydrate(cls, parent, info):
-		traitset = db.collection('Traitsets').get(parent.id)
-		parent.key = traitset.get('_key')
-		parent.name = traitset.get('name')
-		parent.explainer = traitset.get('explainer')
-		parent.entity_types = traitset.get('entity_types')
-		parent.location_restricted = traitset.get('location_restricted')
-		parent.limit = traitset.get('limit')
-		parent.order = traitset.get('order')
-		parent.duplicates = traitset.get('duplicates')
+		"""returns the Traitsets document, reading it at most once per object"""
+		if getattr(parent, '_document', None) is None:
+			parent._document = (loaders.load(info, parent.id, 'Traitsets') if parent.id else None) or {}
+		return parent._document
 
 	def resolve_key(parent, info):
-		if not parent.key:
-			Traitset._hydrate(parent, info)
-		if parent.key:
-			return parent.key
-		return db.collection('Traitsets').get(parent.id).get('_key')
+		return parent.key or Traitset._hydrate(parent, info).get('_key')
 
 	def resolve_name(parent, info):
-		if not parent.name:
-			Traitset._hydrate(parent, info)
-		if parent.name:
-			return parent.name
-		return db.collection('Traitsets').get(parent.id).get('name')
+		return parent.name or Traitset._hydrate(parent, info).get('name')
 
 	def resolve_explainer(parent, info):
-		if not parent.explainer:
-			Traitset._hydrate(parent, info)
-		if parent.explainer:
-			return parent.explainer
-		return db.collection('Traitsets').get(parent.id).get('explainer')
+		return parent.explainer or Traitset._hydrate(parent, info).get('explainer')
 
 	def resolve_entity_types(parent, info):
-		if not parent.entity_types:
-			Traitset._hydrate(parent, info)
-		if parent.entity_types:
-			return parent.entity_types
-		return db.collection('Traitsets').get(parent.id).get('entity_types')
+		return parent.entity_types or Traitset._hydrate(parent, info).get('entity_types')
 
 	def resolve_location_restricted(parent, info):
-		if not parent.location_restricted:
-			Traitset._hydrate(parent, info)
 		if parent.location_restricted is not None:
 			return parent.location_restricted
-		return db.collection('Traitsets').get(parent.id).get('location_restricted') or False
+		return Traitset._hydrate(parent, info).get('location_restricted') or False
 
 	def resolve_limit(parent, info):
 		if info.context.get('entity_id') is not None:
@@ -1374,64 +1310,26 @@ class Traitset(ObjectType):
 			for traitset_setting in traitset_settings:
 				if traitset_setting.get('dicepool_limit') is not None:
 					return traitset_setting.get('dicepool_limit')
-		if parent.limit:
-			return parent.limit
-		return db.collection('Traitsets').get(parent.id).get('dicepool_limit')
+		return parent.limit or Traitset._hydrate(parent, info).get('dicepool_limit')
 
 	def resolve_order(parent, info):
-		if parent.order:
-			return parent.order
-		return db.collection('Traitsets').get(parent.id).get('order')
+		return parent.order or Traitset._hydrate(parent, info).get('order')
 
 	def resolve_duplicates(parent, info):
-		if parent.duplicates:
-			return parent.duplicates
-		return db.collection('Traitsets').get(parent.id).get('duplicates')
+		return parent.duplicates or Traitset._hydrate(parent, info).get('duplicates')
 
 	def resolve_traits(parent, info):
 		if parent.traits:
 			return parent.traits
 		elif info.context.get('entity_id') is not None and info.context.get('entity_id').startswith('Entities/'):
 			# print(f"Traitset.resolve_traits:\tentity_id: { info.context.get('entity_id') }")
-			entity = db.collection('Entities').get(info.context.get('entity_id'))
+			entity = loaders.load(info, info.context.get('entity_id'), 'Entities')
 
 			# traits for location are inherited, so special query
 			if entity is not None and entity.get('type') == 'location':
-				if info.context.get('sorting') is not None and info.context.get('sorting') == 'NAME':
-					sorting = "SORT t.name, setting.statement, MAX(setting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], setting.rating_type, true) ASC"
-				else:
-					sorting = "SORT MAX(setting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], setting.rating_type, true) ASC, t.name, setting.statement"
-				# print(f"Traitset.resolve_traits:\treturning location traits")
-				query = f"""FOR location IN Entities
-					FILTER location._id == '{ info.context.get('entity_id') }'
-					FILTER location.type == 'location'
-					LET direct_traits = (
-						FOR setting IN TraitSettings
-							FILTER location._id == setting._from
-						FOR t IN Traits
-							FILTER setting._to == t._id
-							FILTER t.traitset == '{ parent.id }'
-						{ sorting }
-						RETURN setting
-					)
-					LET parent_locations = (
-						FOR v, e, p IN 0..20 OUTBOUND location._id Relations
-						FILTER p.edges[*].type ALL == 'super'
-						RETURN v._id
-					)
-					LET hierarchies = APPEND([location._id], parent_locations)
-					LET inherited_traits = (
-						FOR entity IN hierarchies
-							FOR trait, traitsetting IN OUTBOUND entity TraitSettings
-							FILTER trait.traitset == '{ parent.id }'
-							FILTER trait.inheritable == true
-							COLLECT traitId = traitsetting._to INTO traitsettings
-							RETURN traitsettings[0].traitsetting
-					)
-					FOR trait IN UNIQUE(APPEND(direct_traits, inherited_traits))
-					RETURN trait"""
-				cursor = db.aql.execute(query)
-				return [Trait(id=trait['_to'], trait_setting_id=trait['_id']) for trait in cursor]
+				trait_settings = loaders.prime(info, lookahead.fetch(info, lookahead.location_traitset_traits(info.context.get('sorting')), location=entity.get('_id'), traitset=parent.id))
+				loaders.want(info, [trait['_to'] for trait in trait_settings], 'Traits')
+				return [Trait.from_trait_setting(trait) for trait in trait_settings]
 
 
 
@@ -1439,56 +1337,17 @@ class Traitset(ObjectType):
 			# traits for non-location entities
 			elif entity is not None and entity.get('type') != 'location':
 
-				location = retrieve_location(entity)
+				location = retrieve_location(entity, info)
 				location_id = location.get('_id')
 
-				# direct traits
-				if info.context.get('sorting') is not None and info.context.get('sorting') == 'NAME':
-					sorting = "SORT trait.name, setting.statement, MAX(setting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], setting.rating_type, true) ASC"
-				else:
-					sorting = "SORT MAX(setting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], setting.rating_type, true) ASC, trait.name"
-				
-				query = f"""FOR setting IN TraitSettings
-					FILTER setting._from == '{ entity.get('_id') }'
-					FOR trait IN Traits
-						FILTER setting._to == trait._id
-						FILTER trait.traitset == '{ parent.id }'
-					{ sorting }
-					RETURN setting"""
-				trait_settings = [doc for doc in db.aql.execute(query)]
-				# print(f"Traitset.resolve_traits:\tentity trait_settings: { trait_settings }")
-				result = filter_trait_settings_by_location(trait_settings, location_id)
-
-				# inherited traits
-				if info.context.get('sorting') is not None and info.context.get('sorting') == 'NAME':
-					sorting = "SORT t.name, traitsettings[0].traitsetting.statement, MAX(traitsettings[0].traitsetting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], traitsettings[0].traitsetting.rating_type, true) ASC"
-				else:
-					sorting = "SORT MAX(traitsettings[0].traitsetting.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], traitsettings[0].traitsetting.rating_type, true) ASC, t.name"
-				inherited_traits = [ts.get('inherited_as') for ts in trait_settings if ts.get('inherited_as') is not None]
-				# print(f"Traitset.resolve_traits:\tinherited_traits: { inherited_traits }")
-				query = f"""LET archetypes = (
-						FOR v, e, p IN 0..5 OUTBOUND '{ entity.get('_id') }' Relations
-						FILTER p.edges[*].type ALL == 'archetype'
-						FILTER v._id != '{ entity.get('_id') }'
-						RETURN v._id
-					)
-					FOR entity IN archetypes
-						FOR trait, traitsetting IN OUTBOUND entity TraitSettings
-						FILTER traitsetting._id NOT IN { inherited_traits }
-						COLLECT traitId = traitsetting._to INTO traitsettings
-					FOR t IN Traits
-						FILTER traitsettings[0].traitsetting._to == t._id
-						FILTER t.traitset == '{ parent.id }'
-						{ sorting }
-					FOR ts IN traitsettings
-					RETURN ts.traitsetting"""
-				# print(f"Traitset.resolve_traits:\tarchetype query: { query }")
-				trait_settings = [doc for doc in db.aql.execute(query)]
-				# print(f"Traitset.resolve_traits:\tarchetype trait_settings: { trait_settings }")
-				trait_settings = filter_trait_settings_by_location(trait_settings, location_id)
-				result = result + trait_settings
-
-				return [Trait(id=trait_setting.get('_to'), trait_setting_id=trait_setting.get('_id')) for trait_setting in result]
+				# direct and inherited traits
+				traits = lookahead.fetch(info, lookahead.entity_traitset_traits(info.context.get('sorting')), entity=entity.get('_id'), traitset=parent.id)[0]
+				result = filter_trait_settings_by_location(traits['direct'], location_id)
+				trait_settings = filter_trait_settings_by_location(traits['archetype'], location_id)
+				result = loaders.prime(info, result + trait_settings)
+				loaders.want(info, [trait_setting.get('_to') for trait_setting in result], 'Traits')
+
+				return [Trait.from_trait_setting(trait_setting) for trait_setting in result]
 
 
 			# neither entity nor relation
@@ -1498,14 +1357,7 @@ class Traitset(ObjectType):
 
 		# traits for relations
 		elif info.context.get('entity_id') is not None and info.context.get('entity_id').startswith('Relations/'):
-			query = f"""FOR traitsettings IN TraitSettings
-				FILTER traitsettings._from == '{ info.context.get('entity_id') }'
-			FOR trait IN Traits
-				FILTER traitsettings._to == trait._id
-				FILTER trait.traitset == '{ parent.id }'
-			SORT TO_NUMBER(SUBSTRING(MAX(traitsettings.rating), 1)) DESC, trait.name
-			RETURN {{ id: trait._id, setting: traitsettings._id }}"""
-			cursor = db.aql.execute(query)
+			cursor = tv.query(queries.RELATION_TRAITSET_TRAITS, relation=info.context.get('entity_id'), traitset=parent.id)
 			return [Trait(
 				id=doc['id'],
 				trait_setting_id=doc['setting']
@@ -1513,64 +1365,25 @@ class Traitset(ObjectType):
 
 		elif info.context.get('entity_id') is None:
 			# print(f"Traitset.resolve_traits:\tResolving traits for traitsets irrespective of entity")
-			query = f"""FOR trait IN Traits
-				FILTER trait.traitset == '{ parent.id }'
-				SORT trait.name ASC
-				RETURN {{ 'id': trait._id, 'name': trait.name }}"""
-			cursor = db.aql.execute(query)
-			if not cursor.empty():
-				result = [
-					Trait(id=doc['id'], name=doc['name'])
-					for doc in cursor
-				]
-			else:
-				result = []
-			return result
+			traits = loaders.prime(info, lookahead.fetch(info, lookahead.TRAITSET_TRAITS, traitset=parent.id))
+			return [Trait.from_document(trait) for trait in traits]
 
 	def resolve_sfxs(parent, info):
-		sfxs = db.collection('Traitsets').get(parent.id).get('sfxs')
+		sfxs = Traitset._hydrate(parent, info).get('sfxs')
 		if sfxs is not None:
+			loaders.want(info, sfxs, 'SFXs')
 			return [SFX(id=sfx) for sfx in sfxs]
 		else:
 			return []
 
 	def resolve_default_trait_setting(parent, info):
-		setting = db.collection('TraitSettings').find({'_from': parent.id, '_to': 'Traits/1'})
-		if setting.count() == 0:
-			# print("resolve_default_trait_setting:\tdefault trait")
-			setting = db.collection('TraitSettings').find({'_from': 'Traits/1', '_to': 'Traits/1'})
-		return [TraitSetting(id=setting['_id']) for setting in setting][0]
+		setting = tv.default_settings.traitset_default(parent.id) or tv.default_settings.global_default()
+		return TraitSetting.from_document(setting)
 
 	def resolve_score(parent, info):
 		logging.warning("traitset\tscore:\tusing deprecated function")
 		if info.context.get('entity_id') is not None:
-			set_query = f"""LET Scores = [
-					{{ 'rating': -5, 'score': -8 }},
-					{{ 'rating': -4, 'score': -5 }},
-					{{ 'rating': -3, 'score': -3 }},
-					{{ 'rating': -2, 'score': -2 }},
-					{{ 'rating': -1, 'score': -1 }},
-					{{ 'rating': 1, 'score': 1 }},
-					{{ 'rating': 2, 'score': 2 }},
-					{{ 'rating': 3, 'score': 3 }},
-					{{ 'rating': 4, 'score': 5 }},
-					{{ 'rating': 5, 'score': 8 }}
-				]
-				RETURN SUM(
-					FOR setting IN TraitSettings
-						FILTER '{ info.context.get('entity_id') }' == setting._from
-					FOR trait IN Traits
-						FILTER setting._to == trait._id
-						FILTER trait.traitset == '{ parent.id }'
-						FOR r IN setting.rating
-							FOR s IN Scores
-								FILTER r == s.rating
-								RETURN s.score
-				)"""
-			# print("(005) using query: ", set_query)
-			set_cursor = db.aql.execute(set_query)
-			result = [doc for doc in set_cursor][0]
-			return result
+			return tv.query(queries.TRAITSET_SCORE, entity=info.context.get('entity_id'), traitset=parent.id)[0]
 		return 0
 
 	def resolve_traitset_setting(parent, info):
@@ -1693,6 +1506,7 @@ class UpdateTraitsetDefault(Mutation):
 				for default_trait_setting in default_trait_settings:
 					default_trait_setting['hidden'] = default_settings.hidden
 					db.collection('TraitSettings').update(default_trait_setting)
+				tv.default_settings.invalidate(trait.get('_id'))
 		# print("Updating default trait setting for traitset: ", traitset_id, " to: ", default_settings)
 		if db.collection('TraitSettings').find({'_from': traitset_id, '_to': 'Traits/1'}).count() == 1:
 			db.collection('TraitSettings').update_match(
@@ -1719,6 +1533,7 @@ class UpdateTraitsetDefault(Mutation):
 					'hidden': default_settings.hidden
 				}
 			)
+		tv.default_settings.invalidate(traitset_id)
 		# if default_settings.get('rating') is not None and default_settings.get('rating_type') is not None:
 		# 	traits = db.collection('Traits').find({'traitset': traitset_id})
 		# 	for trait in traits:
@@ -1741,9 +1556,9 @@ class TraitsetSetting(ObjectType):
 	sfxs = List(lambda: SFX)
 
 	def resolve_entity(parent, info):
-		entity_id = db.collection('TraitsetSettings').get(parent.id).get('_from')
+		entity_id = loaders.load(info, parent.id, 'TraitsetSettings').get('_from')
 		if entity_id.startswith('Entities/'):
-			entity = db.collection('Entities').get(entity_id)
+			entity = loaders.load(info, entity_id, 'Entities')
 			if entity.get('type') == 'character':
 				return Character(id=entity_id)
 			elif entity.get('type') == 'npc':
@@ -1758,15 +1573,16 @@ class TraitsetSetting(ObjectType):
 			return None
 	
 	def resolve_traitset(parent, info):
-		traitset_id = db.collection('TraitsetSettings').get(parent.id).get('_to')
+		traitset_id = loaders.load(info, parent.id, 'TraitsetSettings').get('_to')
 		return Traitset(id=traitset_id)
 
 	def resolve_limit(parent, info):
-		return db.collection('TraitsetSettings').get(parent.id).get('dicepool_limit')
+		return loaders.load(info, parent.id, 'TraitsetSettings').get('dicepool_limit')
 
 	def resolve_sfxs(parent, info):
-		sfx_ids = db.collection('TraitsetSettings').get(parent.id).get('sfxs')
+		sfx_ids = loaders.load(info, parent.id, 'TraitsetSettings').get('sfxs')
 		if sfx_ids is not None:
+			loaders.want(info, sfx_ids, 'SFXs')
 			return [SFX(id=sfx) for sfx in sfx_ids]
 		else:
 			return []
@@ -1810,19 +1626,52 @@ class UpdateTraitsetSetting(Mutation):
 			return UpdateTraitsetSetting(traitset_setting=TraitsetSetting(id=traitset_setting_id))
 
 
+class PortraitSize(ObjectType):
+	"""one stored file of a portrait, as measured when it was written"""
+	size = String(required=True)
+	width = Int()
+	height = Int()
+	bytes = Int()
+	format = String()
+	hash = String()
+	file = String()
+	url = String(prefix=String(required=False))
+
+	def resolve_url(parent, info, prefix="/media/"):
+		"""the address of the file in the content addressed store, it never changes"""
+		return f"{prefix}{parent.file}"
+
+class PortraitSource(ObjectType):
+	"""the responsive files of a portrait in one format, from wide to narrow"""
+	path = String(required=True)
+	format = String(required=True)
+	type = String()
+	files = List(PortraitSize)
+	srcset = String(prefix=String(required=False))
+
+	def resolve_type(parent, info):
+		return f"image/{parent.format}"
+
+	def resolve_srcset(parent, info, prefix="/media/"):
+		return ", ".join(f"{prefix}{file.file} {file.width}w" for file in parent.files or [])
+
 class Portrait(ObjectType):
 	path = String(required=True)
 	ext = String(required=True)
 	size = String(required=True)
 	width = Int()
 	height = Int()
+	sizes = List(PortraitSize)
+	sources = List(PortraitSource)
 
 	@classmethod
 	def _hydrate_size(cls, parent, info):
-		from PIL import Image
-		img = Image.open(f"{app.config['UPLOAD_FOLDER']}/{parent.path}/{parent.size}{parent.ext}")
-		parent.width = img.width
-		parent.height = img.height
+		"""takes the dimensions from the manifest, they stay None for a size the manifest doesn't have"""
+		for size in parent.sizes or []:
+			if size.size == parent.size:
+				parent.width = size.width
+				parent.height = size.height
+				return
 
 	def resolve_width(parent, info):
 		if parent.width is None:
@@ -1876,7 +1725,7 @@ class Entity(Interface):
 		if hasattr(parent, '_hydrated'):
 			return
 		
-		entity = db.collection('Entities').get(parent.id)
+		entity = loaders.load(info, parent.id, 'Entities')
 		parent.key = entity.get('_key')
 		parent.name = entity.get('name')
 		parent.description = entity.get('description')
@@ -1901,113 +1750,73 @@ class Entity(Interface):
 		return parent.description
 
 	def resolve_image(parent, info):
-		# print("Resolving image: ", parent.key)
+		"""looks the image up in the portrait manifest, the region's image first, then the entity's, then its archetype's"""
 		if not parent.key:
 			Entity._hydrate_entity(parent, info)
 		
+		location_key = None
 		try:
-			location_key = None
 			if not parent.location:
 				if parent.entity_type != 'location':
-					location_id = db.collection('Entities').get(parent.id).get('location')
-					location = db.collection('Entities').get(location_id)
-					if location.get('type') != 'location':
+					location_id = loaders.load(info, parent.id, 'Entities').get('location')
+					location = loaders.load(info, location_id, 'Entities') if location_id else None
+					if location is not None and location.get('type') != 'location':
 						# if following
 						location_id = location.get('location')
-						location = db.collection('Entities').get(location_id)
-					parent.location = Location(id=location.get('_id'), key=location.get('_key'))
-					location_hierarchy = tv.retrieve_hierarchy(parent.location.id)
-					if len(location_hierarchy) > 1:
-						location_key = location_hierarchy[-2].get('_key')
+						location = loaders.load(info, location_id, 'Entities') if location_id else None
+					if location is not None:
+						parent.location = Location(id=location.get('_id'), key=location.get('_key'))
+						location_hierarchy = tv.location_hierarchy.ancestors(parent.location.id)
+						if len(location_hierarchy) > 1:
+							location_key = location_hierarchy[-2].split('/')[-1]
 				else: # if location
-					parents = [rel.get('_to') for rel in db.collection('Relations').find({ '_from': parent.id, 'type': 'super' })]
-					if len(parents) > 0:
-						location_id = parents[0]
-						location = db.collection('Entities').get(location_id)
+					location_hierarchy = tv.location_hierarchy.ancestors(parent.id)
+					if len(location_hierarchy) > 1:
+						location = loaders.load(info, location_hierarchy[1], 'Entities')
 						parent.location = Location(id=location.get('_id'), key=location.get('_key'))
-						location_hierarchy = tv.retrieve_hierarchy(parent.location.id)
+						location_hierarchy = tv.location_hierarchy.ancestors(parent.location.id)
 						if len(location_hierarchy) > 1:
-							location_key = location_hierarchy[-2].get('_key')
-			if parent.entity_type != 'location' and location_key is not None and os.path.isdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}"):
-				# print("Resolving image 2: ", parent.key, "/", location_key)
-				old_file = os.listdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}")[0]
-				ext = os.path.splitext(old_file)[1]
-				save_image(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}/{old_file}", parent.key, location_key)
-				os.remove(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}/{old_file}")
-				os.rmdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}")
-				os.rmdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}")
-				# return f"{parent.key}/{location_key}/original{ext}"
-				return Portrait(path=f"{parent.key}/{location_key}/", size="original", ext=ext)
-			elif parent.entity_type != 'location' and location_key is not None and os.path.isdir(f"{app.config['UPLOAD_FOLDER']}/{parent.key}/{location_key}"):
-				# print("Resolving image 3: ", parent.key, "/", location_key)
-				for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-					if os.path.isfile(f"{app.config['UPLOAD_FOLDER']}/{parent.key}/{location_key}/original{ext}"):
-						# return f"{parent.key}/{location_key}/original{ext}"
-						return Portrait(path=f"{parent.key}/{location_key}/", size="original", ext=ext)
-			elif os.path.isdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}"):
-				# print("Resolving image 4: ", parent.key)
-				old_file = os.listdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}")[0]
-				ext = os.path.splitext(old_file)[1]
-				# os.rename(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{old_file}", f"{app.config['IMAGEN_FOLDER']}/{parent.key}/original.jpg")
-				save_image(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{old_file}", parent.key)
-				os.remove(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{old_file}")
-				os.rmdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}")
-				# return f"{parent.key}/original{ext}"
-				return Portrait(path=f"{parent.key}/", size="original", ext=ext)
-			else:
-				# print("Resolving image 5: ", parent.key)
-				for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-					if os.path.isfile(f"{app.config['UPLOAD_FOLDER']}/{parent.key}/original{ext}"):
-						# return f"{parent.key}/original{ext}"
-						return Portrait(path=f"{parent.key}/", size="original", ext=ext)
-					elif parent.entity_type == 'location' and parent.location is not None:
-						if os.path.isfile(f"{app.config['UPLOAD_FOLDER']}/{parent.location.key}/original{ext}"):
-							# return f"{parent.location.key}/original{ext}"
-							return Portrait(path=f"{parent.location.key}/", size="original", ext=ext)
-						else:
-							return None
-					elif (archetype_id := db.collection('Entities').get(parent.id).get('archetype_id')) is not None:
-						archetype = db.collection('Entities').get(archetype_id)
-						if os.path.isfile(f"{app.config['UPLOAD_FOLDER']}/{archetype.get('_key')}/{location_key}/original{ext}"):
-							# return f"{archetype.get('_key')}/{location_key}/original{ext}"
-							return Portrait(path=f"{archetype.get('_key')}/{location_key}/", size="original", ext=ext)
-						elif os.path.isfile(f"{app.config['UPLOAD_FOLDER']}/{archetype.get('_key')}/original{ext}"):
-							# return f"{archetype.get('_key')}/original{ext}"
-							return Portrait(path=f"{archetype.get('_key')}/", size="original", ext=ext)
-						else:
-							return None
-					else:
-						return None
+							location_key = location_hierarchy[-2].split('/')[-1]
 		except Exception as e:
-			# print(f"Entity\tresolve_image:\t{e}")
+			logging.warning(f"entity\tresolve_image:\tcould not look up the location of { parent.id }: { e }")
+
+		def portrait(entity_key, region_key=None):
+			found = portraits.get(entity_key, region_key)
+			if found is None:
+				return None
+			path = f"{entity_key}/{region_key}/" if region_key else f"{entity_key}/"
+			sizes = [PortraitSize(size=size, **metadata) for size, metadata in found[1].items()]
+			sources = [
+				PortraitSource(path=path, format=format, files=[PortraitSize(size=size, **metadata) for size, metadata in files.items()])
+				for format, files in found[2].items()
+			]
+			return Portrait(path=path, size="original", ext=found[0], sizes=sizes, sources=sources)
+
+		if parent.entity_type != 'location' and location_key is not None and (image := portrait(parent.key, location_key)) is not None:
+			return image
+		if (image := portrait(parent.key)) is not None:
+			return image
+		if parent.entity_type == 'location':
+			return portrait(parent.location.key) if parent.location is not None else None
+		try:
+			archetype_id = loaders.load(info, parent.id, 'Entities').get('archetype_id')
+			archetype = loaders.load(info, archetype_id, 'Entities') if archetype_id is not None else None
+		except Exception as e:
+			logging.warning(f"entity\tresolve_image:\tcould not look up the archetype of { parent.id }: { e }")
+			return None
+		if archetype is None:
 			return None
+		if location_key is not None and (image := portrait(archetype.get('_key'), location_key)) is not None:
+			return image
+		return portrait(archetype.get('_key'))
 
 	def resolve_imagening(parent, info):
 		"""prevents the user from running image generation while busy"""
-		return db.collection('Entities').get(parent.id).get('imagening')
+		return loaders.load(info, parent.id, 'Entities').get('imagening')
 
 	def resolve_imagened(parent, info):
-		""""""
-		if parent.entity_type is None:
-			entity = db.collection('Entities').get(parent.id)
-			parent.entity_type = entity.get('type')
-			parent.name = entity.get('name') if entity.get('name') is not None else parent.name
-			parent.description = entity.get('description') if entity.get('description') is not None else parent.description
-		if parent.entity_type == 'character':
-			if parent.location is None:
-				location_id = db.collection('Entities').get(parent.id).get('location')
-				location = db.collection('Entities').get(location_id)
-				if location.get('type') != 'location':
-					# if following
-					location_id = location.get('location')
-					location = db.collection('Entities').get(location_id)
-				parent.location = Location(id=location.get('_id'), name=location.get('name'), description=location.get('description'))
-				location_hierarchy = tv.retrieve_hierarchy(parent.location.id)
-				if len(location_hierarchy) > 1:
-					location_key = location_hierarchy[-2].get('_key')
-				if os.path.isdir(f"{app.config['IMAGEN_FOLDER']}/{parent.key}/{location_key}"):
-					return True
-		return False
+		"""whether a generated image was stored for the entity, set when its image job is done"""
+		return bool(loaders.load(info, parent.id, 'Entities').get('imagened'))
 
 	def resolve_entity_type(parent, info):
 		Entity._hydrate_entity(parent, info)
@@ -2019,27 +1828,8 @@ class Entity(Interface):
 			Entity._hydrate_entity(parent, info)
 		
 		# retrieve all populated sets
-		query = f"""LET archetypes = (
-						FOR v, e, p IN 0..5 OUTBOUND '{ parent.id }' Relations
-						FILTER p.edges[*].type ALL == 'archetype'
-						RETURN v._id
-					)
-					FOR entity IN archetypes
-						FOR trait, traitsetting IN OUTBOUND entity TraitSettings
-						COLLECT traitId = traitsetting._to INTO traitsettings
-					FOR t IN Traits
-						FILTER traitsettings[0].traitsetting._to == t._id
-					FOR set IN Traitsets
-						FILTER t.traitset == set._id
-						FILTER '{ parent.entity_type }' IN set.entity_types
-					SORT set.order ASC
-					RETURN MERGE(
-						traitsettings[0].traitsetting,
-						{{ traitset: t.traitset }}
-					)"""
-		cursor = db.aql.execute(query)
-		trait_settings = [doc for doc in cursor]
-		location = retrieve_location(db.collection('Entities').get(parent.id))
+		trait_settings = lookahead.fetch(info, lookahead.ENTITY_TRAIT_SETTINGS, entity=parent.id, entity_type=parent.entity_type)
+		location = retrieve_location(loaders.load(info, parent.id, 'Entities'), info)
 		# print(f"Entity\n\tresolve_traitsets:\n\t\tretrieved {len(trait_settings)} trait settings, now filtering by location { location.get('name') }")
 		filtered_trait_settings = filter_trait_settings_by_location(trait_settings, location.get('_id'))
 		unique_traitsets = []
@@ -2050,20 +1840,10 @@ class Entity(Interface):
 		# print(f"Entity\n\tresolve_traitsets:\n\t\tfiltered to {len(unique_traitsets)} trait sets")
 		
 		# retrieve unpopulated sets, filtered by location
-		query = f"""FOR set IN Traitsets
-						FILTER '{ parent.entity_type }' IN set.entity_types
-						FILTER set._id NOT IN {unique_traitsets}
-					FOR default IN TraitSettings
-						FILTER set._id == default._from
-						FILTER default._to == 'Traits/1'
-					SORT set.order ASC
-					RETURN {{
-						traitset: set._id,
-						locations_enabled: default.locations_enabled,
-						locations_disabled: default.locations_disabled
-					}}"""
-		cursor = db.aql.execute(query)
-		unpopulated_traitsets = [doc for doc in cursor]
+		unpopulated_traitsets = [
+			doc for doc in lookahead.fetch(info, lookahead.TRAITSET_DEFAULTS, entity_type=parent.entity_type)
+			if doc.get('traitset') not in unique_traitsets
+		]
 		# print(f"Entity\n\tresolve_traitsets:\n\t\tretrieved {len(unpopulated_traitsets)} unpopulated trait sets, now filtering by location { location.get('name') }")
 		filtered_unpopulated_traitsets = filter_trait_settings_by_location(unpopulated_traitsets, location.get('_id'))
 		for traitsetting in filtered_unpopulated_traitsets:
@@ -2071,21 +1851,22 @@ class Entity(Interface):
 			if traitset_id not in unique_traitsets:
 				unique_traitsets.append(traitset_id)
 		# print(f"Entity\n\tresolve_traitsets:\n\t\tfiltered to {len(unique_traitsets)} trait sets")
+		loaders.want(info, unique_traitsets, 'Traitsets')
 		return [Traitset(id=traitset) for traitset in unique_traitsets]		
 
 	def resolve_location(parent, info):
-		entity = db.collection('Entities').get(parent.id)
-		location = retrieve_location(entity)
+		entity = loaders.load(info, parent.id, 'Entities')
+		location = retrieve_location(entity, info)
 		if location.get('_id') is not None:
 			return Location(id=location.get('_id'))
 		else:
 			return None
 
 	def resolve_following(parent, info):
-		loc_id = db.collection('Entities').get(parent.id).get('location')
+		loc_id = loaders.load(info, parent.id, 'Entities').get('location')
 		if not loc_id:
 			return None
-		loc = db.collection('Entities').get(loc_id)
+		loc = loaders.load(info, loc_id, 'Entities')
 		if loc.get('type') == 'asset':
 			return Asset(id=loc.get('_id'))
 		elif loc.get('type') == 'character':
@@ -2099,7 +1880,7 @@ class Entity(Interface):
 
 	def resolve_followers(parent, info):
 		result = []
-		following_entities = db.collection('Entities').find({'location': parent.id})
+		following_entities = loaders.prime(info, list(db.collection('Entities').find({'location': parent.id})))
 		for entity in following_entities:
 			if entity.get('type') == 'character':
 				result.append(Character(id=entity.get('_id')))
@@ -2112,18 +1893,9 @@ class Entity(Interface):
 		return result
 
 	def resolve_relations(parent, info):
-		query = f"""FOR relation IN Relations
-			FILTER relation._from == '{parent.id}'
-			FOR e IN Entities
-			FILTER e._id == relation._to
-			FILTER relation.type == 'relation'
-			SORT relation.favorite DESC, POSITION(['character', 'npc', 'asset', 'faction', 'location'], e.type, true) ASC, e.name ASC
-
-			RETURN relation"""
-		# print("query: ", query)
-		cursor = db.aql.execute(query)
+		relations = loaders.prime(info, tv.query(queries.ENTITY_RELATIONS, entity=parent.id))
 		# relations = db.collection('Relations').find({'_from': parent.id})
-		return [Relation(id=doc['_id']) for doc in cursor]
+		return [Relation(id=doc['_id']) for doc in relations]
 
 	def resolve_favorite(parent, info):
 		Entity._hydrate_entity(parent, info)
@@ -2134,9 +1906,9 @@ class Entity(Interface):
 		return parent.is_archetype
 
 	def resolve_archetype(parent, info):
-		archetype_id = db.collection('Entities').get(parent.id).get('archetype_id')
+		archetype_id = loaders.load(info, parent.id, 'Entities').get('archetype_id')
 		if archetype_id is not None:
-			archetype = db.collection('Entities').get(archetype_id)
+			archetype = loaders.load(info, archetype_id, 'Entities')
 			if archetype.get('type') == 'character':
 				return Character(id=archetype_id)
 			elif archetype.get('type') == 'npc':
@@ -2157,11 +1929,12 @@ class Entity(Interface):
 		return parent.hidden or False
 
 	def resolve_known_to(parent, info):
-		known_to = db.collection('Entities').get(parent.id).get('known_to', [])
+		known_to = loaders.load(info, parent.id, 'Entities').get('known_to', [])
+		loaders.want(info, known_to, 'Entities')
 		result = []
 		changed = False
 		for entity_id in known_to:
-			entity = db.collection('Entities').get(entity_id)
+			entity = loaders.load(info, entity_id, 'Entities')
 			if entity is None:
 				known_to.remove(entity_id)
 				changed = True
@@ -2236,11 +2009,12 @@ class UpdateEntity(Mutation):
 		is_archetype = Boolean()
 		archetype_id = ID()
 		active = Boolean()
+		table = String()
 		entity_input = EntityInput()
 
 	entity = Field(lambda: Entity)
 
-	def mutate(root, info, key, entity_input=None, name=None, location=None, following=None, favorite=None, is_archetype=None, archetype_id=None, active=None):
+	def mutate(root, info, key, entity_input=None, name=None, location=None, following=None, favorite=None, is_archetype=None, archetype_id=None, active=None, table=None):
 		entity = db.collection('Entities').get(key)
 		# print(f"UpdateEntity.mutate:\t0\tparameters:\t{ locals() }")
 		changes = {}
@@ -2263,6 +2037,7 @@ class UpdateEntity(Mutation):
 			zone = [doc for doc in zones][0]
 			zone['_to'] = location or entity_input.pop('location')
 			db.collection('Relations').update(zone)
+			tv.location_hierarchy.add_relation(zone)
 		# print(f"UpdateEntity.mutate:\t3\tchanges: { changes }")
 		if following is not None:
 			changes['location'] = following
@@ -2274,6 +2049,9 @@ class UpdateEntity(Mutation):
 			changes['archetype_id'] = archetype_id
 		if active is not None:
 			changes['active'] = active
+		if active:
+			# the table the entity is active at, so a new session or scene only resets that table's entities
+			changes['table'] = table or tv.Tables.DEFAULT
 		# print(f"UpdateEntity.mutate:\t4\tchanges: { changes }")
 		if entity_input is not None and entity_input.get('show_to') is not None:
 			known_to = set(entity.get('known_to', []) + entity_input.pop('show_to', []))
@@ -2356,22 +2134,7 @@ class InstantiateArchetype(Mutation):
 		# 	db.collection('TraitSettings').insert(new_traitsetting)
 
 		# copy traitset settings
-		query = f"""FOR entity IN Entities
-						FILTER entity._id == 'Entities/{ key }'
-
-					LET traitsetsettings = (
-						FOR ts IN TraitsetSettings
-						FILTER entity._id == ts._from
-						RETURN ts
-					)
-
-					RETURN {{
-						entity: entity,
-						traitsetsettings: traitsetsettings
-					}}"""
-		cursor = db.aql.execute(query)
-		result = [doc for doc in cursor][0]
-		for traitsetsetting in result.get('traitsetsettings'):
+		for traitsetsetting in tv.query(queries.ENTITY_TRAITSET_SETTINGS, entity=f"Entities/{ key }"):
 			new_traitsetsetting = {key: value for key, value in traitsetsetting.items() if not key.startswith('_')}
 			new_traitsetsetting['_from'] = new_entity.get('_id')
 			new_traitsetsetting['_to'] = traitsetsetting.get('_to')
@@ -2445,9 +2208,11 @@ class DeleteEntity(Mutation):
 
 			# remove the image folder
 			shutil.rmtree(f"{app.config['UPLOAD_FOLDER']}/{current_entity.get('_key')}", ignore_errors=True)
+			portraits.remove(current_entity.get('_key'))
 
 			# now we can delete the entity
 			db.collection('Entities').delete(entity_id)
+			tv.location_hierarchy.remove_location(entity_id)
 
 		try:
 			current_entity = db.collection('Entities').get(key)
@@ -2464,6 +2229,7 @@ class DeleteEntity(Mutation):
 
 				# update zones
 				db.collection('Relations').update_match({'_to': current_entity.get('_id'), 'type': 'super'}, {'_to': parent})
+				tv.location_hierarchy.move_zones(current_entity.get('_id'), parent)
 
 				# remove location
 				remove_entity(current_entity.get('_id'))
@@ -2471,11 +2237,7 @@ class DeleteEntity(Mutation):
 			# if the entity is a location and all entities in that location need removing
 			elif current_entity.get('type') == 'location' and rmtree:
 				# first get all zones of this location
-				query = f"""FOR v, e, p IN 0..100 INBOUND "{ current_entity.get('_id') }" Relations
-					FILTER p.edges[*].type ALL == 'super'
-					RETURN v"""
-				cursor = db.aql.execute(query)
-				zones = [doc for doc in cursor]
+				zones = tv.query(queries.LOCATION_SUBTREE, location=current_entity.get('_id'))
 
 				# then remove all entities in those zones
 				for zone in zones:
@@ -2503,8 +2265,9 @@ class Character(ObjectType):
 		interfaces = (Entity,)
 
 	entity_type = 'character'
+	table = String() # the table `available` refers to, unless it's given one
 	score = Int()
-	available = Boolean()
+	available = Boolean(table=String(required=False))
 	pp = Int()
 
 	def resolve_score(parent, info):
@@ -2512,38 +2275,17 @@ class Character(ObjectType):
 		# this function throws a 'get_location' error and isn't used in the UI any more.
 		logging.error("character\tscore:\tusing deprecated function")
 
-		set_query = f"""LET Scores = [
-				{{ 'rating': 'd4', 'score': 1 }},
-				{{ 'rating': 'd6', 'score': 2 }},
-				{{ 'rating': 'd8', 'score': 3 }},
-				{{ 'rating': 'd10', 'score': 4 }},
-				{{ 'rating': 'd12', 'score': 5 }}
-			]
-			RETURN SUM(
-				FOR setting IN TraitSettings
-					FILTER '{ parent.id }' == setting._from
-				FOR trait IN Traits
-					FILTER setting._to == trait._id
-					FILTER trait.traitset != 'Traitsets/906379'
-					FOR r IN setting.rating
-						FOR s IN Scores
-							FILTER r == s.rating
-							RETURN s.score
-			)"""
-		# print("(005) using query: ", set_query)
-		set_cursor = db.aql.execute(set_query)
-		result = [doc for doc in set_cursor][0]
-		return result
+		return tv.query(queries.CHARACTER_SCORE, character=parent.id)[0]
 
-	def resolve_available(parent, info):
+	def resolve_available(parent, info, table=None):
 		if parent.key is None:
-			parent.key = db.collection('Entities').get(parent.id).get('_key')
+			parent.key = loaders.load(info, parent.id, 'Entities').get('_key')
 		if parent.is_archetype is None:
-			parent.is_archetype = db.collection('Entities').get(parent.id).get('is_archetype')
-		return parent.key not in [d['character'] for d in session_characters] and not parent.is_archetype
+			parent.is_archetype = loaders.load(info, parent.id, 'Entities').get('is_archetype')
+		return parent.key not in tv.tables[table or parent.table].current().characters and not parent.is_archetype
 
 	def resolve_pp(parent, info):
-		return db.collection('Entities').get(parent.id).get('pp')
+		return loaders.load(info, parent.id, 'Entities').get('pp')
 
 class CharacterInput(InputObjectType):
 	name = String(required=False)
@@ -2629,59 +2371,42 @@ class Location(ObjectType):
 		if parent.id == 'Entities/2':
 			# the root location
 			return None
-		query = f"""FOR r IN Relations
-			FILTER r._from == '{ parent.id }'
-			FILTER r.type == 'super'
-			RETURN r._to"""
-		cursor = db.aql.execute(query)
-		parent_id = [doc for doc in cursor]
+		parent_id = lookahead.fetch(info, lookahead.LOCATION_PARENT, location=parent.id)
 		if len(parent_id) == 1:
 			return Location(id=parent_id[0])
 		else:
 			raise Exception("location has none or multiple parents: ", parent_id)
 
 	def resolve_parents(parent, info):
-		query = f"""FOR v, e, p IN 0..100 OUTBOUND "{ parent.id }" Relations
-			FILTER p.edges[*].type ALL == 'super'
-			RETURN v._id"""
-		cursor = db.aql.execute(query)
-		return [Location(id=doc) for doc in cursor]
+		parents = lookahead.fetch(info, lookahead.LOCATION_PARENTS, location=parent.id)
+		loaders.want(info, parents, 'Entities')
+		return [Location(id=doc) for doc in parents]
 
 	def resolve_flavortext(parent, info):
-		return db.collection('Entities').get(parent.id).get('description')
+		return loaders.load(info, parent.id, 'Entities').get('description')
 
 	def resolve_zones(parent, info):
 		# zones = db.collection('Entities').find({'type': 'location', 'location': parent.id})
-		query = f"""FOR r IN Relations
-			FILTER r._to == '{ parent.id }'
-			FILTER r.type == 'super'
-			RETURN r._from"""
-		zones = db.aql.execute(query)
+		zones = lookahead.fetch(info, lookahead.LOCATION_ZONES, location=parent.id)
+		loaders.want(info, zones, 'Entities')
 		return [Location(id=loc) for loc in zones]
 
 	def resolve_transversables(parent, info):
-		query = f"""FOR r IN Relations
-			FILTER r._from == '{ parent.id }'
-			FILTER r.type == 'transversable'
-			RETURN r._to"""
-		transversables = db.aql.execute(query)
+		transversables = lookahead.fetch(info, lookahead.LOCATION_TRANSVERSABLES, location=parent.id)
+		loaders.want(info, transversables, 'Entities')
 		return [Location(id=loc) for loc in transversables]
 
 	def resolve_entities(parent, info):
-		query = f"""FOR e IN Entities
-					FILTER e.location == '{ parent.id }'
-					SORT POSITION(['character', 'npc', 'asset', 'faction'], e.type, true) ASC, e.name ASC
-					RETURN e"""
-		cursor = db.aql.execute(query)
-		entities = [doc for doc in cursor]
+		entities = tv.query(queries.LOCATION_ENTITIES, location=parent.id)
 		# check if any entities are being followed
 		new_entities = []
 		for entity in entities:
 			if entity.get('location') is not None and entity.get('type') != 'location':
-				followers = db.collection('Entities').find({'location': entity.get('_id')})
+				followers = loaders.prime(info, list(db.collection('Entities').find({'location': entity.get('_id')})))
 				for follower in followers:
 					new_entities.append(follower)
 		entities.extend(new_entities)
+		loaders.prime(info, entities)
 
 		# active entities need to be added to each other's known_to list if not already there
 		active_entities = [entity for entity in entities if entity.get('active')]
@@ -2738,6 +2463,12 @@ class CreateLocation(Mutation):
 				'_to': location_input.get('location'),
 				'type': 'super'
 			})
+			tv.location_hierarchy.add_relation({
+				'_id': parent_location.get('_id'),
+				'_from': new_location.get('_id'),
+				'_to': location_input.get('location'),
+				'type': 'super'
+			})
 			return CreateLocation(location=Location(id=new_location['_id']))
 		else:
 			raise Exception("No location input provided")
@@ -2770,8 +2501,8 @@ class Relation(ObjectType):
 	favorite = Boolean()
 
 	def resolve_from_entity(parent, info):
-		entity_id = db.collection('Relations').get(parent.id).get('_from')
-		entity_type = db.collection('Entities').get(entity_id).get('type')
+		entity_id = loaders.load(info, parent.id, 'Relations').get('_from')
+		entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 		# print("Relation.resolve_entity:\tentity_id: ", entity_id, "\tentity_type: ", entity_type)
 		if entity_type == 'location':
 			return Location(id=entity_id)
@@ -2787,8 +2518,8 @@ class Relation(ObjectType):
 			raise Exception("unknown entity type: ", entity_id)
 
 	def resolve_to_entity(parent, info):
-		entity_id = db.collection('Relations').get(parent.id).get('_to')
-		entity_type = db.collection('Entities').get(entity_id).get('type')
+		entity_id = loaders.load(info, parent.id, 'Relations').get('_to')
+		entity_type = loaders.load(info, entity_id, 'Entities').get('type')
 		# print("Relation.resolve_entity:\tentity_id: ", entity_id, "\tentity_type: ", entity_type)
 		if entity_type == 'location':
 			return Location(id=entity_id)
@@ -2804,23 +2535,18 @@ class Relation(ObjectType):
 			raise Exception("unknown entity type: ", entity_id)
 
 	def resolve_traitsets(parent, info):
-		traitset_ids = [ts.get('_id') for ts in db.collection('Traitsets').all() if 'relation' in ts.get('entity_types')]
+		traitset_ids = [ts.get('_id') for ts in tv.query(queries.TRAITSETS_OF_TYPE, entity_type='relation')]
 		result = []
 		for traitset_id in traitset_ids:
-			query = f"""FOR traitsetting IN TraitSettings
-FILTER traitsetting._from == '{parent.id}'
-FOR trait IN Traits
-FILTER traitsetting._to == trait._id
-FILTER trait.traitset == '{traitset_id}'
-RETURN {{ trait: trait._id, traitsetting: traitsetting._id }}"""
-			# print("Relation.resolve_traitsets:\tquery: ", query)
-			cursor = db.aql.execute(query)
-			traits = [Trait(id=doc.get('trait'), trait_setting_id=doc.get('traitsetting')) for doc in cursor]
+			docs = tv.query(queries.RELATION_TRAIT_SETTINGS, relation=parent.id, traitset=traitset_id)
+			loaders.want(info, [doc.get('trait') for doc in docs], 'Traits')
+			loaders.want(info, [doc.get('traitsetting') for doc in docs], 'TraitSettings')
+			traits = [Trait(id=doc.get('trait'), trait_setting_id=doc.get('traitsetting')) for doc in docs]
 			result.append(Traitset(id=traitset_id, traits=traits))
 		return result
 
 	def resolve_favorite(parent, info):
-		return db.collection('Relations').get(parent.id).get('favorite')
+		return loaders.load(info, parent.id, 'Relations').get('favorite')
 
 class CreateRelation(Mutation):
 	class Arguments:
@@ -2833,7 +2559,8 @@ class CreateRelation(Mutation):
 
 	def mutate(root, info, from_id=None, to_id=None, type=None):
 		if db.collection('Relations').find({'_from': from_id, '_to': to_id, 'type': type}).empty():
-			db.collection('Relations').insert({ '_from': from_id, '_to': to_id, 'type': type, 'favorite': False })
+			relation = db.collection('Relations').insert({ '_from': from_id, '_to': to_id, 'type': type, 'favorite': False })
+			tv.location_hierarchy.add_relation({ '_id': relation.get('_id'), '_from': from_id, '_to': to_id, 'type': type })
 			return CreateRelation(success=True)
 		else:
 			errorMessage = f"relation already exists, from: { from_id }, to: { to_id }"
@@ -2863,56 +2590,67 @@ class DeleteRelation(Mutation):
 		for trait in traits:
 			db.collection('TraitSettings').delete(trait.get('_id'))
 		db.collection('Relations').delete(relation_id)
+		tv.location_hierarchy.remove_relation(relation_id)
 		return DeleteRelation(success=True)
 
 
 
 class Query(ObjectType):
-	session = Field(Session)
-	def resolve_session(parent, info):
-		return Session()
+	session = Field(Session, table=String(required=False))
+
+	odds = Field(Odds, dice=List(String, required=True), result_limit=Int(required=False), effect_limit=Int(required=False))
+	def resolve_odds(parent, info, dice, result_limit=2, effect_limit=1):
+		return Odds(dice=dice, result_limit=result_limit, effect_limit=effect_limit)
+
+	image_job = Field(ImageJob, id=ID(required=True))
+	def resolve_image_job(parent, info, id):
+		job = jobs.image_jobs.get(id)
+		return ImageJob(**job.status()) if job is not None else None
 
-	characters = List(Character, key=ID(required=False), available=Boolean(required=False))
-	def resolve_characters(parent, info, key=None, available=None):
+	def resolve_session(parent, info, table=None):
+		return Session(table=table)
+
+	characters = List(Character, key=ID(required=False), available=Boolean(required=False), table=String(required=False))
+	def resolve_characters(parent, info, key=None, available=None, table=None):
 		# print("character resolver, for key: ", key)
 		if not key and not available:
-			cursor = db.collection('Entities').find({'type': 'character'})
-			return [Character(id = doc['_id']) for doc in cursor]
+			cursor = loaders.prime(info, list(db.collection('Entities').find({'type': 'character'})))
+			return [Character(id = doc['_id'], table = table) for doc in cursor]
 		elif not key and available:
-			cursor = db.collection('Entities').get_many([char.get('character') for char in session_characters])
-			return [Character(id = doc['_id']) for doc in cursor]
+			cursor = loaders.load_many(info, list(tv.tables[table].current().characters), 'Entities')
+			return [Character(id = doc['_id'], table = table) for doc in cursor]
 		else:
-			character = db.collection('Entities').get(key)
+			character = loaders.load(info, key, 'Entities')
 			info.context['entity_id'] = character['_id']
-			return [Character(id = character['_id'])]
+			return [Character(id = character['_id'], table = table)]
 
 	factions = List(Faction, key=ID(required=False))
 	def resolve_factions(parent, info, key=None):
 		if not key:
-			cursor = db.collection('Entities').find({'type': 'faction'})
+			cursor = loaders.prime(info, list(db.collection('Entities').find({'type': 'faction'})))
 			return [Faction(id = doc['_id']) for doc in cursor]
 		else:
-			faction = db.collection('Entities').get(key)
+			faction = loaders.load(info, key, 'Entities')
 			info.context['entity_id'] = faction['_id']
 			return [Faction(id = faction['_id'])]
 
 	assets = List(Asset, key=ID(required=False))
 	def resolve_assets(parent, info, key=None):
 		if not key:
-			cursor = db.collection('Entities').find({'type': 'asset'})
+			cursor = loaders.prime(info, list(db.collection('Entities').find({'type': 'asset'})))
 			return [Asset(id = doc['_id']) for doc in cursor]
 		else:
-			asset = db.collection('Entities').get(key)
+			asset = loaders.load(info, key, 'Entities')
 			info.context['entity_id'] = asset['_id']
 			return [Asset(id = asset['_id'])]
 
 	npcs = List(NPC, key=ID(required=False))
 	def resolve_npcs(parent, info, key=None):
 		if not key:
-			cursor = db.collection('Entities').find({'type': 'npc'})
+			cursor = loaders.prime(info, list(db.collection('Entities').find({'type': 'npc'})))
 			return [NPC(id = doc['_id']) for doc in cursor]
 		else:
-			npc = db.collection('Entities').get(key)
+			npc = loaders.load(info, key, 'Entities')
 			info.context['entity_id'] = npc['_id']
 			return [NPC(id = npc['_id'])]
 
@@ -2923,13 +2661,8 @@ class Query(ObjectType):
 	def resolve_entities(parent, info, key=None, entity_type=None, search=None):
 		# print("entity resolver, for key: ", key)
 		if not key and not entity_type:
-			query = "FOR e IN Entities "
-			if search:
-				query += "FILTER LOWER(e.name) LIKE LOWER('%" + search + "%') "
-			query += """SORT POSITION(['character', 'npc', 'asset', 'faction', 'location'], e.type, true) ASC, e.name ASC
-			RETURN e"""
-			cursor = db.aql.execute(query)
-			entities = [doc for doc in cursor]
+			entities = loaders.prime(info, tv.query(queries.SEARCH_ENTITIES, search=search or None))
+			lookahead.plan_entities(info, entities)
 			result = []
 			for entity in entities:
 				if entity['type'] in ['character', 'gm']:
@@ -2944,13 +2677,8 @@ class Query(ObjectType):
 					result.append(Location(id = entity['_id']))
 			return result
 		elif not key and entity_type is not None:
-			query = "FOR e IN Entities "
-			if search:
-				query += "FILTER LOWER(e.name) LIKE LOWER('%" + search + "%') "
-			query += f"""FILTER e.type == '{ entity_type }'
-			SORT e.name ASC
-			RETURN e"""
-			entities = db.aql.execute(query)
+			entities = loaders.prime(info, tv.query(queries.SEARCH_ENTITIES_OF_TYPE, search=search or None, entity_type=entity_type))
+			lookahead.plan_entities(info, entities)
 			if entity_type  in ['character', 'gm']:
 				return [Character(id = doc['_id']) for doc in entities]
 			elif entity_type == 'location':
@@ -2964,8 +2692,9 @@ class Query(ObjectType):
 			else:
 				raise Exception("unknown entity type: ", entity_type)
 		elif key is not None:
-			entity = db.collection('Entities').get(key)
+			entity = loaders.load(info, key, 'Entities')
 			info.context['entity_id'] = entity['_id']
+			lookahead.plan_entities(info, [entity])
 			if entity.get('type') in ['character', 'gm']:
 				return [Character(id = entity['_id'])]
 			elif entity.get('type') == 'location':
@@ -2987,31 +2716,22 @@ class Query(ObjectType):
 		entity_type=String(required=False),
 		sorting=String(required=False))
 	def resolve_traitsets(parent, info, traitset_id=None, entity_id=None, entity_type=None, sorting=None):
-		query = None
+		traitsets = None
 		if traitset_id is not None:
 			if entity_id is not None:
 				info.context['entity_id'] = entity_id
 			if sorting is not None:
 				info.context['sorting'] = sorting
+			lookahead.plan_traitsets(info, [traitset_id])
 			return [Traitset(id=traitset_id)]
 		elif entity_type is not None:
 			# return all traitsets of a given entity type
-			query = f"""FOR traitsets IN Traitsets
-				FILTER '{ entity_type }' IN traitsets.entity_types
-				SORT traitsets.order ASC
-				RETURN {{ 'id': traitsets._id, 'name': traitsets.name }}"""
-			# print("retrieving traitsets for entity type: ", query)
+			traitsets = loaders.prime(info, tv.query(queries.TRAITSETS_OF_TYPE, entity_type=entity_type))
 		else:
-			query = f"""FOR traitsets IN Traitsets
-				SORT traitsets.order ASC, traitsets.name ASC
-				RETURN {{ 'id': traitsets._id, 'name': traitsets.name }}"""
-		if query is not None:
-			cursor = db.aql.execute(query)
-			result = [
-				Traitset(id = doc['id'], name = doc['name'])
-				for doc in cursor
-			]
-			return result
+			traitsets = loaders.prime(info, tv.query(queries.ALL_TRAITSETS))
+		if traitsets is not None:
+			lookahead.plan_traitsets(info, [traitset.get('_id') for traitset in traitsets])
+			return [Traitset.from_document(traitset) for traitset in traitsets]
 		else:
 			return []
 
@@ -3028,81 +2748,46 @@ class Query(ObjectType):
 		# retrieve a specific trait
 		if trait_setting_id is not None:
 			info.context['trait_setting_id'] = trait_setting_id
-			trait_setting = db.collection('TraitSettings').get(trait_setting_id)
+			trait_setting = loaders.load(info, trait_setting_id, 'TraitSettings')
 			# check if it is a default trait
 			if trait_setting is not None and trait_id is not None and trait_setting.get('_from') == trait_id and trait_setting.get('_to') == 'Traits/1':
 				return [Trait(id=trait_id, trait_setting_id=trait_setting_id, trait_setting=trait_setting)]
-			return [Trait(id=trait_setting.get('_to'), trait_setting_id=trait_setting_id, trait_setting=trait_setting)]
+			lookahead.plan_traits(info, [], [trait_setting])
+			return [Trait.from_trait_setting(trait_setting)]
 
 		# retrieve a trait for an entity
 		elif trait_id is not None and entity_id is not None:
-			trait_setting = db.collection('TraitSettings').find({'_from': entity_id, '_to': trait_id})
-			return [Trait(id=trait_id, trait_setting_id = doc.get('_id')) for doc in trait_setting]
+			trait_settings = loaders.prime(info, tv.query(queries.TRAIT_SETTINGS_BETWEEN, entity=entity_id, trait=trait_id))
+			lookahead.plan_traits(info, [], trait_settings)
+			return [Trait.from_trait_setting(doc) for doc in trait_settings]
 
 		# retrieve a generic trait
 		elif trait_id is not None:
+			lookahead.plan_traits(info, loaders.load_many(info, [trait_id], 'Traits'))
 			return [Trait(id=trait_id)]
 
 		# retrieve all traits of a traitset
 		elif traitset_id is not None and entity_id is None:
 			# return all traits of a given traitset
-			cursor = db.collection('Traits').find({'traitset': traitset_id})
-			return [Trait(id=doc.get('_id')) for doc in cursor]
+			cursor = loaders.prime(info, lookahead.fetch(info, lookahead.TRAITSET_TRAITS, traitset=traitset_id))
+			lookahead.plan_traits(info, cursor)
+			return [Trait.from_document(doc) for doc in cursor]
 
 		# return all of an entity's traits of a given traitset
 		elif traitset_id is not None and entity_id is not None and potential_only is False:
-			query = f"""FOR traitsetting IN TraitSettings
-			FILTER traitsetting._from == '{ entity_id }'
-			FOR trait IN Traits
-			FILTER traitsetting._to == trait._id
-			FILTER trait.traitset == '{ traitset_id }'
-			RETURN trait
-			"""
-			set_cursor = db.aql.execute(query)
-			return [Trait(id=doc.get('_id')) for doc in set_cursor]
+			set_cursor = loaders.prime(info, tv.query(queries.ENTITY_TRAITSET_TRAIT_DOCUMENTS, entity=entity_id, traitset=traitset_id))
+			lookahead.plan_traits(info, set_cursor)
+			return [Trait.from_document(doc) for doc in set_cursor]
 
 		# return all of a traitset's traits that the given entity doesn't already have
 		# and only ones they can learn (this needs work like the traitset traits logic)
 		elif traitset_id is not None and entity_id is not None and potential_only is True:
-			traitset = db.collection('Traitsets').get(traitset_id)
-			query = f"""LET entity_id = '{ entity_id }'
-
-				LET location = (
-					FOR e IN Entities
-					FILTER e._id == entity_id
-					RETURN e.location
-				)
-				LET location_hierarchy = (
-					FOR v, e, p IN 0..20 OUTBOUND location[0] Relations
-					FILTER p.edges[*].type ALL == 'super'
-					RETURN v._id
-				)
-
-				LET traitset_id = '{ traitset_id }'
-
-				LET connected_traits = (
-					FOR traitsetting IN TraitSettings
-						FILTER traitsetting._from == entity_id
-						RETURN traitsetting._to
-				)
-
-				FOR t IN Traits
-					FILTER t.traitset == traitset_id
-					{"FILTER t._id NOT IN connected_traits" if traitset.get('duplicates') == False else ""}
-					FILTER LENGTH(t.required_traits) == 0
-						OR LENGTH(MINUS(t.required_traits, connected_traits)) == 0
-
-				LET default_trait = (
-					FOR def_setting IN TraitSettings
-						FILTER def_setting._from == t._id
-						FILTER def_setting._to == 'Traits/1'
-						RETURN def_setting
-				)
-
-					SORT t.name, TO_NUMBER(SUBSTRING(default_trait[0].rating[0], 1)) ASC
-					RETURN {{ location_hierarchy: location_hierarchy, trait: t, default: default_trait }}"""
-			# print("resolve_traits\tpotential traits query\n", query)
-			cursor = db.aql.execute(query)
+			traitset = loaders.load(info, traitset_id, 'Traitsets')
+			cursor = tv.query(queries.POTENTIAL_TRAITS,
+				entity=entity_id,
+				traitset=traitset_id,
+				unique=traitset.get('duplicates') == False)
+			lookahead.plan_traits(info, loaders.prime(info, [doc['trait'] for doc in cursor]))
 			result = []
 			for doc in cursor:
 				if doc['default']:
@@ -3131,20 +2816,18 @@ class Query(ObjectType):
 			# return [Trait(id=doc['_id']) for doc in set_cursor]
 		else:
 			# return all traits
-			cursor = db.collection('Traits').all()
-			return [Trait(id=doc.get('_id')) for doc in cursor]
+			cursor = loaders.prime(info, list(db.collection('Traits').all()))
+			lookahead.plan_traits(info, cursor)
+			return [Trait.from_document(doc) for doc in cursor]
 
 	sfxs = List(SFX, sfx_id=ID(required=False))
 	def resolve_sfxs(parent, info, sfx_id=None):
 		if sfx_id is not None:
-			doc = db.collection('SFXs').get(sfx_id)
+			doc = loaders.load(info, sfx_id, 'SFXs')
 			return [SFX(id=sfx_id, name = doc['name'], description = doc['description'])]
 		else:
 			# cursor = db.collection('SFXs').all()
-			query = f"""FOR sfx IN SFXs
-				SORT sfx.name ASC
-				RETURN sfx"""
-			cursor = db.aql.execute(query)
+			cursor = tv.query(queries.ALL_SFXS)
 			return [
 				SFX(id=doc['_id'], name = doc['name'], description = doc['description'])
 				for doc in cursor
@@ -3154,14 +2837,17 @@ class Query(ObjectType):
 	def resolve_locations(parent, info, key=None):
 		# print("Query.resolve_locations:\tkey: ", key)
 		if not key:
-			cursor = db.collection('Entities').find({'type': 'location'})
+			cursor = loaders.prime(info, list(db.collection('Entities').find({'type': 'location'})))
+			lookahead.plan_locations(info, cursor)
 			return [
 				Location(id=doc['_id'], name = doc['name'])
 				for doc in cursor
 			]
 		else:
-			location_id = db.collection('Entities').get(key).get('_id')
+			location = loaders.load(info, key, 'Entities')
+			location_id = location.get('_id')
 			info.context['entity_id'] = location_id
+			lookahead.plan_locations(info, [location])
 			result = Location(id=location_id)
 			# print(result)
 			return [result]
@@ -3172,7 +2858,7 @@ class Query(ObjectType):
 		if relation_id is not None:
 			return [Relation(id=relation_id)]
 		else:
-			cursor = db.collection('Relations').all()
+			cursor = loaders.prime(info, list(db.collection('Relations').all()))
 			return [
 				Relation(id=doc['_id'])
 				for doc in cursor
@@ -3220,6 +2906,7 @@ app.add_url_rule('/graphql', view_func=GraphQLView.as_view(
 	'graphql',
 	schema=schema,
 	graphiql=True,
+	middleware=[loaders.LoaderMiddleware()],
 ))
 
 
@@ -3234,85 +2921,38 @@ def filter_trait_settings_by_location(trait_settings, location_id):
 	Returns:
 		list: Filtered list of trait settings.
 	"""
-	result = []
-	# print(f"filter_trait_settings_by_location:\n\ttrait_settings: {[trait_setting.get('_id') for trait_setting in trait_settings]}")
-	hierarchy_ids = [location.get('_id') for location in tv.retrieve_hierarchy(location_id)]
-	# print(f"filter_trait_settings_by_location:\n\thierarchy_ids: {hierarchy_ids}")
-	for trait_setting in trait_settings:
-		# print(f"filter_trait_settings_by_location:\n\tProcessing trait setting: {trait_setting.get('_id')}")
-		determined = False
-		for location_id in hierarchy_ids:
-			# print(f"filter_trait_settings_by_location:\n\tChecking location_id {location_id} in enabled locations")
-			if trait_setting.get('locations_enabled') and location_id in trait_setting.get('locations_enabled'):
-				result.append(trait_setting)
-				determined = True
-				# print("filter_trait_settings_by_location:\n\tTrait setting enabled at this location, added to result")
-				break
-			elif trait_setting.get('locations_disabled') and location_id in trait_setting.get('locations_disabled'):
-				determined = True
-				# print("filter_trait_settings_by_location:\n\tTrait setting disabled at this location, not added")
-				break
-		if not determined and trait_setting.get('_to') is not None and trait_setting.get('_to') != 'Traits/1':
-			# print("filter_trait_settings_by_location:\n\tChecking default trait setting")
-			default_trait_setting = db.collection('TraitSettings').find({ '_from': trait_setting.get('_to'), '_to': 'Traits/1' })
-			if not default_trait_setting.empty():
-				default_trait_setting = [doc for doc in default_trait_setting][0]
-				for location_id in hierarchy_ids:
-					# print(f"filter_trait_settings_by_location:\n\tChecking location_id {location_id} in default enabled locations")
-					if default_trait_setting.get('locations_enabled') and location_id in default_trait_setting.get('locations_enabled'):
-						result.append(trait_setting)
-						determined = True
-						# print("filter_trait_settings_by_location:\n\tDefault trait setting enabled, added to result")
-						break
-					elif default_trait_setting.get('locations_disabled') and location_id in default_trait_setting.get('locations_disabled'):
-						determined = True
-						# print("filter_trait_settings_by_location:\n\tDefault trait setting disabled, not added")
-						break
-		if not determined and trait_setting.get('_from') is not None and not trait_setting.get('_from').startswith('Traitsets'):
-			# print("filter_trait_settings_by_location:\n\tChecking traitset default setting")
-			traitset_id = db.collection('Traits').get(trait_setting.get('_to')).get('traitset')
-			traitset_setting = db.collection('TraitSettings').find({ '_from': traitset_id, '_to': 'Traits/1' })
-			if not traitset_setting.empty():
-				traitset_setting = [doc for doc in traitset_setting][0]
-				for location_id in hierarchy_ids:
-					# print(f"filter_trait_settings_by_location:\n\tChecking location_id {location_id} in traitset enabled locations")
-					if traitset_setting.get('locations_enabled') and location_id in traitset_setting.get('locations_enabled'):
-						result.append(trait_setting)
-						determined = True
-						# print("filter_trait_settings_by_location:\n\tTraitset default setting enabled, added to result")
-						break
-					elif traitset_setting.get('locations_disabled') and location_id in traitset_setting.get('locations_disabled'):
-						determined = True
-						# print("filter_trait_settings_by_location:\n\tTraitset default setting disabled, not added")
-						break
-		if not determined:
-			result.append(trait_setting)
-			# print("filter_trait_settings_by_location:\n\tNo location restrictions, added trait setting to result")
-			# print(f"filter_trait_settings_by_location:\n\tNo location restrictions, ignoring trait setting")
-			# break
-	return result
+	trait_settings = list(trait_settings)
+	if len(trait_settings) == 0:
+		return []
+	return tv.LocationEnablement(tv.location_hierarchy.ancestors(location_id)).filter(trait_settings)
 
-def retrieve_location(entity):
+def retrieve_location(entity, info=None):
 	"""
 	Retrieves the location of an entity.
 
 	Args:
 		entity (dict): The entity to retrieve the location for.
+		info: GraphQL resolve info, if given the request's loaders are used.
 
 	Returns:
 		dict: The location of the entity.
 	"""
+	def get_entity(entity_id):
+		if info is not None:
+			return loaders.load(info, entity_id, 'Entities')
+		return db.collection('Entities').get(entity_id)
+
 	if entity.get('type') != 'location':
 		# if the entity is not a location, get the location from its location attribute
 		location_id = entity.get('location')
-		location = db.collection('Entities').get(location_id)
+		location = get_entity(location_id)
 		if location.get('type') != 'location':
 			# if the location is not a location, get the location from its location attribute
-			location = retrieve_location(location)
+			location = retrieve_location(location, info)
 	elif entity.get('_id') != 'Entities/2':
 		# if the entity is a location, get the location from its super relations
 		location_id = [doc.get('_to') for doc in db.collection('Relations').find({ '_from': entity.get('_id'), 'type': 'super' })][0]
-		location = db.collection('Entities').get(location_id)
+		location = get_entity(location_id)
 	else:
 		location = entity
 	return location
@@ -3332,9 +2972,7 @@ class ADB:
 
 @app.route("/gmc")
 def get_gmcs():
-	adb = ADB()
-	result = adb.db.fetch_list("FOR e in Entities FILTER e.type == 'GMC' RETURN e")
-	return result
+	return tv.query(queries.ENTITIES_OF_TYPE, entity_type='GMC')
 
 @app.route("/entity/<id>")
 def get_gmc(id):
@@ -3344,15 +2982,11 @@ def get_gmc(id):
 
 @app.route("/entities/<type>")
 def get_entities(type):
-	adb = ADB()
-	result = adb.db.fetch_list(f"FOR e in Entities FILTER e.type == '{type}' RETURN e")
-	return result
+	return tv.query(queries.ENTITIES_OF_TYPE, entity_type=type)
 
 @app.route("/location")
 def get_locations():
-	adb = ADB()
-	result = adb.db.fetch_list("FOR e in Entities FILTER e.type == 'Location' RETURN e")
-	return result
+	return tv.query(queries.ENTITIES_OF_TYPE, entity_type='Location')
 
 @app.route("/location/<id>")
 def get_location(id):
@@ -3360,242 +2994,198 @@ def get_location(id):
 	result = adb.db.fetchDocument(f"Entities/{id}").getStore()
 	return result
 
+# every session route is also available without a table, for the default table
+
+@app.route("/create-table/<table>", methods = ['POST'])
+def create_table(table):
+	tv.tables.create(table)
+	return jsonify({"success": True, "table": table})
+
 @app.route("/pick-character/<uuid>/<character>", methods = ['POST'])
-def pick_character(uuid, character):
-	if uuid not in [d['uuid'] for d in session_characters] and character not in [d['character'] for d in session_characters]:
-		session_characters.append({
-			"uuid": uuid,
-			"character": character
-		})
+@app.route("/pick-character/<table>/<uuid>/<character>", methods = ['POST'])
+def pick_character(uuid, character, table=tv.Tables.DEFAULT):
+	if tv.tables[table].pick_character(uuid, character):
 		return { "success": True }
-
-	elif character not in [d['character'] for d in session_characters]:
-		for sc in session_characters:
-			if sc["uuid"] == uuid:
-				sc["character"] = character
-				return { "success": True }
 	
 	character_doc = db.collection('Entities').get(character)
 	character_doc['active'] = True
+	character_doc['table'] = table
 	db.collection('Entities').update(character_doc)
 
 	return { "success": False }
 
 @app.route("/deactivate-character/<character>", methods = ['POST'])
-def deactivate_character(character):
-	if character in [d['character'] for d in session_characters]:
-		for sc in session_characters:
-			if sc["character"] == character:
-				session_characters.remove(sc)
-				return { "success": True }
-	return { "success": False }
+@app.route("/deactivate-character/<table>/<character>", methods = ['POST'])
+def deactivate_character(character, table=tv.Tables.DEFAULT):
+	return { "success": tv.tables[table].deactivate_character(character) }
 
 # dicepool: { character: ID, player: ID, gm: Boolean, result: Number, effect: Die[] }
 @app.route("/set-dicepool/<uuid>", methods = ['POST'])
-def set_dicepool(uuid):
-	global resolutions
-	global resolutions_rev
-
+@app.route("/set-dicepool/<table>/<uuid>", methods = ['POST'])
+def set_dicepool(uuid, table=tv.Tables.DEFAULT):
 	if not request.json:
 		return jsonify({ "error": "no JSON provided" })
 
-	new_resolution = request.json
+	state = tv.tables[table]
+	session = state.set_resolution(uuid, request.json)
 
-	# is_new = False
-	# if len(resolutions) == 0 or not any([dicepool.get('player').get('uuid') == uuid for dicepool in resolutions]):
-	# 	is_new = True
-	if any([dicepool.get('player').get('uuid') == uuid for dicepool in resolutions]):
-		resolutions.pop([dicepool.get('player').get('uuid') == uuid for dicepool in resolutions].index(True))
+	# a client that passes the revision it has gets the changes since then, like from `get_resolutions`
+	if request.args.get('rev'):
+		return Response(state.since(request.args.get('rev')), mimetype='application/json')
 
-	if len(new_resolution.get('dice')) > 0:
+	return jsonify({ "resolutions": [session.dicepool.resolution(uuid) for uuid in session.dicepool.resolutions] })
 
-	# 	# add complications to new resolutions
-	# 	for cp in complication_pool:
-	# 		if cp.get('player') != uuid:
-	# 			# new_resolution['dice'] = [d for d in new_resolution.get('dice') if d.get('complication_source') != cp.get('player')]
-	# 			for comp in cp.get('complications'):
-	# 				if comp.get('id') not in [d.get('id') for d in new_resolution.get('dice')]:
-	# 					comp['complication_source'] = cp.get('player')
-	# 					new_resolution['dice'].append(comp)
-
-		resolutions.append(new_resolution)
+@app.route("/roll-dicepool/<uuid>", methods = ['POST'])
+@app.route("/roll-dicepool/<table>/<uuid>", methods = ['POST'])
+def roll_dicepool(uuid, table=tv.Tables.DEFAULT):
+	"""rolls the player's dicepool on the server, the results replace the player's resolution, `?explode=true` for SWADE rolls"""
+	if not request.json:
+		return jsonify({ "error": "no JSON provided" })
 
-	result = { "resolutions": resolutions }
+	resolution = tv.tables[table].roll(uuid, request.json, request.args.get('explode') == 'true')
 
-	resolutions_rev = uuid4()
+	return jsonify({ "resolution": resolution })
 
-	return jsonify(result)
+@app.route("/verify-rolls")
+def verify_rolls():
+	"""generates every roll in the audit log again, with the revealed seeds and the ones of the tables open here"""
+	result = rolls.roll_log.verify([tv.tables[table].current().seed for table in tv.tables.ids()])
+	return jsonify({
+		"verified": result['verified'],
+		"unrevealed": result['unrevealed'],
+		"mismatches": result['mismatches']
+	})
 
 @app.route("/add-complications/<uuid>", methods = ['POST'])
-def add_complications(uuid):
+@app.route("/add-complications/<table>/<uuid>", methods = ['POST'])
+def add_complications(uuid, table=tv.Tables.DEFAULT):
 	"""this method completely removes all complications of the given user and replaces them with supplied complications"""
-	global complication_pool
-	global resolutions
-	global resolutions_rev
-
 	if not request.json:
 		return jsonify({ "error": "no JSON provided" })
 
-	new_complications = request.json.get('complications')
-
-	# the player has already suggested complications
-	if uuid in [comp.get('player') for comp in complication_pool]:
-		player_complication_pool = complication_pool.pop([comp.get('player') == uuid for comp in complication_pool].index(True))
-		player_complication_pool['complications'] = new_complications
-		complication_pool.append(player_complication_pool)
-
-	elif len(new_complications) > 0:
-		complication_pool.append({
-			"player": uuid,
-			"complications": new_complications
-		})
-
-	# add complication to opposing resolutions
-	for res in resolutions:
-		if res.get('player').get('uuid') != uuid:
-			res['dice'] = [d for d in res.get('dice') if d.get('complication_source') != uuid]
-			for comp in new_complications:
-				comp['complication_source'] = uuid
-				res['dice'].append(comp)
-
-	resolutions_rev = uuid4()
+	tv.tables[table].set_complications(uuid, request.json.get('complications'))
 
 	return jsonify({ "success": True })
 
 @app.route("/get-resolutions/")
 @app.route("/get-resolutions/<res_rev>")
-def get_resolutions(res_rev = None):
+@app.route("/get-resolutions/<table>/")
+@app.route("/get-resolutions/<table>/<res_rev>")
+def get_resolutions(res_rev = None, table=tv.Tables.DEFAULT):
 	# returns the results of different players' dicepools
-	global resolutions
-	global resolutions_rev
+	# with `?wait=<seconds>` the request is held until the resolutions change (long polling),
+	# `session`, `scene` and `beat` arguments also end the wait when those change,
+	# with `?delta=1` only the changes since `res_rev` are returned, see `tv.diff`
+	state = tv.tables[table]
+	wait = request.args.get('wait', type=float)
+	if wait and res_rev is not None:
+		state.revisions.wait({
+			'resolutions': res_rev,
+			'session': request.args.get('session'),
+			'scene': request.args.get('scene'),
+			'beat': request.args.get('beat')
+		}, min(wait, long_poll_limit))
 
 	# first check if it's needed, to save performance
-	if res_rev is not None and str(resolutions_rev) == res_rev:
+	session = state.current()
+	if res_rev is not None and session.dicepool.rev == res_rev:
 		return jsonify({
 			"message": "no new resolutions",
-			"resolutions_rev": resolutions_rev
+			"resolutions_rev": session.dicepool.rev,
+			"session": session.session,
+			"scene": session.scene,
+			"beat": session.beat
 		})
 
+	elif res_rev is not None and request.args.get('delta'):
+		return Response(state.since(res_rev), mimetype='application/json')
+
 	else:
-		# set variables to determine winner
-		highest_sum = 0
-		second_highest_sum = 0
-
-		for r in resolutions:
-			if r.get('player').get('phase') == "resolving dicepools":
-				result = 0
-
-				for die in r.get('dice'):
-					if die.get('isResultDie'):
-						result += die.get('result')
-					if result > highest_sum:
-						second_highest_sum = highest_sum
-						highest_sum = result
-
-				for r in resolutions:
-					result_dice = [d for d in r.get('dice') if d.get('isResultDie')]
-					r['result'] = sum([d.get('result') for d in result_dice])
-					if r.get('result') == highest_sum:
-						r['winner'] = True
-					else:
-						r['winner'] = False
-			else:
-				r['winner'] = False
-				r['result'] = 0
+		return Response(session.encoded(), mimetype='application/json')
 
-		return jsonify({
-			"resolutions": resolutions,
-			"complication_pool": complication_pool,
-			"resolutions_rev": resolutions_rev,
-			"heroic": math.floor((highest_sum - second_highest_sum) / 5),
-			"highest_sum": highest_sum
-		})
+@app.route("/resolutions-stream")
+@app.route("/resolutions-stream/<table>")
+def stream_resolutions(table=tv.Tables.DEFAULT):
+	"""
+	server-sent events with the resolutions, sent once every time one of the revisions changes
+
+	with `?delta=1` every event after the first one only holds the changes since the one before,
+	a reconnecting client gets the changes since the last event it received
+	"""
+	state = tv.tables[table]
+	delta = request.args.get('delta')
+	sent = request.headers.get('Last-Event-ID') if delta else None
+	def events():
+		nonlocal sent
+		revisions = state.revisions.current()
+		while True:
+			session = state.current()
+			data = state.since(sent, session) if sent is not None else session.encoded()
+			yield f"id: { session.dicepool.rev }\nevent: resolutions\ndata: ".encode() + data + b"\n\n"
+			if delta:
+				sent = session.dicepool.rev
+			current = state.revisions.wait(revisions, keep_alive_interval)
+			while current == revisions:
+				# comments keep proxies from closing the connection, and detect clients that left
+				yield ": keep-alive\n\n"
+				current = state.revisions.wait(revisions, keep_alive_interval)
+			revisions = current
+
+	return Response(events(), mimetype='text/event-stream', headers={
+		'Cache-Control': 'no-cache',
+		'X-Accel-Buffering': 'no'
+	})
 
 @app.route("/reset-dicepool", methods=['POST'])
-def reset_dicepool():
+@app.route("/reset-dicepool/<table>", methods=['POST'])
+def reset_dicepool(table=tv.Tables.DEFAULT):
 	# when GM resets gamestate
-	global resolutions
-	global resolutions_rev
-	resolutions = []
-	resolutions_rev = uuid4()
+	tv.tables[table].clear_resolutions()
 	return jsonify({ "success": True })
 
 @app.route("/session-characters")
-def get_session_characters():
-	return { "characters": session_characters }
+@app.route("/session-characters/<table>")
+def get_session_characters(table=tv.Tables.DEFAULT):
+	return { "characters": list(tv.tables[table].current().players.values()) }
+
+@app.route("/query-stats")
+def get_query_stats():
+	return jsonify(queries.stats())
 
 @app.route("/upload/<entity_key>", methods = ['POST'])
 def upload_file(entity_key):
-	# print("received request to upload file")
 	file = request.files['file']
 	file_extension = os.path.splitext(file.filename)[1]
-	entity_folder = os.path.join(app.config['UPLOAD_FOLDER'], entity_key)
-	# print("entity_folder: ", entity_folder)
-	if not os.path.exists(entity_folder):
-		# print("creating folder: ", entity_folder)
-		os.makedirs(entity_folder)
-	# filename = f"{ entity_id }{ file_extension }"
-	# filename = secure_filename(file.filename)
-	image = Image.open(file)
-	image_mini = image.copy()
-	image_large = image.copy()
-	data = list(image.getdata())
-	image_without_exif = Image.new(image.mode, image.size)
-	image_without_exif.putdata(data)
-	width, height = image.size
-	max_size_mini = 48
-	max_size_small = 240
-	max_size_large = 1024
-	if width > height:
-		new_width_small = max_size_small
-		new_height_small = int((new_width_small / width) * height)
-		image_small = image.resize((new_width_small, new_height_small))
-		new_width_mini = max_size_mini
-		new_height_mini = int((new_width_mini / width) * height)
-		image_mini = image_mini.resize((new_width_mini, new_height_mini))
-		new_width_large = max_size_large
-		new_height_large = int((new_width_large / width) * height)
-		image_large = image_large.resize((new_width_large, new_height_large))
-
-	else:
-		new_height_small = max_size_small
-		new_width_small = int((new_height_small / height) * width)
-		image_small = image.resize((new_width_small, new_height_small))
-		new_height_mini = max_size_mini
-		new_width_mini = int((new_height_mini / height) * width)
-		image_mini = image_mini.resize((new_width_mini, new_height_mini))
-		new_height_large = max_size_large
-		new_width_large = int((new_height_large / height) * width)
-		image_large = image_large.resize((new_width_large, new_height_large))
-	image_small.save(os.path.join(app.config['UPLOAD_FOLDER'], entity_key, f"small{ file_extension.lower() }"))
-	image_mini.save(os.path.join(app.config['UPLOAD_FOLDER'], entity_key, f"mini{ file_extension.lower() }"))
-	image_large.save(os.path.join(app.config['UPLOAD_FOLDER'], entity_key, f"large{ file_extension.lower() }"))
-	image_without_exif.save(os.path.join(app.config['UPLOAD_FOLDER'], entity_key, f"original{ file_extension.lower() }"))
-	return jsonify({ "success": True })
+	job = submit_image(file, os.path.join(app.config['UPLOAD_FOLDER'], entity_key), file_extension, entity_key)
+	return jsonify({ "success": True, "job": job.id })
 
 @app.route("/upload/<entity_key>/<location_key>", methods = ['POST'])
 def upload_file_location(entity_key, location_key):
-	# print("received request to upload file")
 	file = request.files['file']
 	file_extension = os.path.splitext(file.filename)[1]
-	entity_folder = os.path.join(app.config['UPLOAD_FOLDER'], entity_key, location_key)
-	# print("entity_folder: ", entity_folder)
-	if not os.path.exists(entity_folder):
-		# print("creating folder: ", entity_folder)
-		os.makedirs(entity_folder)
-	# filename = f"{ entity_id }{ file_extension }"
-	# filename = secure_filename(file.filename)
-	image = Image.open(file)
-	hierarchy = tv.retrieve_hierarchy('Entities/' + location_key)
+	hierarchy = tv.location_hierarchy.ancestors('Entities/' + location_key)
 	# print("hierarchy: ", hierarchy)
-	location_key = hierarchy[-2].get('_key')
-	path = os.path.join(app.config['UPLOAD_FOLDER'], entity_key, location_key, f"original{ file_extension.lower() }")
-	# print("image path: ", path)
-	if not os.path.exists(os.path.dirname(path)):
-		os.makedirs(os.path.dirname(path))
-	image.save(path)
-	save_image(path, entity_key, location_key)
-	return jsonify({ "success": True })
+	location_key = hierarchy[-2].split('/')[-1]
+	job = submit_image(file, os.path.join(app.config['UPLOAD_FOLDER'], entity_key, location_key), file_extension, entity_key)
+	return jsonify({ "success": True, "job": job.id })
+
+@app.route("/media/<name>")
+def get_media(name):
+	"""serves a file from the content addressed store, its name is its hash so it can be cached for good"""
+	match = re.fullmatch(r'([0-9a-f]{64})(\.\w+)', name)
+	path = images.stored_path(match.group(1), match.group(2)) if match is not None else None
+	if path is None or not os.path.isfile(path):
+		return jsonify({ "success": False }), 404
+	response = send_file(path, etag=match.group(1), conditional=True)
+	response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+	return response
+
+@app.route("/image-job/<job_id>")
+def get_image_job(job_id):
+	job = jobs.image_jobs.get(job_id)
+	if job is None:
+		return jsonify({ "success": False }), 404
+	return jsonify(job.status())
 
 @app.route("/imagen/<entity_key>/<force>", methods = ['POST'])
 def imagegen(entity_key, force):
@@ -3651,9 +3241,9 @@ def imagegen(entity_key, force):
 					location_id = location.get('location')
 					location = db.collection('Entities').get(location_id)
 					location_key = location.get('_key')
-				hierarchy = tv.retrieve_hierarchy(location_id)
+				hierarchy = tv.location_hierarchy.ancestors(location_id)
 				if len(hierarchy) > 1:
-					location_key = hierarchy[-2].get('_key')
+					location_key = hierarchy[-2].split('/')[-1]
 		name = entity.get('name')
 		description = entity.get('description')
 		negative = "cgi, 3d, bad quality, watermark, signature"
@@ -3755,43 +3345,7 @@ def imagegen(entity_key, force):
 
 		# location
 		elif entity_type == "location":
-			query = f"""FOR entity IN Entities
-				FILTER entity._id == 'Entities/{ entity_key }'
-			LET traits = (
-				FOR s IN TraitSettings
-					FILTER entity._id == s._from
-				FOR t IN Traits
-					FILTER s._to == t._id
-				RETURN [t.name, s.statement, s.rating[0], s.notes, s.rating_type]
-			)
-			LET hierarchy = (
-				FOR v, e, p IN 0..20 OUTBOUND entity Relations
-				FILTER p.edges[*].type ALL == 'super'
-				LET hierarchy_traits = (
-					FOR s IN TraitSettings
-						FILTER v._id == s._from
-						FILTER s.rating_type != 'resource'
-					FOR t IN Traits
-						FILTER s._to == t._id
-					RETURN [t.name, s.statement, s.rating[0]]
-				)
-				RETURN [v.name, v.description, hierarchy_traits]
-			)
-			LET zones = (
-				FOR v, e, p IN 0..1 INBOUND entity Relations
-				FILTER p.edges[*].type ALL == 'super'
-				RETURN [v.name, v.description]
-			)
-			RETURN {{
-				entity: entity.name,
-				description: entity.description,
-				traits: traits,
-				hierarchy: hierarchy,
-				zones: zones
-			}}"""
-
-			# there should only be one result
-			cursor = db.aql.execute(query)
+			cursor = tv.query(queries.LOCATION_PROMPT, entity=f"Entities/{ entity_key }")
 
 			traits = []
 
@@ -3844,37 +3398,7 @@ def imagegen(entity_key, force):
 
 		# faction
 		elif entity_type == "faction":
-			query = f"""FOR entity IN Entities
-				FILTER entity._id == 'Entities/{ entity_key }'
-			LET traits = (
-				FOR s IN TraitSettings
-					FILTER entity._id == s._from
-				FOR t IN Traits
-					FILTER s._to == t._id
-				RETURN [t.name, s.statement, s.rating[0]]
-			)
-			LET genres = (
-				FOR v, e, p IN 0..20 OUTBOUND entity.location Relations
-				FILTER p.edges[*].type ALL == 'super'
-				LET hierarchy_traits = (
-					FOR s IN TraitSettings
-						FILTER v._id == s._from
-					FOR t IN Traits
-						FILTER s._to == t._id
-						FILTER t.name == 'genre'
-					RETURN s.statement
-				)
-				RETURN hierarchy_traits
-			)
-			RETURN {{
-				entity: entity.name,
-				description: entity.description,
-				traits: traits,
-				genres: FLATTEN(genres)
-			}}"""
-
-			# there should only be one result
-			cursor = db.aql.execute(query)
+			cursor = tv.query(queries.FACTION_PROMPT, entity=f"Entities/{ entity_key }")
 
 			traits = []
 
@@ -3932,72 +3456,84 @@ def imagegen(entity_key, force):
 	else:
 		return jsonify({ "success": False })
 
-def save_image(filepath, entity_key, location_key=None):
-	# Open the original image
-	image = Image.open(filepath)
-	image_mini = image.copy()
-	image_large = image.copy()
-	data = list(image.getdata())
-	image_without_exif = Image.new(image.mode, image.size)
-	image_without_exif.putdata(data)
-
-	# Determine image dimensions
-	width, height = image.size
-
-	# Define size thresholds
-	max_size_mini = 48
-	max_size_small = 240
-	max_size_large = 1024
-
-	# Calculate new dimensions and resize images
-	if width > height:
-		new_width_small = max_size_small
-		new_height_small = int((new_width_small / width) * height)
-		image_small = image.resize((new_width_small, new_height_small))
-
-		new_width_mini = max_size_mini
-		new_height_mini = int((new_width_mini / width) * height)
-		image_mini = image_mini.resize((new_width_mini, new_height_mini))
-
-		new_width_large = max_size_large
-		new_height_large = int((new_width_large / width) * height)
-		image_large = image_large.resize((new_width_large, new_height_large))
-	else:
-		new_height_small = max_size_small
-		new_width_small = int((new_height_small / height) * width)
-		image_small = image.resize((new_width_small, new_height_small))
+def image_finished(job, generated=False):
+	"""ends the imagening of the entity of a finished image job, a generated image marks it as imagened"""
+	portraits.update(*os.path.relpath(job.folder, app.config['UPLOAD_FOLDER']).split(os.sep))
+	entity = db.collection('Entities').get(job.entity_key)
+	if entity is None:
+		return
+	entity['imagening'] = False
+	if generated and job.state == jobs.ImageJob.DONE:
+		entity['imagened'] = True
+	db.collection('Entities').update(entity)
 
-		new_height_mini = max_size_mini
-		new_width_mini = int((new_height_mini / height) * width)
-		image_mini = image_mini.resize((new_width_mini, new_height_mini))
+def submit_image(source, folder, extension, entity_key, generated=False):
+	"""
+	Spools an image and makes its derivatives in the background.
 
-		new_height_large = max_size_large
-		new_width_large = int((new_height_large / height) * width)
-		image_large = image_large.resize((new_width_large, new_height_large))
+	Args:
+		source: An uploaded file, it's streamed to the spool, or the path of a file that's moved there.
+		folder (str): Folder the original and the derivatives are written to.
+		extension (str): Extension of the image.
+		entity_key (str): The entity that's imagening until the job is finished.
+		generated (bool): Whether the image was generated, the entity is imagened when it's stored.
 
-	# Get file extension
-	file_extension = os.path.splitext(filepath)[1]
+	Returns:
+		ImageJob: The submitted job.
+	"""
+	spooled = jobs.image_jobs.spool_file(extension)
+	if isinstance(source, str):
+		shutil.move(source, spooled)
+	else:
+		source.save(spooled)
+	db.collection('Entities').update({ '_key': entity_key, 'imagening': True })
+	return jobs.image_jobs.submit(spooled, folder, extension, entity_key, done=lambda job: image_finished(job, generated))
 
-	# Create entity folder for saving if it doesn't exist
+def save_image(filepath, entity_key, location_key=None):
+	"""ingests an image ComfyUI generated, the entity is marked as imagened when its derivatives are stored"""
 	if not location_key:
 		entity_folder = os.path.join(app.config['UPLOAD_FOLDER'], entity_key)
 	else:
 		entity_folder = os.path.join(app.config['UPLOAD_FOLDER'], entity_key, location_key)
-	if not os.path.exists(entity_folder):
-		os.makedirs(entity_folder)
+	submit_image(filepath, entity_folder, os.path.splitext(filepath)[1], entity_key, generated=True)
 
-	# Save images
-	image_small.save(os.path.join(entity_folder, f"small{file_extension.lower()}"))
-	image_mini.save(os.path.join(entity_folder, f"mini{file_extension.lower()}"))
-	image_large.save(os.path.join(entity_folder, f"large{file_extension.lower()}"))
-	image_without_exif.save(os.path.join(entity_folder, f"original{file_extension.lower()}"))
+imagen_watcher = ingest.ImagenWatcher(app.config['IMAGEN_FOLDER'], save_image)
 
-	entity = db.collection('Entities').get(entity_key)
-	entity['imagening'] = False
-	entity['imagened'] = True
-	db.collection('Entities').update(entity)
+def own():
+	"""
+	Does the work only one flask process may do, once this process holds the owner lock.
 
-	return jsonify({"success": True})
+	Every process waits for the lock in a thread, when the owner stops another one takes over.
+	The owner creates the missing indexes, migrates the images stored before their metadata was kept,
+	and then ingests the generated images, it keeps the lock until it stops.
+	"""
+	os.makedirs(os.path.dirname(app.config['OWNER_LOCK']), exist_ok=True)
+	with open(app.config['OWNER_LOCK'], 'a') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			indexes.provision(db)
+		except Exception as e:
+			logging.error(f"indexes\tcould not provision indexes: { e }")
+		try:
+			portraits.compact()
+			for folder in images.migrate(app.config['UPLOAD_FOLDER']):
+				portraits.update(*os.path.relpath(folder, app.config['UPLOAD_FOLDER']).split(os.sep))
+		except Exception as e:
+			logging.error(f"images\tcould not migrate the images: { e }")
+		imagen_watcher.run()
+
+def start():
+	"""starts the workers and threads that run next to the requests"""
+	# the image workers are forked before any thread is started
+	jobs.image_jobs.start()
+	# the caches of this worker follow the changes the other workers make
+	tv.tables.watch()
+	threading.Thread(target=portraits.load, name='portraits', daemon=True).start()
+	threading.Thread(target=own, name='owner', daemon=True).start()
+
+# with the reloader the app runs in a child process, the process that reloads it doesn't serve requests
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+	start()
 
 if __name__ == "__main__":
 	app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,520 @@
+"""
+	Image derivatives of uploaded and generated images
+
+	Every image is stored as `original` without its metadata, and as `large`, `small` and `mini`
+	derivatives. JPEG originals are copied without their metadata segments and never decoded
+	in full, their derivatives are decoded in draft mode at the smallest scale that's big enough.
+	Each derivative is reduced from the one before it, and every file is written atomically.
+	Responsive sources are made in WebP, and AVIF where Pillow supports it, at every width of the
+	ladder up to the width of the image, as `w<width>.webp` and `w<width>.avif`.
+	The width, height, byte size, format and hash of every file go to `portrait.json` next to them.
+
+	Every file is also kept in a content addressed store, by its sha256, and the files in the folder
+	of an entity are hard links to it, so an image that's stored twice only takes up its space once.
+	Files are only ever replaced, never written to in place, so a file in the store never changes.
+
+	Run `python images.py [image]` to compare the memory and latency with the former pipeline,
+	`python images.py migrate <upload folder>` to measure and store the images that were stored before,
+	and `python images.py collect <upload folder>` to remove the files no portrait refers to anymore.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import sys
+import threading
+import time
+
+from PIL import Image, features
+
+SIZES = [('large', 1024), ('small', 240), ('mini', 48)] # from large to small, longest side in pixels
+
+METADATA = 'portrait.json' # the sizes of the files in a folder
+CHANGES = '.changes' # log of the folders the manifests have to read again, in the upload folder
+
+# content addressed store of the files, `<store>/<first two digits of the hash>/<hash><extension>`
+STORE = os.environ.get("MEDIA_STORE", "/media/uploads/.media")
+
+# widths of the responsive sources, like `IMAGE_LADDER=320,640,1024,1600`
+LADDER = sorted(int(width) for width in os.environ.get("IMAGE_LADDER", "320,640,1024,1600").split(','))
+
+# formats of the responsive sources by extension, with their encoder options
+SOURCE_FORMATS = { 'webp': ('WEBP', { 'quality': 80, 'method': 4 }) }
+if features.check('avif'):
+	SOURCE_FORMATS['avif'] = ('AVIF', { 'quality': 60, 'speed': 8 })
+SOURCE_FILE = re.compile(r'w\d+\.(webp|avif)')
+
+# JPEG segments that are kept: JFIF, ICC profile and Adobe color transform
+JPEG_KEPT_SEGMENTS = { 0xE0, 0xE2, 0xEE }
+
+def dimensions(width, height, max_size):
+	"""the size of a derivative, the longest side gets `max_size` pixels"""
+	if width > height:
+		return max_size, int((max_size / width) * height)
+	return int((max_size / height) * width), max_size
+
+def ladder(width, height):
+	"""the sizes of the responsive sources of an image, from large to small, none is wider than the image"""
+	widths = { min(width, LADDER[-1]), *(rung for rung in LADDER if rung < width) }
+	return [(rung, max(1, round(height * rung / width))) for rung in sorted(widths, reverse=True)]
+
+def image_format(extension):
+	return Image.registered_extensions().get(extension.lower())
+
+def _write(path, write):
+	"""writes a file next to the path and moves it in place, readers never see a partial file"""
+	temporary = f"{ path }.{ os.getpid() }.tmp"
+	try:
+		write(temporary)
+		os.replace(temporary, path)
+	finally:
+		if os.path.exists(temporary):
+			os.remove(temporary)
+
+def content_hash(path, chunk_size=1 << 20):
+	"""the sha256 of a file, in hexadecimal"""
+	digest = hashlib.sha256()
+	with open(path, 'rb') as file:
+		while chunk := file.read(chunk_size):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def _size(path, width, height, format):
+	return { 'width': width, 'height': height, 'bytes': os.path.getsize(path), 'format': format, 'hash': content_hash(path) }
+
+def describe(folder, extension):
+	"""the metadata of the files of an image that was stored before there was a `portrait.json`, only their headers are decoded"""
+	sizes = {}
+	for name in ['original', *(name for name, _ in SIZES)]:
+		path = os.path.join(folder, f"{ name }{ extension }")
+		try:
+			with Image.open(path) as image:
+				sizes[name] = _size(path, image.width, image.height, image.format)
+		except OSError:
+			pass # missing, or not an image
+	return sizes
+
+def write_metadata(folder, document):
+	content = json.dumps(document, separators=(',', ':'))
+	def write(path):
+		with open(path, 'w') as metadata:
+			metadata.write(content)
+	_write(os.path.join(folder, METADATA), write)
+
+def read_metadata(folder):
+	"""the document `derivatives` wrote for the image in a folder, None if there's no metadata"""
+	try:
+		with open(os.path.join(folder, METADATA)) as metadata:
+			return json.load(metadata)
+	except (FileNotFoundError, ValueError):
+		return None
+
+def stored_path(digest, extension):
+	"""the path of a file in the store"""
+	return os.path.join(STORE, digest[:2], f"{ digest }{ extension }")
+
+def _files(document):
+	"""the names of the files of an image, with their hash"""
+	for name, size in document.get('sizes', {}).items():
+		yield f"{ name }{ document.get('extension') }", size.get('hash')
+	for format, files in document.get('sources', {}).items():
+		for name, size in files.items():
+			yield f"{ name }.{ format }", size.get('hash')
+
+def _keep(path, digest):
+	"""adds a file to the store, or replaces it with a link to the same file that's there already"""
+	stored = stored_path(digest, os.path.splitext(path)[1].lower())
+	os.makedirs(os.path.dirname(stored), exist_ok=True)
+	try:
+		os.link(path, stored)
+		return
+	except FileExistsError:
+		pass
+	except OSError:
+		# a filesystem without hard links, the store gets a copy
+		if not os.path.exists(stored):
+			_write(stored, lambda temporary: shutil.copyfile(path, temporary))
+		return
+	if not os.path.samefile(path, stored):
+		try:
+			_write(path, lambda temporary: os.link(stored, temporary))
+		except OSError:
+			pass # without hard links the folder keeps its own copy
+
+def store(folder, document):
+	"""adds the files of an image to the store, and marks its document as stored"""
+	for name, digest in _files(document):
+		_keep(os.path.join(folder, name), digest)
+	document['stored'] = True
+
+def collect(folder):
+	"""removes the files from the store that no `portrait.json` in the upload folder refers to, returns how many, run it while no images are stored"""
+	referred = set()
+	for path, folders, files in os.walk(folder):
+		folders[:] = [name for name in folders if not name.startswith('.')]
+		if METADATA in files:
+			referred.update(digest for _, digest in _files(read_metadata(path) or {}))
+	removed = 0
+	for path, _, files in os.walk(STORE):
+		for name in files:
+			if os.path.splitext(name)[0] not in referred:
+				os.remove(os.path.join(path, name))
+				removed += 1
+	return removed
+
+def strip_jpeg(source, destination, chunk_size=1 << 16):
+	"""copies a JPEG stream without its EXIF, XMP, IPTC and comment segments, the image data isn't decoded"""
+	if source.read(2) != b'\xff\xd8':
+		raise Exception("not a JPEG file: ", source)
+	destination.write(b'\xff\xd8')
+	while True:
+		marker = source.read(2)
+		while len(marker) == 2 and marker[1] == 0xFF:
+			marker = marker[1:] + source.read(1) # fill bytes
+		if len(marker) < 2 or marker[0] != 0xFF:
+			raise Exception("broken JPEG file: ", source)
+		length = source.read(2)
+		segment = source.read(int.from_bytes(length, 'big') - 2)
+		if marker[1] == 0xDA:
+			# start of scan, the rest is image data
+			destination.write(marker + length + segment)
+			break
+		if not (0xE0 <= marker[1] <= 0xEF or marker[1] == 0xFE) or marker[1] in JPEG_KEPT_SEGMENTS:
+			destination.write(marker + length + segment)
+	while True:
+		chunk = source.read(chunk_size)
+		if not chunk:
+			break
+		destination.write(chunk)
+
+def _shrink(image, size):
+	"""resizes an image, large steps are taken with the cheap `reduce` first"""
+	factor = max(1, min(image.width // (2 * size[0]), image.height // (2 * size[1])))
+	if factor > 1 and image.mode not in ('1', 'P'): # palette images can't be reduced
+		image = image.reduce(factor)
+	return image.resize(size, Image.LANCZOS)
+
+def _sources(image, folder):
+	"""writes the responsive sources of a decoded image, returns their metadata by format and name"""
+	sources = { extension: {} for extension in SOURCE_FORMATS }
+	rung = image
+	for size in ladder(*image.size):
+		rung = _shrink(rung, size)
+		for extension, (format, options) in SOURCE_FORMATS.items():
+			path = os.path.join(folder, f"w{ size[0] }.{ extension }")
+			_write(path, lambda path: rung.save(path, format=format, **options))
+			sources[extension][f"w{ size[0] }"] = _size(path, *size, format)
+	# sources of an image stored before at other widths
+	for name in os.listdir(folder):
+		if SOURCE_FILE.fullmatch(name) and name.split('.')[0] not in sources.get(name.split('.')[1], {}):
+			os.remove(os.path.join(folder, name))
+	return sources
+
+def derivatives(source, folder, extension):
+	"""
+	Stores an image as original and derivatives.
+
+	Args:
+		source: Path or binary file of the image, files are read from their start.
+		folder (str): Folder the files are written to, it's created if it doesn't exist.
+		extension (str): Extension of the files, like `.png`, it sets their format.
+
+	Returns:
+		dict: The document written to `portrait.json`, with the width, height, byte size, format and hash
+			of every size by name, and of every responsive source by format and name.
+			Every file is in the store by the time it's returned.
+	"""
+	extension = extension.lower()
+	format = image_format(extension)
+	os.makedirs(folder, exist_ok=True)
+	opened = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+	try:
+		opened.seek(0)
+		image = Image.open(opened)
+		width, height = image.size
+		sizes = { name: dimensions(width, height, max_size) for name, max_size in SIZES }
+		result = { 'original': (width, height), **sizes }
+
+		if image.format == 'JPEG' and format == 'JPEG':
+			def copy(path):
+				opened.seek(0)
+				with open(path, 'wb') as destination:
+					strip_jpeg(opened, destination)
+			_write(os.path.join(folder, f"original{ extension }"), copy)
+			# decodes at 1/2, 1/4 or 1/8 scale when that's still big enough for the large derivative and sources
+			widest = ladder(width, height)[0]
+			image.draft(image.mode, (max(sizes['large'][0], widest[0]), max(sizes['large'][1], widest[1])))
+		else:
+			image.load()
+			# a copy without `info` leaves the metadata behind, without going through the pixels in Python
+			original = image.copy()
+			original.info = {}
+			_write(os.path.join(folder, f"original{ extension }"), lambda path: original.save(path, format=format))
+			del original
+
+		# the modern formats take RGB, with alpha when the image has transparency
+		if image.mode in ('RGB', 'RGBA'):
+			rgb = image
+		else:
+			rgb = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+		image.info = {}
+		rgb.info = {}
+		sources = _sources(rgb, folder)
+		del rgb
+
+		for name, max_size in SIZES:
+			image = _shrink(image, sizes[name])
+			_write(os.path.join(folder, f"{ name }{ extension }"), lambda path: image.save(path, format=format))
+
+		metadata = { name: _size(os.path.join(folder, f"{ name }{ extension }"), *size, format) for name, size in result.items() }
+		document = { 'extension': extension, 'sizes': metadata, 'sources': sources }
+		store(folder, document)
+		write_metadata(folder, document)
+		return document
+	finally:
+		if opened is not source:
+			opened.close()
+
+def _original_extension(folder):
+	"""the extension of the original image in a folder, None without one"""
+	files = {}
+	try:
+		for entry in os.scandir(folder):
+			if entry.is_file():
+				name, extension = os.path.splitext(entry.name)
+				files.setdefault(extension, set()).add(name)
+	except FileNotFoundError:
+		return None
+	return next((extension for extension, names in sorted(files.items()) if 'original' in names and image_format(extension) is not None), None)
+
+def migrate(folder):
+	"""
+	Measures and stores the images that were stored before their metadata and the store were kept.
+
+	Args:
+		folder (str): The upload folder.
+
+	Returns:
+		generator: The folders of the entities and regions that were migrated.
+	"""
+	for path, folders, files in os.walk(folder):
+		folders[:] = [name for name in folders if not name.startswith('.')]
+		if len(os.path.relpath(path, folder).split(os.sep)) not in (1, 2) or os.path.normpath(path) == os.path.normpath(folder):
+			continue
+		document = read_metadata(path)
+		if document is None:
+			extension = _original_extension(path)
+			if extension is None:
+				continue
+			document = { 'extension': extension, 'sizes': describe(path, extension), 'sources': {} }
+		if document.get('stored'):
+			continue
+		try:
+			store(path, document)
+			write_metadata(path, document)
+		except OSError as e:
+			logging.warning(f"images\tcould not store the files in { path }: { e }")
+			continue
+		yield path
+
+class Manifest:
+	"""
+		In-memory index of the images in the upload folder, by entity key and region key.
+
+		The folder is read once, and every image job and deletion updates the index in place.
+		Each process appends the folders it changed to the `.changes` log in the upload folder,
+		and reads the folders the others logged since it last looked, at most every `interval` seconds.
+		Replacing the log, like `compact` does, makes every process read the whole folder again.
+	"""
+	def __init__(self, folder, interval=1.0):
+		self.folder = folder
+		self.changes = os.path.join(folder, CHANGES)
+		self.interval = interval
+		self.lock = threading.RLock()
+		self.portraits = None # (entity key, region key or None) -> (extension, metadata by size, sources)
+		self.log = None # (inode, offset) of the change log, as far as it was read
+		self.checked = 0
+
+	def _read(self, folder):
+		"""the extension of the image in a folder and the metadata of its sizes and sources, None without an original"""
+		document = read_metadata(folder)
+		if document is None or not document.get('stored'):
+			# stored before the metadata and the store were kept, `migrate` adds them
+			extension = _original_extension(folder)
+			return (extension, {}, {}) if extension is not None else None
+		extension = document.get('extension')
+		# the name in the store, which keeps every file with a lower case extension
+		sizes = {
+			size: { **metadata, 'file': f"{ metadata.get('hash') }{ extension.lower() }" }
+			for size, metadata in document.get('sizes', {}).items()
+		}
+		sources = {
+			format: { size: { **metadata, 'file': f"{ metadata.get('hash') }.{ format }" } for size, metadata in files.items() }
+			for format, files in document.get('sources', {}).items()
+		}
+		return extension, sizes, sources
+
+	def _position(self):
+		try:
+			stat = os.stat(self.changes)
+			return stat.st_ino, stat.st_size
+		except FileNotFoundError:
+			return None, 0
+
+	def load(self):
+		"""reads the whole upload folder"""
+		with self.lock:
+			# changes logged during the scan are read again afterwards
+			self.log = self._position()
+			portraits = {}
+			if os.path.isdir(self.folder):
+				for entity in os.scandir(self.folder):
+					if not entity.is_dir() or entity.name.startswith('.'):
+						continue
+					portraits[(entity.name, None)] = self._read(entity.path)
+					for region in os.scandir(entity.path):
+						if region.is_dir():
+							portraits[(entity.name, region.name)] = self._read(region.path)
+			self.portraits = { key: portrait for key, portrait in portraits.items() if portrait is not None }
+			self.checked = time.monotonic()
+
+	def _follow(self):
+		"""applies the changes the other processes logged"""
+		if self.portraits is None:
+			return self.load()
+		if time.monotonic() - self.checked < self.interval:
+			return
+		self.checked = time.monotonic()
+		inode, size = self._position()
+		if inode != self.log[0] and (self.log[0] is not None or inode is None):
+			return self.load() # the log was replaced
+		if size <= self.log[1]:
+			return
+		with open(self.changes, 'rb') as log:
+			log.seek(self.log[1])
+			data = log.read(size - self.log[1])
+		data = data[:data.rfind(b'\n') + 1] # a line that's still being written is read next time
+		self.log = (inode, self.log[1] + len(data))
+		for line in data.decode().splitlines():
+			change, entity_key, region_key = (line.split('\t') + ['', ''])[:3]
+			if change == 'remove':
+				self._remove(entity_key)
+			else:
+				self._update(entity_key, region_key or None)
+
+	def _log(self, *change):
+		line = '\t'.join(change) + '\n'
+		try:
+			# a single write of a short line in append mode doesn't interleave with other processes
+			with open(self.changes, 'a') as log:
+				log.write(line)
+		except OSError as e:
+			logging.warning(f"images\tcould not log a change of the manifest: { e }")
+
+	def compact(self):
+		"""replaces the change log with an empty one, every process reads the upload folder again"""
+		_write(self.changes, lambda path: open(path, 'w').close())
+
+	def get(self, entity_key, region_key=None):
+		"""
+		Looks up the image of an entity, or of the entity in a region.
+
+		Returns:
+			tuple: The extension of the files in the folder, the metadata of the sizes that are stored and
+				of the responsive sources by format, with their `file` name in the store, or None when there's no image.
+		"""
+		with self.lock:
+			self._follow()
+			return self.portraits.get((entity_key, region_key))
+
+	def _update(self, entity_key, region_key=None):
+		folder = os.path.join(self.folder, entity_key, region_key) if region_key else os.path.join(self.folder, entity_key)
+		portrait = self._read(folder)
+		if portrait is None:
+			self.portraits.pop((entity_key, region_key), None)
+		else:
+			self.portraits[(entity_key, region_key)] = portrait
+
+	def update(self, entity_key, region_key=None):
+		"""reads the folder of an entity or region again, after its images were stored"""
+		self._log('update', entity_key, region_key or '')
+		with self.lock:
+			if self.portraits is not None:
+				self._update(entity_key, region_key)
+
+	def _remove(self, entity_key):
+		self.portraits = { key: portrait for key, portrait in self.portraits.items() if key[0] != entity_key }
+
+	def remove(self, entity_key):
+		"""forgets the images of an entity, in every region"""
+		self._log('remove', entity_key)
+		with self.lock:
+			if self.portraits is not None:
+				self._remove(entity_key)
+
+def _legacy_derivatives(path, folder, extension):
+	"""the former pipeline, only kept for the benchmark"""
+	image = Image.open(path)
+	image_mini = image.copy()
+	image_large = image.copy()
+	data = list(image.getdata())
+	image_without_exif = Image.new(image.mode, image.size)
+	image_without_exif.putdata(data)
+	width, height = image.size
+	image.resize(dimensions(width, height, 240)).save(os.path.join(folder, f"small{ extension }"))
+	image_mini.resize(dimensions(width, height, 48)).save(os.path.join(folder, f"mini{ extension }"))
+	image_large.resize(dimensions(width, height, 1024)).save(os.path.join(folder, f"large{ extension }"))
+	image_without_exif.save(os.path.join(folder, f"original{ extension }"))
+
+def _measure(pipeline, path, folder, repeat, results):
+	"""runs in its own process, so its peak memory isn't shared with the other pipeline"""
+	extension = os.path.splitext(path)[1]
+	before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	start = time.perf_counter()
+	for _ in range(repeat):
+		pipeline(path, folder, extension)
+	latency = (time.perf_counter() - start) * 1000 / repeat
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+	results.put((latency, peak / 1024))
+
+def benchmark(path, folder, repeat=5):
+	"""returns the latency in milliseconds and the peak memory increase in MB of both pipelines, by name"""
+	import multiprocessing
+	context = multiprocessing.get_context('fork')
+	report = {}
+	for name, pipeline in [('legacy', _legacy_derivatives), ('derivatives', derivatives)]:
+		results = context.Queue()
+		process = context.Process(target=_measure, args=(pipeline, path, folder, repeat, results))
+		process.start()
+		report[name] = results.get()
+		process.join()
+	return report
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ['collect']:
+		print(f"{ collect(sys.argv[2]) } files removed from { STORE }")
+		sys.exit(0)
+	if sys.argv[1:2] == ['migrate']:
+		manifest = Manifest(sys.argv[2])
+		for path in migrate(sys.argv[2]):
+			manifest.update(*os.path.relpath(path, sys.argv[2]).split(os.sep))
+			print("migrated ", path)
+		sys.exit(0)
+	import tempfile
+	folder = tempfile.mkdtemp()
+	if len(sys.argv) > 1:
+		paths = sys.argv[1:]
+	else:
+		# a generated image the size ComfyUI makes, and a photo sized JPEG with EXIF
+		paths = [os.path.join(folder, 'generated.png'), os.path.join(folder, 'photo.jpg')]
+		Image.radial_gradient('L').resize((832, 1216)).convert('RGB').save(paths[0])
+		photo = Image.merge('RGB', [Image.linear_gradient('L'), Image.radial_gradient('L'), Image.effect_noise((256, 256), 64).convert('L')])
+		exif = Image.Exif()
+		exif[0x010F] = "camera"
+		photo.resize((4000, 3000)).save(paths[1], quality=90, exif=exif)
+	for path in paths:
+		for name, (latency, peak) in benchmark(path, folder).items():
+			print(f"{ os.path.basename(path) } { name }: { latency:.1f} ms, { peak:.1f} MB peak memory")
@@ -0,0 +1,204 @@
+"""
+	Index declarations for the hot lookup paths, and checks that the registered queries use them
+
+	Run `python indexes.py` to create the missing indexes, print a report, and explain every
+	registered query. It exits with status 1 if a query scans a whole collection.
+"""
+import logging
+import re
+import sys
+
+import queries
+
+class Index:
+	"""a persistent index that has to exist on a collection, fields ending in [*] make it an array index"""
+	def __init__(self, collection, fields, sparse=False):
+		self.collection = collection
+		self.fields = fields
+		self.sparse = sparse
+		self.name = "idx_" + "_".join([collection.lower()] + [field.strip('_').replace('[*]', '') for field in fields])
+
+	def matches(self, index):
+		return index.get('type') == 'persistent' and list(index.get('fields', [])) == self.fields
+
+	def __repr__(self):
+		return f"{ self.collection }({ ', '.join(self.fields) })"
+
+INDEXES = [
+	Index('Entities', ['type']),
+	Index('Entities', ['location']),
+	Index('Entities', ['archetype_id']),
+	Index('Entities', ['active']),
+	Index('Entities', ['imagening']),
+	Index('TraitSettings', ['_from', '_to']),
+	Index('TraitSettings', ['sfxs[*]']),
+	Index('TraitsetSettings', ['_from', '_to']),
+	Index('Traits', ['traitset']),
+	Index('Traitsets', ['entity_types[*]']),
+	Index('Relations', ['_from', 'type']),
+	Index('Relations', ['_to', 'type']),
+]
+
+# queries that read a whole collection on purpose
+FULL_SCANS = {
+	'all_sfxs': "lists every SFX",
+	'all_traitsets': "lists every traitset",
+	'search_entities': "LIKE can't use a persistent index",
+	'super_relations': "loads the location hierarchy once per process",
+}
+
+# values used to explain the registered queries, by bind parameter name
+SAMPLE_BIND_VARS = {
+	'entity': 'Entities/1',
+	'character': 'Entities/1',
+	'location': 'Entities/1',
+	'entity_type': 'character',
+	'relation': 'Relations/1',
+	'trait': 'Traits/1',
+	'traitset': 'Traitsets/1',
+	'setting': 'TraitSettings/1',
+	'sfx': 'SFXs/1',
+	'statement': '',
+	'search': 'a',
+	'unique': True,
+	'table': 'default',
+	'tables': ['default'],
+	'default': True,
+	'traits': ['Traits/1'],
+	'traitsets': ['Traitsets/1'],
+}
+
+def existing(db, collection):
+	return db.collection(collection).indexes()
+
+def missing(db):
+	"""returns the declared indexes that don't exist yet"""
+	result = []
+	for collection in sorted(set(index.collection for index in INDEXES)):
+		current = existing(db, collection)
+		for index in INDEXES:
+			if index.collection == collection and not any(index.matches(i) for i in current):
+				result.append(index)
+	return result
+
+def undeclared(db):
+	"""returns the persistent indexes that exist, but aren't declared here"""
+	result = []
+	for collection in sorted(set(index.collection for index in INDEXES)):
+		for current in existing(db, collection):
+			if current.get('type') in ['primary', 'edge']:
+				continue
+			if not any(index.collection == collection and index.matches(current) for index in INDEXES):
+				result.append(f"{ collection }({ ', '.join(current.get('fields', [])) }) { current.get('name') }")
+	return result
+
+def provision(db):
+	"""
+	Creates the declared indexes that are missing and logs the ones that aren't declared.
+
+	Args:
+		db: python-arango database.
+
+	Returns:
+		list: The indexes that were created.
+	"""
+	created = []
+	for index in missing(db):
+		logging.warning(f"indexes\tcreating { index }")
+		db.collection(index.collection).add_persistent_index(
+			index.fields,
+			sparse=index.sparse,
+			name=index.name,
+			in_background=True
+		)
+		created.append(index)
+	for index in undeclared(db):
+		logging.warning(f"indexes\tundeclared index { index }")
+	return created
+
+def _nodes(plan):
+	"""the execution nodes of a plan, including the ones of its subqueries"""
+	for node in plan.get('nodes', []):
+		yield node
+		if node.get('subquery') is not None:
+			yield from _nodes(node.get('subquery'))
+
+def _bind_vars(query):
+	return {
+		name: SAMPLE_BIND_VARS.get(name, '')
+		for name in set(re.findall(r'(?<!@)@(\w+)', query))
+	}
+
+def explain(db, name):
+	"""
+	Explains a registered query.
+
+	Args:
+		db: python-arango database.
+		name (str): Name of the registered query.
+
+	Returns:
+		dict: `full_scans`, the collections the plan reads entirely,
+			and `indexes`, the names of the indexes the plan uses.
+	"""
+	query = queries.QUERIES[name]
+	plan = db.aql.explain(query, bind_vars=_bind_vars(query))
+	full_scans = []
+	indexes = []
+	for node in _nodes(plan):
+		if node.get('type') == 'EnumerateCollectionNode':
+			full_scans.append(node.get('collection'))
+		for index in node.get('indexes', []):
+			indexes.append(index.get('name'))
+	return { 'full_scans': full_scans, 'indexes': indexes }
+
+def check(db):
+	"""
+	Explains every registered query.
+
+	Args:
+		db: python-arango database.
+
+	Returns:
+		dict: The collections scanned entirely, by the name of every query that isn't allowed to.
+	"""
+	failures = {}
+	for name in sorted(queries.QUERIES):
+		if name in FULL_SCANS:
+			continue
+		full_scans = explain(db, name).get('full_scans')
+		if len(full_scans) > 0:
+			failures[name] = full_scans
+	return failures
+
+def report(db):
+	"""returns the missing and undeclared indexes, and the declared ones that no registered query uses"""
+	used = set()
+	for name in queries.QUERIES:
+		used.update(explain(db, name).get('indexes'))
+	return {
+		'missing': [str(index) for index in missing(db)],
+		'undeclared': undeclared(db),
+		# these may still be used by the `find` calls, which can't be explained
+		'unused': [str(index) for index in INDEXES if index.name not in used]
+	}
+
+def _register_all():
+	"""imports the modules that register queries, including both sortings of the look-ahead fragments"""
+	import lookahead
+	for sorting in [None, 'NAME']:
+		lookahead.location_traitset_traits(sorting)
+		lookahead.entity_traitset_traits(sorting)
+
+if __name__ == "__main__":
+	from transversal import db
+	_register_all()
+	for index in provision(db):
+		print("created index: ", index)
+	for key, values in report(db).items():
+		for value in values:
+			print(f"{ key } index: ", value)
+	failures = check(db)
+	for name, collections in failures.items():
+		print(f"full collection scan in query { name }: ", ", ".join(collections))
+	sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,233 @@
+"""
+	Ingest of the images ComfyUI generates
+
+	ComfyUI writes a generated image to `<imagens>/<entity key>/` or `<imagens>/<entity key>/<region key>/`.
+	The watcher follows the folder with inotify and hands every finished image over to a callback,
+	where inotify isn't available it scans the folder and takes the files whose size stopped changing.
+	An image is claimed by moving it to `<imagens>/.ingest/` first, so it's only ever ingested once.
+
+	Run `python ingest.py <imagens folder>` to print the images that would be ingested.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from uuid import uuid4
+
+import images
+
+CLAIMS = '.ingest'
+SETTLE = 0.5 # seconds between the scans that wait for an image to be finished
+PRUNE_AGE = 60 # seconds an empty folder is kept, ComfyUI may still write to it
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct('iIII') # wd, mask, cookie, length of the name
+
+class Inotify:
+	"""the few inotify calls the watcher needs, through libc"""
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1")
+		self.folders = {} # watch descriptor -> folder
+
+	def watch(self, folder):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_add_watch: " + folder)
+		self.folders[wd] = folder
+
+	def read(self, timeout):
+		"""waits for events, returns (path, mask) pairs, the path is None when events were lost"""
+		ready, _, _ = select.select([self.fd], [], [], timeout)
+		if not ready:
+			return []
+		try:
+			data = os.read(self.fd, 1 << 16)
+		except BlockingIOError:
+			return []
+		events = []
+		offset = 0
+		while offset < len(data):
+			wd, mask, _, length = EVENT.unpack_from(data, offset)
+			name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+			offset += EVENT.size + length
+			if mask & IN_Q_OVERFLOW:
+				events.append((None, mask))
+			elif mask & IN_IGNORED:
+				self.folders.pop(wd, None) # the folder was removed
+			elif wd in self.folders:
+				events.append((os.path.join(self.folders[wd], os.fsdecode(name)), mask))
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+class ImagenWatcher:
+	"""
+		Follows the imagens folder in a thread, and calls `ingest(path, entity_key, location_key)`
+		for every finished image. The path is the claimed image, the callback owns it.
+	"""
+	def __init__(self, folder, ingest, interval=2.0):
+		self.folder = folder
+		self.ingest = ingest
+		self.interval = interval # seconds between scans
+		self.seen = {} # path -> (size, modified), as found by the last scan
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		if self.thread is None:
+			self.thread = threading.Thread(target=self.run, name='imagen-watcher', daemon=True)
+			self.thread.start()
+		return self
+
+	def stop(self):
+		self.stopped.set()
+
+	def _parse(self, path):
+		"""the entity and region key of an image in the folder, None for anything that isn't an image"""
+		parts = os.path.relpath(path, self.folder).split(os.sep)
+		if len(parts) not in (2, 3) or any(part.startswith('.') for part in parts):
+			return None
+		if images.image_format(os.path.splitext(parts[-1])[1]) is None:
+			return None
+		return parts[0], parts[1] if len(parts) == 3 else None
+
+	def _images(self):
+		for folder, folders, files in os.walk(self.folder):
+			folders[:] = [name for name in folders if not name.startswith('.')]
+			for name in files:
+				path = os.path.join(folder, name)
+				if self._parse(path) is not None:
+					yield path
+
+	def claim(self, path):
+		"""
+		Moves an image out of the way of other watchers and hands it to the callback.
+
+		Returns:
+			bool: Whether the image was ingested, False when it was gone or wasn't an image.
+		"""
+		keys = self._parse(path)
+		if keys is None:
+			return False
+		claims = os.path.join(self.folder, CLAIMS)
+		os.makedirs(claims, exist_ok=True)
+		claimed = os.path.join(claims, f"{ uuid4() }{ os.path.splitext(path)[1].lower() }")
+		try:
+			os.rename(path, claimed)
+		except FileNotFoundError:
+			return False # claimed by another watcher
+		self.seen.pop(path, None)
+		try:
+			self.ingest(claimed, *keys)
+		except Exception as e:
+			logging.error(f"ingest\tcould not ingest { path } (claimed as { claimed }): { e }")
+		return True
+
+	def scan(self):
+		"""claims the images that didn't change since the last scan, returns how many"""
+		seen = {}
+		claimed = 0
+		for path in self._images():
+			try:
+				stat = os.stat(path)
+			except FileNotFoundError:
+				continue
+			seen[path] = (stat.st_size, stat.st_mtime_ns)
+			if stat.st_size > 0 and self.seen.get(path) == seen[path]:
+				try:
+					claimed += self.claim(path)
+					seen.pop(path)
+				except OSError as e:
+					logging.error(f"ingest\tcould not claim { path }: { e }")
+		self.seen = seen
+		self._prune()
+		return claimed
+
+	def _prune(self):
+		"""removes the folders ComfyUI made once they're empty, and didn't change for a while"""
+		for folder, folders, files in os.walk(self.folder, topdown=False):
+			if os.path.normpath(folder) == os.path.normpath(self.folder) or os.path.basename(folder).startswith('.'):
+				continue
+			try:
+				if len(os.listdir(folder)) == 0 and time.time() - os.stat(folder).st_mtime >= PRUNE_AGE:
+					os.rmdir(folder)
+			except OSError:
+				pass # written to or removed in the meantime
+
+	def _watch(self, inotify, folder):
+		for path, folders, _ in os.walk(folder):
+			folders[:] = [name for name in folders if not name.startswith('.')]
+			try:
+				inotify.watch(path)
+			except FileNotFoundError:
+				pass # removed again, like after its image was claimed
+
+	def run(self):
+		os.makedirs(self.folder, exist_ok=True)
+		try:
+			inotify = Inotify()
+			self._watch(inotify, self.folder)
+		except (OSError, AttributeError) as e:
+			logging.warning(f"ingest\tinotify isn't available, scanning { self.folder } every { self.interval } seconds: { e }")
+			inotify = None
+		next_scan = 0
+		try:
+			while not self.stopped.is_set():
+				timeout = max(next_scan - time.monotonic(), 0)
+				if inotify is None:
+					self.stopped.wait(timeout)
+				else:
+					try:
+						events = inotify.read(timeout)
+					except OSError as e:
+						logging.error(f"ingest\tcould not read the inotify events: { e }")
+						events = [(None, 0)]
+						self.stopped.wait(self.interval)
+					for path, mask in events:
+						try:
+							if path is None:
+								next_scan = 0 # events were lost, the scan finds their images
+							elif mask & IN_ISDIR:
+								if not os.path.basename(path).startswith('.'):
+									self._watch(inotify, path)
+									# an image can be written before its folder is watched
+									next_scan = min(next_scan, time.monotonic() + SETTLE)
+							elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+								self.claim(path)
+						except Exception as e:
+							# the scan tries the image again
+							logging.error(f"ingest\tcould not claim { path }: { e }")
+				# the scan also finds the images that were written before the watcher started
+				if time.monotonic() >= next_scan:
+					try:
+						self.scan()
+					except Exception as e:
+						logging.error(f"ingest\tscan of { self.folder } failed: { e }")
+					pending = inotify is not None and len(self.seen) > 0
+					next_scan = time.monotonic() + (SETTLE if pending else self.interval)
+		finally:
+			if inotify is not None:
+				inotify.close()
+
+if __name__ == "__main__":
+	watcher = ImagenWatcher(sys.argv[1], None)
+	for path in watcher._images():
+		entity_key, location_key = watcher._parse(path)
+		print(f"{ entity_key }\t{ location_key or '' }\t{ path }")
@@ -0,0 +1,142 @@
+"""
+	Background image jobs
+
+	Requests spool the image to a file and submit a job, worker processes make the derivatives
+	(see `images.derivatives`) so encoding never holds the GIL of the API threads. The status
+	of the jobs this process submitted can be queried by id until they're forgotten, it's only
+	kept in memory, so with several flask workers only the worker that took the upload knows it.
+	The `imagening` flag of the entity is the status every worker agrees on.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from uuid import uuid4
+
+import images
+
+HISTORY = 256 # finished jobs whose status is kept
+
+class ImageJob:
+	QUEUED = 'queued'
+	DONE = 'done'
+	FAILED = 'failed'
+
+	def __init__(self, entity_key, folder):
+		self.id = str(uuid4())
+		self.entity_key = entity_key
+		self.folder = folder
+		self.state = self.QUEUED
+		self.error = None
+		self.sizes = None
+		self.submitted = time.time()
+		self.finished = None
+
+	def status(self):
+		return {
+			'id': self.id,
+			'entity_key': self.entity_key,
+			'state': self.state,
+			'error': self.error,
+			'sizes': self.sizes,
+			'submitted': self.submitted,
+			'finished': self.finished
+		}
+
+class ImageJobs:
+	"""
+		Process pool for image derivatives, and the status of the submitted jobs.
+
+		The workers are forked, a spawned worker would import `app.py` again as its main module
+		and connect to the database, a forked worker only ever runs `images.derivatives`.
+		A forked child inherits the locks other threads hold at that moment, so `start` forks
+		all workers while the app still runs on its main thread, and the workers are kept.
+		When a worker dies the pool is broken, new workers aren't forked from the running app,
+		the jobs fail until the process is restarted.
+	"""
+	def __init__(self, spool, workers=2):
+		self.spool = spool
+		self.workers = workers
+		self.lock = threading.Lock()
+		self.executor = None
+		self.jobs = {} # id -> ImageJob, in the order they were submitted
+
+	def start(self):
+		"""forks the workers, before the app starts any thread"""
+		with self.lock:
+			if self.executor is None:
+				context = multiprocessing.get_context('fork')
+				self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+				# the first job forks every worker of a fork context pool
+				self.executor.submit(os.getpid).result()
+		return self
+
+	def _submit(self, *args):
+		if self.executor is None:
+			raise Exception("image jobs aren't started: ", self.spool)
+		try:
+			return self.executor.submit(*args)
+		except BrokenProcessPool:
+			logging.error(f"image jobs\ta worker died and the pool takes no more jobs, restart the app")
+			raise
+
+	def spool_file(self, extension):
+		"""a new path in the spool folder, the spool is on the same disk as the uploads"""
+		os.makedirs(self.spool, exist_ok=True)
+		return os.path.join(self.spool, f"{ uuid4() }{ extension.lower() }")
+
+	def submit(self, path, folder, extension, entity_key, done=None):
+		"""
+		Makes the derivatives of a spooled image in a worker process.
+
+		Args:
+			path (str): The spooled image, it's removed when the job is finished.
+			folder (str): Folder the original and the derivatives are written to.
+			extension (str): Extension of the files.
+			entity_key (str): The entity the image belongs to.
+			done (function): Called with the job when it's finished, successfully or not.
+
+		Returns:
+			ImageJob: The job, its status changes when it's finished.
+		"""
+		job = ImageJob(entity_key, folder)
+		with self.lock:
+			self.jobs[job.id] = job
+			self._forget()
+
+		def finished(future):
+			try:
+				job.sizes = future.result()
+				job.state = ImageJob.DONE
+			except Exception as e:
+				logging.error(f"image jobs\tjob { job.id } for entity { entity_key } failed: { e }")
+				job.error = str(e)
+				job.state = ImageJob.FAILED
+			job.finished = time.time()
+			if os.path.exists(path):
+				os.remove(path)
+			if done is not None:
+				try:
+					done(job)
+				except Exception as e:
+					logging.error(f"image jobs\tafter job { job.id }: { e }")
+		try:
+			future = self._submit(images.derivatives, path, folder, extension)
+		except Exception as e:
+			future = Future()
+			future.set_exception(e)
+		future.add_done_callback(finished)
+		return job
+
+	def _forget(self):
+		finished = [id for id, job in self.jobs.items() if job.finished is not None]
+		for id in finished[:max(len(finished) - HISTORY, 0)]:
+			del self.jobs[id]
+
+	def get(self, id):
+		return self.jobs.get(id)
+
+image_jobs = ImageJobs(os.environ.get("IMAGE_SPOOL", "/media/uploads/.spool"), int(os.environ.get("IMAGE_WORKERS", 2)))
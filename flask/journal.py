@@ -0,0 +1,122 @@
+"""
+	Append-only journal of the changes to the session of a table, with periodic snapshots
+
+	Every change is one JSON line { seq, event, args, time } in a segment file, a snapshot
+	holds the whole session after a sequence number. A new segment starts after every snapshot,
+	the old segments are kept, so the journal also holds the history of every session played.
+
+	<folder>/<table>/snapshot.json
+	<folder>/<table>/<sequence number of the first event>.jsonl
+
+	Run `python journal.py <folder> <table>` to count the events of a table.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SNAPSHOT_INTERVAL = 500 # events between snapshots
+
+class Journal:
+	"""the journal of one table, its writes are serialized by the table's session state"""
+	def __init__(self, folder, table, interval=SNAPSHOT_INTERVAL):
+		self.folder = os.path.join(folder, table)
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.seq = 0 # sequence number of the last event
+		self.snapshot_seq = None # sequence number of the last snapshot
+		self.segment = None
+
+	def _segments(self):
+		"""the segment files, by the sequence number of their first event"""
+		if not os.path.isdir(self.folder):
+			return []
+		return sorted(
+			(int(name[:-len('.jsonl')]), os.path.join(self.folder, name))
+			for name in os.listdir(self.folder) if name.endswith('.jsonl')
+		)
+
+	def events(self, after=0):
+		"""yields the events with a sequence number higher than `after`, in order"""
+		segments = self._segments()
+		for i, (start, path) in enumerate(segments):
+			# segments that end before `after` are skipped without reading them
+			if i + 1 < len(segments) and segments[i + 1][0] <= after + 1:
+				continue
+			with open(path) as segment:
+				for line in segment:
+					if not line.endswith("\n"):
+						break # a write that was cut off
+					event = json.loads(line)
+					if event.get('seq') > after:
+						yield event
+
+	def recover(self):
+		"""
+		Reads the last snapshot and the events after it.
+
+		Returns:
+			tuple: The document of the snapshot, or None if there is none, and the events after it.
+		"""
+		document = None
+		self.snapshot_seq = None
+		path = os.path.join(self.folder, 'snapshot.json')
+		if os.path.exists(path):
+			with open(path) as snapshot:
+				snapshot = json.load(snapshot)
+			document = snapshot.get('session')
+			self.snapshot_seq = snapshot.get('seq')
+		events = list(self.events(self.snapshot_seq or 0))
+		self.seq = events[-1].get('seq') if len(events) > 0 else self.snapshot_seq or 0
+		return document, events
+
+	def append(self, event, args):
+		"""
+		Writes an event.
+
+		Returns:
+			bool: Whether a snapshot is due.
+		"""
+		with self.lock:
+			if self.segment is None:
+				self._open(self.seq + 1)
+			self.seq += 1
+			self.segment.write(json.dumps({
+				'seq': self.seq,
+				'event': event,
+				'args': args,
+				'time': round(time.time(), 3)
+			}, separators=(',', ':')) + "\n")
+			self.segment.flush()
+			return self.snapshot_seq is None or self.seq - self.snapshot_seq >= self.interval
+
+	def snapshot(self, document):
+		"""replaces the snapshot with the document of the session after the last event, and starts a new segment"""
+		with self.lock:
+			os.makedirs(self.folder, exist_ok=True)
+			path = os.path.join(self.folder, 'snapshot.json')
+			with open(path + '.tmp', 'w') as snapshot:
+				json.dump({ 'seq': self.seq, 'session': document }, snapshot, separators=(',', ':'))
+			os.replace(path + '.tmp', path)
+			self.snapshot_seq = self.seq
+			self._open(self.seq + 1)
+
+	def _open(self, start):
+		if self.segment is not None:
+			self.segment.close()
+		os.makedirs(self.folder, exist_ok=True)
+		path = os.path.join(self.folder, f"{ start:012d}.jsonl")
+		if os.path.exists(path):
+			# drops a write that was cut off, the next event would end up on its line
+			with open(path, 'rb+') as segment:
+				content = segment.read()
+				segment.truncate(content.rfind(b"\n") + 1)
+		self.segment = open(path, 'a')
+
+if __name__ == "__main__":
+	journal = Journal(sys.argv[1], sys.argv[2])
+	counts = Counter(event.get('event') for event in journal.events())
+	for event, count in counts.most_common():
+		print(f"{ event }: { count }")
@@ -0,0 +1,136 @@
+"""
+	Request-scoped document loaders for the GraphQL resolvers
+"""
+from graphql import OperationType
+
+from transversal import db
+
+class DocumentLoader:
+	"""
+		Batches document reads for a single collection.
+
+		Ids can be queued with `want` while a list of objects is being built,
+		the first `load` afterwards fetches every queued id in one `get_many` call.
+		Every fetched document is kept in an identity map for the rest of the request,
+		so the same document is never fetched twice in one query.
+	"""
+	def __init__(self, collection):
+		self.collection = collection
+		self.documents = {} # _id -> document, or None if the document doesn't exist
+		self.pending = {} # ids waiting for the next batch, a dict to keep the order
+
+	def _id(self, id):
+		return id if '/' in id else f"{ self.collection }/{ id }"
+
+	def want(self, ids):
+		"""queues ids to be fetched with the next batch"""
+		for id in ids:
+			if id:
+				id = self._id(id)
+				if id not in self.documents:
+					self.pending[id] = True
+
+	def prime(self, document):
+		"""adds a document that was already retrieved some other way"""
+		if document is not None and document.get('_id'):
+			self.documents[document.get('_id')] = document
+		return document
+
+	def load(self, id):
+		if not id:
+			return None
+		id = self._id(id)
+		if id not in self.documents:
+			self.pending[id] = True
+			self._dispatch()
+		return self.documents.get(id)
+
+	def load_many(self, ids):
+		self.want(ids)
+		self._dispatch()
+		return [self.documents.get(self._id(id)) for id in ids if id]
+
+	def clear(self, id=None):
+		"""forgets a document, or all documents, after it has been written to"""
+		if id is None:
+			self.documents = {}
+		else:
+			self.documents.pop(self._id(id), None)
+
+	def _dispatch(self):
+		ids = list(self.pending)
+		self.pending = {}
+		if len(ids) == 0:
+			return
+		for document in db.collection(self.collection).get_many(ids):
+			self.documents[document.get('_id')] = document
+		for id in ids:
+			self.documents.setdefault(id, None)
+
+class Loaders:
+	"""one loader per collection, created when first needed"""
+	def __init__(self):
+		self.loaders = {}
+
+	def __getitem__(self, collection):
+		if collection not in self.loaders:
+			self.loaders[collection] = DocumentLoader(collection)
+		return self.loaders[collection]
+
+class LoaderMiddleware:
+	"""starts every mutation with empty loaders, so documents read before its writes aren't reused"""
+	def resolve(self, next, root, info, **args):
+		if info.path.prev is None and info.operation.operation == OperationType.MUTATION:
+			info.context['loaders'] = Loaders()
+		return next(root, info, **args)
+
+def get_loaders(info):
+	"""returns the loaders of the current request, stored in the GraphQL context"""
+	return info.context.setdefault('loaders', Loaders())
+
+def _collection(id, collection):
+	if '/' in id:
+		return id.split('/', 1)[0]
+	if collection is None:
+		raise Exception("no collection given for document key: ", id)
+	return collection
+
+def load(info, id, collection=None):
+	"""
+	Loads a single document through the request's loaders.
+
+	Args:
+		info: GraphQL resolve info of the current request.
+		id (str): Document id, or document key if `collection` is given.
+		collection (str): Collection name, only needed when `id` is a key.
+
+	Returns:
+		dict: The document, or None if it doesn't exist.
+	"""
+	if not id:
+		return None
+	return get_loaders(info)[_collection(id, collection)].load(id)
+
+def load_many(info, ids, collection=None):
+	"""loads the documents that exist, fetching the missing ones per collection in one round trip"""
+	want(info, ids, collection)
+	documents = [load(info, id, collection) for id in ids if id]
+	return [document for document in documents if document is not None]
+
+def is_loaded(info, id, collection=None):
+	"""checks if a document is already in the request's identity map"""
+	loader = get_loaders(info)[_collection(id, collection)]
+	return loader._id(id) in loader.documents
+
+def want(info, ids, collection=None):
+	"""queues documents that resolvers are about to need, so they're fetched in one batch"""
+	for id in ids:
+		if id:
+			get_loaders(info)[_collection(id, collection)].want([id])
+
+def prime(info, documents):
+	"""adds documents that were already retrieved with a query to the identity map"""
+	for document in documents:
+		if document is not None and document.get('_id'):
+			get_loaders(info)[_collection(document.get('_id'), None)].prime(document)
+	return documents
@@ -0,0 +1,421 @@
+"""
+	Selection-set look-ahead for the root GraphQL fields
+"""
+import re
+
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode
+from graphene.utils.str_converters import to_snake_case
+
+import loaders
+import queries
+import transversal as tv
+
+class Fragment:
+	"""
+		A registered AQL query with bind parameters.
+
+		The same fragment is executed on its own by a resolver, or compiled
+		together with other fragments into a single query by a `Plan`.
+	"""
+	def __init__(self, name, query):
+		self.name = queries.register(name, query)
+		self.query = query
+
+	def key(self, bind_vars):
+		return (self.name,) + tuple(sorted(bind_vars.items()))
+
+def _trait_sorting(sorting, name, setting, statement=False):
+	if sorting == 'NAME':
+		return f"SORT { name }, { setting }.statement, MAX({ setting }.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], { setting }.rating_type, true) ASC"
+	if statement:
+		return f"SORT MAX({ setting }.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], { setting }.rating_type, true) ASC, { name }, { setting }.statement"
+	return f"SORT MAX({ setting }.rating) DESC, POSITION(['empty', 'challenge', 'static', 'resource'], { setting }.rating_type, true) ASC, { name }"
+
+# trait settings of an entity and its archetypes, with the traitset they belong to
+ENTITY_TRAIT_SETTINGS = Fragment('entity_trait_settings', """LET archetypes = (
+		FOR v, e, p IN 0..5 OUTBOUND @entity Relations
+		FILTER p.edges[*].type ALL == 'archetype'
+		RETURN v._id
+	)
+	FOR entity IN archetypes
+		FOR trait, traitsetting IN OUTBOUND entity TraitSettings
+		COLLECT traitId = traitsetting._to INTO traitsettings
+	FOR t IN Traits
+		FILTER traitsettings[0].traitsetting._to == t._id
+	FOR set IN Traitsets
+		FILTER t.traitset == set._id
+		FILTER @entity_type IN set.entity_types[*]
+	SORT set.order ASC
+	RETURN MERGE(
+		traitsettings[0].traitsetting,
+		{ traitset: t.traitset }
+	)""")
+
+# default settings of all traitsets of an entity type
+TRAITSET_DEFAULTS = Fragment('traitset_defaults', """FOR set IN Traitsets
+		FILTER @entity_type IN set.entity_types[*]
+	FOR default IN TraitSettings
+		FILTER set._id == default._from
+		FILTER default._to == 'Traits/1'
+	SORT set.order ASC
+	RETURN {
+		traitset: set._id,
+		locations_enabled: default.locations_enabled,
+		locations_disabled: default.locations_disabled
+	}""")
+
+# generic traits of a traitset
+TRAITSET_TRAITS = Fragment('traitset_traits', """FOR trait IN Traits
+	FILTER trait.traitset == @traitset
+	SORT trait.name ASC
+	RETURN trait""")
+
+# sub-trait settings and shortcuts of a trait setting
+SUB_TRAITS = Fragment('sub_traits', """LET sub_traits = (
+		FOR subtraits IN TraitSettings
+		FILTER subtraits._from == @setting
+		FOR trait IN Traits
+		FILTER trait._id == subtraits._to
+		SORT trait.traitset ASC, SUM(ABS(subtraits.rating)), trait._id ASC
+		RETURN subtraits
+	)
+	LET shortcuts = (
+		FOR setting IN TraitSettings
+		FILTER setting._id == @setting
+		FOR shortcut_trait IN setting.shortcut_traits OR []
+		FOR trait_setting IN TraitSettings
+		FILTER shortcut_trait == trait_setting._id
+		RETURN trait_setting
+	)
+	FOR trait_setting IN APPEND(sub_traits, shortcuts)
+	RETURN trait_setting""")
+
+LOCATION_PARENT = Fragment('location_parent', """FOR r IN Relations
+	FILTER r._from == @location
+	FILTER r.type == 'super'
+	RETURN r._to""")
+
+LOCATION_PARENTS = Fragment('location_parents', """FOR v, e, p IN 0..100 OUTBOUND @location Relations
+	FILTER p.edges[*].type ALL == 'super'
+	RETURN v._id""")
+
+LOCATION_ZONES = Fragment('location_zones', """FOR r IN Relations
+	FILTER r._to == @location
+	FILTER r.type == 'super'
+	RETURN r._from""")
+
+LOCATION_TRANSVERSABLES = Fragment('location_transversables', """FOR r IN Relations
+	FILTER r._from == @location
+	FILTER r.type == 'transversable'
+	RETURN r._to""")
+
+def location_traitset_traits(sorting=None):
+	"""direct and inherited trait settings of a location for a traitset"""
+	name = 'location_traitset_traits_by_name' if sorting == 'NAME' else 'location_traitset_traits'
+	return Fragment(name, f"""FOR location IN Entities
+		FILTER location._id == @location
+		FILTER location.type == 'location'
+		LET direct_traits = (
+			FOR setting IN TraitSettings
+				FILTER location._id == setting._from
+			FOR t IN Traits
+				FILTER setting._to == t._id
+				FILTER t.traitset == @traitset
+			{ _trait_sorting(sorting, 't.name', 'setting', statement=True) }
+			RETURN setting
+		)
+		LET parent_locations = (
+			FOR v, e, p IN 0..20 OUTBOUND location._id Relations
+			FILTER p.edges[*].type ALL == 'super'
+			RETURN v._id
+		)
+		LET hierarchies = APPEND([location._id], parent_locations)
+		LET inherited_traits = (
+			FOR entity IN hierarchies
+				FOR trait, traitsetting IN OUTBOUND entity TraitSettings
+				FILTER trait.traitset == @traitset
+				FILTER trait.inheritable == true
+				COLLECT traitId = traitsetting._to INTO traitsettings
+				RETURN traitsettings[0].traitsetting
+		)
+		FOR trait IN UNIQUE(APPEND(direct_traits, inherited_traits))
+		RETURN trait""")
+
+def entity_traitset_traits(sorting=None):
+	"""direct and archetype trait settings of an entity for a traitset, not yet filtered by location"""
+	name = 'entity_traitset_traits_by_name' if sorting == 'NAME' else 'entity_traitset_traits'
+	return Fragment(name, f"""LET direct = (
+			FOR setting IN TraitSettings
+				FILTER setting._from == @entity
+				FOR trait IN Traits
+					FILTER setting._to == trait._id
+					FILTER trait.traitset == @traitset
+				{ _trait_sorting(sorting, 'trait.name', 'setting') }
+				RETURN setting
+		)
+		LET inherited = direct[* FILTER CURRENT.inherited_as != null RETURN CURRENT.inherited_as]
+		LET archetype = (
+			LET archetypes = (
+				FOR v, e, p IN 0..5 OUTBOUND @entity Relations
+				FILTER p.edges[*].type ALL == 'archetype'
+				FILTER v._id != @entity
+				RETURN v._id
+			)
+			FOR entity IN archetypes
+				FOR trait, traitsetting IN OUTBOUND entity TraitSettings
+				FILTER traitsetting._id NOT IN inherited
+				COLLECT traitId = traitsetting._to INTO traitsettings
+			FOR t IN Traits
+				FILTER traitsettings[0].traitsetting._to == t._id
+				FILTER t.traitset == @traitset
+				{ _trait_sorting(sorting, 't.name', 'traitsettings[0].traitsetting') }
+			FOR ts IN traitsettings
+			RETURN ts.traitsetting
+		)
+		RETURN {{ direct: direct, archetype: archetype }}""")
+
+def _prefetched(info):
+	return info.context.setdefault('prefetched', {})
+
+def fetch(info, fragment, **bind_vars):
+	"""
+	Returns the result of a fragment, from the look-ahead plan if it was prefetched.
+
+	Args:
+		info: GraphQL resolve info of the current request.
+		fragment (Fragment): The query to run.
+		**bind_vars: Values of the fragment's bind parameters.
+
+	Returns:
+		list: The documents the query returned.
+	"""
+	key = fragment.key(bind_vars)
+	prefetched = _prefetched(info)
+	if key in prefetched:
+		return prefetched[key]
+	return tv.query(fragment.name, **bind_vars)
+
+class Plan:
+	"""
+		Collects the fragments and documents that the nested resolvers are going to need,
+		and fetches all of them in a single AQL query.
+	"""
+	def __init__(self, info):
+		self.info = info
+		self.fragments = {} # key -> (fragment, bind_vars)
+		self.documents = {} # document ids, a dict to keep the order
+
+	def add(self, fragment, **bind_vars):
+		key = fragment.key(bind_vars)
+		if key not in _prefetched(self.info):
+			self.fragments[key] = (fragment, bind_vars)
+
+	def want(self, ids):
+		for id in ids:
+			if id and id not in self.documents and not loaders.is_loaded(self.info, id):
+				self.documents[id] = True
+
+	def execute(self):
+		"""runs the plan, returns the prefetched results by fragment key"""
+		if len(self.fragments) == 0 and len(self.documents) == 0:
+			return {}
+		lets = []
+		bind_vars = {}
+		for n, (fragment, fragment_vars) in enumerate(self.fragments.values()):
+			# every fragment gets its own namespace for its bind parameters
+			query = re.sub(r'@(\w+)', lambda match: f"@q{ n }_{ match.group(1) }", fragment.query)
+			lets.append(f"LET q{ n } = ({ query })")
+			for name, value in fragment_vars.items():
+				bind_vars[f"q{ n }_{ name }"] = value
+		lets.append("LET documents = DOCUMENT(@documents)")
+		bind_vars['documents'] = list(self.documents)
+		query = "\n".join(lets) + "\nRETURN { documents: documents, results: [" + ", ".join(f"q{ n }" for n in range(len(self.fragments))) + "] }"
+		result = queries.run(tv.db, 'lookahead_plan', query, bind_vars)[0]
+
+		loaders.prime(self.info, result['documents'])
+		prefetched = _prefetched(self.info)
+		results = {}
+		for key, value in zip(self.fragments, result['results']):
+			prefetched[key] = value
+			results[key] = value
+		self.fragments = {}
+		self.documents = {}
+		return results
+
+def selection(info):
+	"""
+	Returns the sub-selection of the field being resolved as a tree of snake_case field names.
+
+	Fragments and inline fragments are merged into the tree,
+	so every field that might be requested for any type is in it.
+	"""
+	tree = {}
+	for field_node in info.field_nodes:
+		_merge(info, field_node.selection_set, tree)
+	return tree
+
+def _merge(info, selection_set, tree):
+	if selection_set is None:
+		return
+	for node in selection_set.selections:
+		if isinstance(node, FieldNode):
+			subtree = tree.setdefault(to_snake_case(node.name.value), {})
+			_merge(info, node.selection_set, subtree)
+		elif isinstance(node, InlineFragmentNode):
+			_merge(info, node.selection_set, tree)
+		elif isinstance(node, FragmentSpreadNode):
+			fragment = info.fragments.get(node.name.value)
+			if fragment is not None:
+				_merge(info, fragment.selection_set, tree)
+
+# planners, one per kind of root field
+
+def plan_entities(info, entities):
+	"""
+	Prefetches what the nested resolvers of the root entities are going to need.
+
+	Args:
+		info: GraphQL resolve info of the root field.
+		entities (list): Entity documents the root field returns.
+	"""
+	tree = selection(info)
+	plan = Plan(info)
+	_plan_entity_fields(info, plan, entities, tree)
+	plan.execute()
+	_plan_trait_fields(info, plan, _prefetched_trait_settings(info), tree.get('traitsets', {}).get('traits', {}))
+	plan.execute()
+
+def plan_traitsets(info, traitsets):
+	"""
+	Prefetches what the nested resolvers of the root traitsets are going to need.
+
+	Args:
+		info: GraphQL resolve info of the root field.
+		traitsets (list): Traitset ids the root field returns.
+	"""
+	tree = selection(info)
+	plan = Plan(info)
+	if 'sfxs' in tree:
+		plan.want(traitsets)
+	if 'traits' in tree:
+		_plan_traitset_traits(info, plan, traitsets)
+	plan.execute()
+	if 'sfxs' in tree:
+		plan.want(sfx for traitset in loaders.load_many(info, traitsets) for sfx in traitset.get('sfxs') or [])
+	_plan_trait_fields(info, plan, _prefetched_trait_settings(info), tree.get('traits', {}))
+	plan.execute()
+
+def plan_traits(info, traits, trait_settings=()):
+	"""
+	Prefetches what the nested resolvers of the root traits are going to need.
+
+	Args:
+		info: GraphQL resolve info of the root field.
+		traits (list): Traits documents the root field returns.
+		trait_settings (list): TraitSettings documents the root field returns.
+	"""
+	tree = selection(info)
+	plan = Plan(info)
+	if trait_settings:
+		plan.want(setting.get('_to') for setting in trait_settings)
+	plan.execute()
+	traits = list(traits) + loaders.load_many(info, [setting.get('_to') for setting in trait_settings])
+	if 'traitset' in tree or 'location_restricted' in tree:
+		plan.want(trait.get('traitset') for trait in traits)
+	if 'possible_sfxs' in tree:
+		plan.want(sfx for trait in traits for sfx in trait.get('possible_sfxs') or [])
+	if 'required_traits' in tree:
+		plan.want(required for trait in traits for required in trait.get('required_traits') or [])
+	_plan_trait_fields(info, plan, trait_settings, tree)
+	plan.execute()
+
+def plan_locations(info, locations):
+	"""
+	Prefetches what the nested resolvers of the root locations are going to need.
+
+	Args:
+		info: GraphQL resolve info of the root field.
+		locations (list): Location documents the root field returns.
+	"""
+	tree = selection(info)
+	plan = Plan(info)
+	for location in locations:
+		if 'parent' in tree and location.get('_id') != 'Entities/2':
+			plan.add(LOCATION_PARENT, location=location.get('_id'))
+		if 'parents' in tree:
+			plan.add(LOCATION_PARENTS, location=location.get('_id'))
+		if 'zones' in tree:
+			plan.add(LOCATION_ZONES, location=location.get('_id'))
+		if 'transversables' in tree:
+			plan.add(LOCATION_TRANSVERSABLES, location=location.get('_id'))
+	_plan_entity_fields(info, plan, locations, tree)
+	results = plan.execute()
+	# the locations these lists point to
+	plan.want(id for result in results.values() for id in result if isinstance(id, str))
+	_plan_trait_fields(info, plan, _prefetched_trait_settings(info), tree.get('traitsets', {}).get('traits', {}))
+	plan.execute()
+
+def _plan_entity_fields(info, plan, entities, tree):
+	if 'location' in tree:
+		plan.want(entity.get('location') for entity in entities if entity.get('type') != 'location')
+	if 'known_to' in tree:
+		plan.want(id for entity in entities for id in entity.get('known_to') or [])
+	if 'archetype' in tree:
+		plan.want(entity.get('archetype_id') for entity in entities)
+	if 'traitsets' in tree:
+		for entity_type in set(entity.get('type') for entity in entities):
+			plan.add(TRAITSET_DEFAULTS, entity_type=entity_type)
+		for entity in entities:
+			plan.add(ENTITY_TRAIT_SETTINGS, entity=entity.get('_id'), entity_type=entity.get('type'))
+		if 'traits' in tree.get('traitsets'):
+			# traitset traits are only resolved per entity for the entity in the context
+			if info.context.get('entity_id') is None:
+				entity_types = set(entity.get('type') for entity in entities)
+			else:
+				entity_types = set(entity.get('type') for entity in entities if entity.get('_id') == info.context.get('entity_id'))
+			traitsets = [
+				traitset.get('_id')
+				for traitset in loaders.prime(info, list(tv.db.collection('Traitsets').all()))
+				if len(entity_types.intersection(traitset.get('entity_types') or [])) > 0
+			]
+			_plan_traitset_traits(info, plan, traitsets)
+
+def _plan_traitset_traits(info, plan, traitsets):
+	entity_id = info.context.get('entity_id')
+	sorting = info.context.get('sorting')
+	if entity_id is None:
+		for traitset in traitsets:
+			plan.add(TRAITSET_TRAITS, traitset=traitset)
+		return
+	entity = loaders.load(info, entity_id, 'Entities') if entity_id.startswith('Entities/') else None
+	if entity is None:
+		# relations and missing entities are left to the resolvers
+		return
+	for traitset in traitsets:
+		if entity.get('type') == 'location':
+			plan.add(location_traitset_traits(sorting), location=entity_id, traitset=traitset)
+		else:
+			plan.add(entity_traitset_traits(sorting), entity=entity_id, traitset=traitset)
+
+def _prefetched_trait_settings(info):
+	"""all trait settings the plan prefetched for traitset trait lists so far"""
+	result = []
+	for key, value in _prefetched(info).items():
+		if key[0].startswith('location_traitset_traits'):
+			result.extend(value)
+		elif key[0].startswith('entity_traitset_traits'):
+			for traits in value:
+				result.extend(traits['direct'] + traits['archetype'])
+	return result
+
+def _plan_trait_fields(info, plan, trait_settings, tree):
+	if len(tree) == 0:
+		return
+	plan.want(setting.get('_to') for setting in trait_settings)
+	if 'sfxs' in tree:
+		plan.want(sfx for setting in trait_settings for sfx in setting.get('sfxs') or [])
+	if 'sub_traits' in tree:
+		for setting in trait_settings:
+			plan.add(SUB_TRAITS, setting=setting.get('_id'))
+	if 'known_to' in tree.get('trait_setting', {}):
+		plan.want(id for setting in trait_settings for id in setting.get('known_to') or [])
@@ -0,0 +1,207 @@
+"""
+	Exact outcome probabilities of dicepools
+
+	A dicepool is rolled, the highest dice that aren't hitches (1s) make up the result,
+	and the dice left over that aren't hitches can be picked as effect dice.
+	The distributions are computed exactly from the die sizes, without simulation,
+	and kept per sorted multiset of die sizes.
+
+	Run `python odds.py` to benchmark the engine.
+"""
+import math
+import re
+import threading
+import time
+
+import numpy as np
+
+CACHE_LIMIT = 4096
+
+class Odds:
+	"""
+		Exact outcome distributions of a dicepool.
+
+		`totals[s]` is the probability that the result is s, `hitches[h]` that h dice are hitches,
+		and `effects[e]` that e effect dice are left after picking the result, not counting the d4
+		that's added when none is left.
+	"""
+	def __init__(self, sizes, result_limit, effect_limit, totals, hitches, effects):
+		self.sizes = sizes
+		self.result_limit = result_limit
+		self.effect_limit = effect_limit
+		self.totals = totals
+		self.hitches = hitches
+		self.effects = effects
+		self.totals.flags.writeable = False
+		self.hitches.flags.writeable = False
+		self.effects.flags.writeable = False
+
+	def mean(self):
+		return float(np.dot(np.arange(len(self.totals)), self.totals))
+
+	def botch(self):
+		"""the probability that every die is a hitch"""
+		return float(self.hitches[-1]) if len(self.sizes) > 0 else 0.0
+
+	def beat(self, target):
+		"""the probability that the result is higher than the target"""
+		return float(self.totals[max(target + 1, 0):].sum())
+
+	def beat_pool(self, other):
+		"""the probability that the result is higher than the result of another dicepool"""
+		below = np.cumsum(other.totals) # below[s]: the other result is s or lower
+		below = np.concatenate(([0.0], below))[:len(self.totals)]
+		below = np.pad(below, (0, len(self.totals) - len(below)), constant_values=1.0)
+		return float(np.dot(self.totals, below))
+
+def die_size(rating):
+	"""the size of a rating like `d8`, None for anything else"""
+	match = re.fullmatch(r'd(\d+)', str(rating or '').strip())
+	if match is None or int(match.group(1)) < 2:
+		return None
+	return int(match.group(1))
+
+def sizes(dice):
+	"""the sorted die sizes of ratings like `d8`, anything else is ignored"""
+	return sorted(size for size in map(die_size, dice) if size is not None)
+
+_binomials_cache = {} # (count, face) -> binomials
+
+def _binomials(count, face):
+	"""binomials[m, c]: the probability that c of m dice uniform over 1 to face show the face"""
+	binomials = _binomials_cache.get((count, face))
+	if binomials is None:
+		m = np.arange(count + 1)[:, None]
+		c = np.arange(count + 1)[None, :]
+		combinations = np.array([[math.comb(i, j) for j in range(count + 1)] for i in range(count + 1)], dtype=float)
+		binomials = np.where(c <= m, combinations * (1 / face) ** c * (1 - 1 / face) ** np.clip(m - c, 0, None), 0.0)
+		binomials.flags.writeable = False
+		_binomials_cache[(count, face)] = binomials
+	return binomials
+
+def totals(sizes, result_limit):
+	"""
+	Computes the distribution of the sum of the highest dice that aren't hitches.
+
+	The faces are visited from the highest down to 2. A die that didn't show a higher face
+	is uniform over the faces left, so the number of undecided dice showing the current face
+	is binomial, whatever their sizes. Once enough dice are picked the sum is final.
+
+	Args:
+		sizes (list): Die sizes of the pool.
+		result_limit (int): Number of dice that make up the result.
+
+	Returns:
+		numpy.ndarray: The probability of every sum, by sum.
+	"""
+	limit = max(min(result_limit, len(sizes)), 0)
+	if limit == 0 or len(sizes) == 0:
+		return np.ones(1)
+	count = len(sizes)
+	highest = max(sizes)
+	size = limit * highest + 1
+	final = np.zeros(size)
+	# undecided[k, s, m]: k dice picked with sum s, m dice of the faces visited so far undecided
+	undecided = np.zeros((limit, size, count + 1))
+	undecided[0, 0, 0] = 1.0
+	for face in range(highest, 1, -1):
+		entering = sizes.count(face)
+		if entering > 0:
+			undecided = np.concatenate((np.zeros((limit, size, entering)), undecided[:, :, :count + 1 - entering]), axis=2)
+		binomials = _binomials(count, face)
+		following = np.zeros_like(undecided)
+		for picked in range(limit):
+			# outcomes[s, m, c]: c of the m undecided dice show the face
+			outcomes = undecided[picked][:, :, None] * binomials[None, :, :]
+			missing = limit - picked
+			for c in range(missing):
+				following[picked + c, c * face:, :count + 1 - c] += outcomes[:size - c * face, c:, c]
+			complete = outcomes[:, :, missing:].sum(axis=(1, 2))
+			final[missing * face:] += complete[:size - missing * face]
+		undecided = following
+	# the undecided dice left are hitches, the result is what was picked so far
+	final += undecided.sum(axis=(0, 2))
+	return final
+
+def hitches(sizes):
+	"""the distribution of the number of hitches, by number"""
+	result = np.ones(1)
+	for size in sizes:
+		result = np.convolve(result, [1 - 1 / size, 1 / size])
+	return result
+
+def effects(hitches, result_limit, effect_limit):
+	"""the distribution of the number of effect dice left after the result dice, by number"""
+	count = len(hitches) - 1
+	result = np.zeros(max(effect_limit, 0) + 1)
+	for h, p in enumerate(hitches):
+		left = count - h - min(max(result_limit, 0), count - h)
+		result[min(left, len(result) - 1)] += p
+	return result
+
+class OddsCache:
+	"""computed odds by sorted die sizes and limits"""
+	def __init__(self, limit=CACHE_LIMIT):
+		self.lock = threading.Lock()
+		self.limit = limit
+		self.odds = {}
+
+	def get(self, sizes, result_limit, effect_limit):
+		key = (tuple(sizes), result_limit, effect_limit)
+		odds = self.odds.get(key)
+		if odds is None:
+			hitch_distribution = hitches(sizes)
+			odds = Odds(
+				key[0],
+				result_limit,
+				effect_limit,
+				totals(list(key[0]), result_limit),
+				hitch_distribution,
+				effects(hitch_distribution, result_limit, effect_limit)
+			)
+			with self.lock:
+				if len(self.odds) >= self.limit:
+					self.odds = {}
+				self.odds[key] = odds
+		return odds
+
+odds_cache = OddsCache()
+
+def odds(dice, result_limit=2, effect_limit=1):
+	"""
+	Returns the exact outcome distributions of a dicepool.
+
+	Args:
+		dice (list): Die ratings like `d8`, in any order.
+		result_limit (int): Number of dice that make up the result.
+		effect_limit (int): Number of effect dice that can be picked.
+
+	Returns:
+		Odds: The distributions, shared by every pool with the same dice.
+	"""
+	return odds_cache.get(sizes(dice), result_limit, effect_limit)
+
+def benchmark(dice, repeat=200):
+	"""returns the milliseconds a computation of the odds of a dicepool takes, without and with the cache"""
+	key = sizes(dice)
+	start = time.perf_counter()
+	for _ in range(repeat):
+		hitch_distribution = hitches(key)
+		totals(key, 2)
+		effects(hitch_distribution, 2, 1)
+	computed = (time.perf_counter() - start) * 1000 / repeat
+	odds(dice)
+	start = time.perf_counter()
+	for _ in range(repeat):
+		odds(dice)
+	cached = (time.perf_counter() - start) * 1000 / repeat
+	return computed, cached
+
+if __name__ == "__main__":
+	for dice in [
+		['d8', 'd8'],
+		['d6', 'd8', 'd8', 'd10', 'd12'],
+		['d4', 'd6', 'd6', 'd8', 'd8', 'd8', 'd10', 'd10', 'd12', 'd12', 'd12', 'd12'],
+	]:
+		computed, cached = benchmark(dice)
+		print(f"{ len(dice) } dice: { computed:.3f} ms computed, { cached:.4f} ms cached, mean result { odds(dice).mean():.2f}")
@@ -0,0 +1,336 @@
+"""
+	Registry of named AQL queries
+
+	Every query is a static text with bind parameters, so ArangoDB can reuse its plan
+	and its query result cache, and the latency of every query is measured by name.
+"""
+import threading
+import time
+
+QUERIES = {} # name -> AQL text
+
+class QueryStats:
+	"""latency of the executed queries, by query name"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.stats = {} # name -> { count, total, max } in seconds
+
+	def record(self, name, duration):
+		with self.lock:
+			stats = self.stats.setdefault(name, { 'count': 0, 'total': 0.0, 'max': 0.0 })
+			stats['count'] += 1
+			stats['total'] += duration
+			stats['max'] = max(stats['max'], duration)
+
+	def report(self):
+		"""returns the count, mean and maximum latency in milliseconds of every query"""
+		with self.lock:
+			return {
+				name: {
+					'count': stats['count'],
+					'total_ms': round(stats['total'] * 1000, 3),
+					'mean_ms': round(stats['total'] * 1000 / stats['count'], 3),
+					'max_ms': round(stats['max'] * 1000, 3)
+				}
+				for name, stats in sorted(self.stats.items(), key=lambda item: item[1]['total'], reverse=True)
+			}
+
+	def reset(self):
+		with self.lock:
+			self.stats = {}
+
+query_stats = QueryStats()
+
+def register(name, query):
+	"""
+	Adds a query to the registry.
+
+	Args:
+		name (str): Unique name of the query, used for execution and in the latency report.
+		query (str): Static AQL text, every value has to be passed as a bind parameter.
+
+	Returns:
+		str: The name of the query.
+	"""
+	if name in QUERIES and QUERIES[name] != query:
+		raise Exception("query registered twice with different texts: ", name)
+	QUERIES[name] = query
+	return name
+
+def run(db, name, query, bind_vars=None):
+	"""runs an AQL text that was composed at runtime, its latency is recorded under the given name"""
+	start = time.perf_counter()
+	try:
+		return list(db.aql.execute(query, bind_vars=bind_vars or {}))
+	finally:
+		query_stats.record(name, time.perf_counter() - start)
+
+def execute(db, name, **bind_vars):
+	"""
+	Executes a registered query.
+
+	Args:
+		db: python-arango database to run the query on.
+		name (str): Name of the registered query.
+		**bind_vars: Values of the query's bind parameters.
+
+	Returns:
+		list: All documents the query returned.
+	"""
+	if name not in QUERIES:
+		raise Exception("unknown query: ", name)
+	return run(db, name, QUERIES[name], bind_vars)
+
+def stats():
+	return query_stats.report()
+
+
+# Traits and trait settings
+
+TRAIT_SETTINGS_WITH_SFX = register('trait_settings_with_sfx', """FOR ts IN TraitSettings
+	FILTER @sfx IN ts.sfxs[*]
+	RETURN ts""")
+
+# compares statements after trimming, so an empty statement matches a missing one
+RESOURCE_POCKETS = register('resource_pockets', """FOR setting IN TraitSettings
+	FILTER setting._from == @entity
+	FILTER setting._to == @trait
+	FILTER TRIM(setting.statement) == TRIM(@statement)
+	RETURN setting""")
+
+TRAIT_SETTINGS_BETWEEN = register('trait_settings_between', """FOR setting IN TraitSettings
+	FILTER setting._from == @entity
+	FILTER setting._to == @trait
+	RETURN setting""")
+
+SUB_TRAIT_SETTINGS = register('sub_trait_settings', """FOR setting IN TraitSettings
+	FILTER setting._from == @setting
+	FILTER setting._to != 'Traits/1'
+	RETURN setting""")
+
+RELATION_TRAITSET_TRAITS = register('relation_traitset_traits', """FOR traitsettings IN TraitSettings
+	FILTER traitsettings._from == @relation
+	FOR trait IN Traits
+		FILTER traitsettings._to == trait._id
+		FILTER trait.traitset == @traitset
+	SORT TO_NUMBER(SUBSTRING(MAX(traitsettings.rating), 1)) DESC, trait.name
+	RETURN { id: trait._id, setting: traitsettings._id }""")
+
+RELATION_TRAIT_SETTINGS = register('relation_trait_settings', """FOR traitsetting IN TraitSettings
+	FILTER traitsetting._from == @relation
+	FOR trait IN Traits
+		FILTER traitsetting._to == trait._id
+		FILTER trait.traitset == @traitset
+	RETURN { trait: trait._id, traitsetting: traitsetting._id }""")
+
+TRAITSET_SCORE = register('traitset_score', """LET Scores = [
+		{ 'rating': -5, 'score': -8 },
+		{ 'rating': -4, 'score': -5 },
+		{ 'rating': -3, 'score': -3 },
+		{ 'rating': -2, 'score': -2 },
+		{ 'rating': -1, 'score': -1 },
+		{ 'rating': 1, 'score': 1 },
+		{ 'rating': 2, 'score': 2 },
+		{ 'rating': 3, 'score': 3 },
+		{ 'rating': 4, 'score': 5 },
+		{ 'rating': 5, 'score': 8 }
+	]
+	RETURN SUM(
+		FOR setting IN TraitSettings
+			FILTER setting._from == @entity
+		FOR trait IN Traits
+			FILTER setting._to == trait._id
+			FILTER trait.traitset == @traitset
+			FOR r IN setting.rating
+				FOR s IN Scores
+					FILTER r == s.rating
+					RETURN s.score
+	)""")
+
+CHARACTER_SCORE = register('character_score', """LET Scores = [
+		{ 'rating': 'd4', 'score': 1 },
+		{ 'rating': 'd6', 'score': 2 },
+		{ 'rating': 'd8', 'score': 3 },
+		{ 'rating': 'd10', 'score': 4 },
+		{ 'rating': 'd12', 'score': 5 }
+	]
+	RETURN SUM(
+		FOR setting IN TraitSettings
+			FILTER setting._from == @character
+		FOR trait IN Traits
+			FILTER setting._to == trait._id
+			FILTER trait.traitset != 'Traitsets/906379'
+			FOR r IN setting.rating
+				FOR s IN Scores
+					FILTER r == s.rating
+					RETURN s.score
+	)""")
+
+ENTITY_TRAITSET_TRAIT_DOCUMENTS = register('entity_traitset_trait_documents', """FOR traitsetting IN TraitSettings
+	FILTER traitsetting._from == @entity
+	FOR trait IN Traits
+		FILTER traitsetting._to == trait._id
+		FILTER trait.traitset == @traitset
+	RETURN trait""")
+
+# traits of a traitset that an entity can still learn, with their default settings
+POTENTIAL_TRAITS = register('potential_traits', """LET location = (
+		FOR e IN Entities
+		FILTER e._id == @entity
+		RETURN e.location
+	)
+	LET location_hierarchy = (
+		FOR v, e, p IN 0..20 OUTBOUND location[0] Relations
+		FILTER p.edges[*].type ALL == 'super'
+		RETURN v._id
+	)
+	LET connected_traits = (
+		FOR traitsetting IN TraitSettings
+			FILTER traitsetting._from == @entity
+			RETURN traitsetting._to
+	)
+	FOR t IN Traits
+		FILTER t.traitset == @traitset
+		FILTER NOT @unique OR t._id NOT IN connected_traits
+		FILTER LENGTH(t.required_traits) == 0
+			OR LENGTH(MINUS(t.required_traits, connected_traits)) == 0
+	LET default_trait = (
+		FOR def_setting IN TraitSettings
+			FILTER def_setting._from == t._id
+			FILTER def_setting._to == 'Traits/1'
+			RETURN def_setting
+	)
+	SORT t.name, TO_NUMBER(SUBSTRING(default_trait[0].rating[0], 1)) ASC
+	RETURN { location_hierarchy: location_hierarchy, trait: t, default: default_trait }""")
+
+TRAITSETS_OF_TYPE = register('traitsets_of_type', """FOR traitsets IN Traitsets
+	FILTER @entity_type IN traitsets.entity_types[*]
+	SORT traitsets.order ASC
+	RETURN traitsets""")
+
+ALL_TRAITSETS = register('all_traitsets', """FOR traitsets IN Traitsets
+	SORT traitsets.order ASC, traitsets.name ASC
+	RETURN traitsets""")
+
+ALL_SFXS = register('all_sfxs', """FOR sfx IN SFXs
+	SORT sfx.name ASC
+	RETURN sfx""")
+
+
+# Entities and locations
+
+ENTITY_RELATIONS = register('entity_relations', """FOR relation IN Relations
+	FILTER relation._from == @entity
+	FOR e IN Entities
+	FILTER e._id == relation._to
+	FILTER relation.type == 'relation'
+	SORT relation.favorite DESC, POSITION(['character', 'npc', 'asset', 'faction', 'location'], e.type, true) ASC, e.name ASC
+	RETURN relation""")
+
+ENTITY_TRAITSET_SETTINGS = register('entity_traitset_settings', """FOR ts IN TraitsetSettings
+	FILTER ts._from == @entity
+	RETURN ts""")
+
+ENTITIES_OF_TYPE = register('entities_of_type', """FOR e IN Entities
+	FILTER e.type == @entity_type
+	RETURN e""")
+
+# entities active at a table, entities without a table belong to the default table
+ACTIVE_TABLE_ENTITIES = register('active_table_entities', """FOR e IN Entities
+	FILTER e.active == true
+	FILTER e.type == @entity_type
+	FILTER e.table == @table OR (@default AND e.table == null)
+	RETURN e""")
+
+IMAGENING_TABLE_ENTITIES = register('imagening_table_entities', """FOR e IN Entities
+	FILTER e.imagening == true
+	FILTER e.table == @table OR (@default AND e.table == null)
+	RETURN e""")
+
+LOCATION_SUBTREE = register('location_subtree', """FOR v, e, p IN 0..100 INBOUND @location Relations
+	FILTER p.edges[*].type ALL == 'super'
+	RETURN v""")
+
+LOCATION_ENTITIES = register('location_entities', """FOR e IN Entities
+	FILTER e.location == @location
+	SORT POSITION(['character', 'npc', 'asset', 'faction'], e.type, true) ASC, e.name ASC
+	RETURN e""")
+
+# a null search matches every entity
+SEARCH_ENTITIES = register('search_entities', """FOR e IN Entities
+	FILTER @search == null OR LIKE(e.name, CONCAT('%', @search, '%'), true)
+	SORT POSITION(['character', 'npc', 'asset', 'faction', 'location'], e.type, true) ASC, e.name ASC
+	RETURN e""")
+
+SEARCH_ENTITIES_OF_TYPE = register('search_entities_of_type', """FOR e IN Entities
+	FILTER @search == null OR LIKE(e.name, CONCAT('%', @search, '%'), true)
+	FILTER e.type == @entity_type
+	SORT e.name ASC
+	RETURN e""")
+
+
+# Image generation prompts
+
+LOCATION_PROMPT = register('location_prompt', """FOR entity IN Entities
+	FILTER entity._id == @entity
+	LET traits = (
+		FOR s IN TraitSettings
+			FILTER entity._id == s._from
+		FOR t IN Traits
+			FILTER s._to == t._id
+		RETURN [t.name, s.statement, s.rating[0], s.notes, s.rating_type]
+	)
+	LET hierarchy = (
+		FOR v, e, p IN 0..20 OUTBOUND entity Relations
+		FILTER p.edges[*].type ALL == 'super'
+		LET hierarchy_traits = (
+			FOR s IN TraitSettings
+				FILTER v._id == s._from
+				FILTER s.rating_type != 'resource'
+			FOR t IN Traits
+				FILTER s._to == t._id
+			RETURN [t.name, s.statement, s.rating[0]]
+		)
+		RETURN [v.name, v.description, hierarchy_traits]
+	)
+	LET zones = (
+		FOR v, e, p IN 0..1 INBOUND entity Relations
+		FILTER p.edges[*].type ALL == 'super'
+		RETURN [v.name, v.description]
+	)
+	RETURN {
+		entity: entity.name,
+		description: entity.description,
+		traits: traits,
+		hierarchy: hierarchy,
+		zones: zones
+	}""")
+
+FACTION_PROMPT = register('faction_prompt', """FOR entity IN Entities
+	FILTER entity._id == @entity
+	LET traits = (
+		FOR s IN TraitSettings
+			FILTER entity._id == s._from
+		FOR t IN Traits
+			FILTER s._to == t._id
+		RETURN [t.name, s.statement, s.rating[0]]
+	)
+	LET genres = (
+		FOR v, e, p IN 0..20 OUTBOUND entity.location Relations
+		FILTER p.edges[*].type ALL == 'super'
+		LET hierarchy_traits = (
+			FOR s IN TraitSettings
+				FILTER v._id == s._from
+			FOR t IN Traits
+				FILTER s._to == t._id
+				FILTER t.name == 'genre'
+			RETURN s.statement
+		)
+		RETURN hierarchy_traits
+	)
+	RETURN {
+		entity: entity.name,
+		description: entity.description,
+		traits: traits,
+		genres: FLATTEN(genres)
+	}""")
@@ -0,0 +1,158 @@
+"""
+	Server side dice rolls, and the audit log they are written to
+
+	Every table has a secret seed, a roll is generated from the seed and the number of rolls
+	made at the table before, so it can be generated again to verify it. The log only holds
+	a commitment to the seed, the seed itself is written to the log when the table starts a
+	new session and takes a new seed. From then on everyone can replay the rolls of the old seed.
+
+	Run `python rolls.py` to verify the log.
+"""
+import hashlib
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+
+import numpy as np
+
+import odds
+
+def new_seed():
+	return secrets.token_hex(16)
+
+def commitment(seed):
+	"""a short hash of the seed, rolls refer to their seed with it"""
+	return hashlib.sha256(seed.encode()).hexdigest()[:16]
+
+def roll(seed, counter, sizes, explode=False):
+	"""
+	Rolls a whole pool at once.
+
+	Args:
+		seed (str): Hexadecimal seed of the table.
+		counter (int): Number of rolls made with the seed before, every roll gets its own stream.
+		sizes (list): Die sizes.
+		explode (bool): Whether a die that rolls its highest side is rolled again and added, like the SWADE aces.
+
+	Returns:
+		list: The result of every die, in the order of the sizes.
+	"""
+	generator = np.random.Generator(np.random.PCG64(np.random.SeedSequence(int(seed, 16), spawn_key=(counter,))))
+	if len(sizes) == 0:
+		return []
+	results = generator.integers(1, np.array(sizes, dtype=np.int64) + 1).tolist()
+	if explode:
+		# the aces are rolled after the pool, from the same stream
+		for index, size in enumerate(sizes):
+			ace = results[index]
+			while size > 1 and ace == size:
+				ace = int(generator.integers(1, size + 1))
+				results[index] += ace
+	return results
+
+class RollLog:
+	"""
+		Append-only log of rolls and revealed seeds, one JSON document per line.
+
+		A roll: { table, beat, player, seed (commitment), counter, dice (sizes), results, time }, and `explode` if its dice exploded
+		A revealed seed: { table, reveal (seed) }
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def append(self, entry):
+		line = json.dumps(entry, separators=(',', ':')) + "\n"
+		with self.lock:
+			os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+			# a single write of a short line in append mode doesn't interleave with other processes
+			with open(self.path, 'a') as log:
+				log.write(line)
+
+	def rolled(self, table, beat, player, seed, counter, sizes, results, explode=False):
+		entry = {
+			'table': table,
+			'beat': beat,
+			'player': player,
+			'seed': commitment(seed),
+			'counter': counter,
+			'dice': sizes,
+			'results': results,
+			'time': round(time.time(), 3)
+		}
+		if explode:
+			entry['explode'] = True
+		self.append(entry)
+
+	def reveal(self, table, seed):
+		self.append({ 'table': table, 'reveal': seed })
+
+	def entries(self):
+		if not os.path.exists(self.path):
+			return
+		with open(self.path) as log:
+			for line in log:
+				if line.strip():
+					yield json.loads(line)
+
+	def replay(self, table=None):
+		"""returns the rolls in the order they were made, of one table or all"""
+		return [entry for entry in self.entries() if 'results' in entry and (table is None or entry.get('table') == table)]
+
+	def verify(self, seeds=None):
+		"""
+		Generates every logged roll again from its seed.
+
+		Args:
+			seeds (list): Seeds that weren't revealed in the log yet, like the current seeds of the tables.
+
+		Returns:
+			dict: The number of `verified` rolls, the ones that can't be verified yet as `unrevealed`,
+				and the rolls that don't match their seed as `mismatches`.
+		"""
+		entries = list(self.entries())
+		known = { commitment(seed): seed for seed in seeds or [] }
+		known.update({ commitment(entry['reveal']): entry['reveal'] for entry in entries if 'reveal' in entry })
+		result = { 'verified': 0, 'unrevealed': 0, 'mismatches': [] }
+		for entry in entries:
+			if 'results' not in entry:
+				continue
+			seed = known.get(entry.get('seed'))
+			if seed is None:
+				result['unrevealed'] += 1
+			elif roll(seed, entry.get('counter'), entry.get('dice'), entry.get('explode', False)) == entry.get('results'):
+				result['verified'] += 1
+			else:
+				result['mismatches'].append(entry)
+		return result
+
+roll_log = RollLog(os.environ.get("ROLL_LOG", "/media/logs/rolls.jsonl"))
+
+def roll_dice(seed, counter, dice, explode=False):
+	"""
+	Rolls the dice of a resolution, dice without a size like `d8` aren't rolled.
+
+	Returns:
+		tuple: The dice with their `result`, and the sizes and results that were rolled.
+	"""
+	sizes = [odds.die_size(die.get('rating')) for die in dice]
+	rolled_sizes = [size for size in sizes if size is not None]
+	results = roll(seed, counter, rolled_sizes, explode)
+	remaining = iter(results)
+	rolled = []
+	for die, size in zip(dice, sizes):
+		if size is not None:
+			result = next(remaining)
+			die = { **die, 'result': result, 'isHitch': result == 1 }
+		rolled.append(die)
+	return rolled, rolled_sizes, results
+
+if __name__ == "__main__":
+	result = roll_log.verify(sys.argv[1:])
+	print(f"{ result['verified'] } rolls verified, { result['unrevealed'] } with a seed that isn't revealed yet")
+	for entry in result['mismatches']:
+		print("roll doesn't match its seed: ", entry)
+	sys.exit(1 if len(result['mismatches']) > 0 else 0)
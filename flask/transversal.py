@@ -1,11 +1,26 @@
 """
 	Game logic and database connections
 """
+from collections import deque
 from enum import Enum
+from types import MappingProxyType
+from uuid import uuid4
+import json
+import logging
+import math
 import os
+import re
+import threading
+import time
 
 # https://docs.python-arango.com/en/main/
 from arango import ArangoClient
+from arango.errno import UNIQUE_CONSTRAINT_VIOLATED
+from arango.exceptions import CollectionCreateError, DocumentInsertError, DocumentRevisionError
+
+import journal as journal_module
+import queries
+import rolls as rolls_module
 ARANGO_HOST = "tv_adb"
 ARANGO_PORT = "8529"
 ARANGO_USERNAME = "root"
@@ -33,28 +48,851 @@ db = client.db(
 )
 print("Transversal ArangoDB connection established")
 
+def query(name, **bind_vars):
+	"""executes a registered query on the Transversal database, see `queries.execute`"""
+	return queries.execute(db, name, **bind_vars)
+
+class Dicepool:
+	"""
+		Snapshot of the dicepools of a session, it never changes once created.
+
+		Holds the resolution of every player and the complications every player
+		suggests to the others, both by player uuid. Every change returns a new dicepool.
+		The resolutions don't hold the complications, `resolution` adds the ones of the other players.
+		The results of the dice the server rolled are kept apart, a client can't change them.
+	"""
+	def __init__(self, resolutions=None, complications=None, rev=None, rolled=None):
+		self.resolutions = MappingProxyType(dict(resolutions or {})) # player uuid -> { player, dice }
+		self.complications = MappingProxyType(dict(complications or {})) # source player uuid -> (complication dice)
+		self.rolled = MappingProxyType(dict(rolled or {})) # player uuid -> { die id: result }
+		self.rev = rev or str(uuid4())
+
+	def set_resolution(self, uuid, resolution):
+		"""replaces the player's resolution, an empty dicepool removes it, dice the server didn't roll have no result"""
+		resolutions = { player: r for player, r in self.resolutions.items() if player != uuid }
+		rolled = dict(self.rolled)
+		if len(resolution.get('dice')) > 0:
+			results = rolled.get(uuid) or {}
+			if len(results) > 0 or any('result' in die or 'isHitch' in die for die in resolution.get('dice')):
+				resolution = {
+					**resolution,
+					'dice': [
+						{ **die, 'result': results[die.get('id')], 'isHitch': results[die.get('id')] == 1 }
+						if die.get('id') in results else
+						{ key: value for key, value in die.items() if key not in ('result', 'isHitch') }
+						for die in resolution.get('dice')
+					]
+				}
+			resolutions[uuid] = resolution
+		else:
+			rolled.pop(uuid, None)
+		return Dicepool(resolutions, self.complications, rolled=rolled)
+
+	def set_rolled(self, uuid, resolution):
+		"""replaces the player's resolution with one the server rolled"""
+		rolled = {
+			**self.rolled,
+			uuid: { die.get('id'): die.get('result') for die in resolution.get('dice') if die.get('result') is not None }
+		}
+		return Dicepool(self.resolutions, self.complications, rolled=rolled).set_resolution(uuid, resolution)
+
+	def set_complications(self, uuid, complications):
+		"""
+		Replaces all complications the player suggests to the others.
+
+		Only the complications that changed are copied, the unchanged ones are kept as they are.
+		The stored complications are never changed, so no player shares them with another.
+		A complication has no result, it's only rolled as part of the dicepool of the player it's suggested to.
+
+		Args:
+			uuid (str): The uuid of the suggesting player.
+			complications (list): The complication dice, with ids.
+
+		Returns:
+			Dicepool: The new dicepool, or this one if nothing changed.
+		"""
+		current = { die.get('id'): die for die in self.complications.get(uuid, ()) }
+		suggested = []
+		for complication in complications:
+			complication = { key: value for key, value in complication.items() if key not in ('result', 'isHitch') }
+			complication['complication_source'] = uuid
+			previous = current.get(complication.get('id'))
+			suggested.append(previous if previous == complication else complication)
+		suggested = tuple(suggested)
+		if suggested == self.complications.get(uuid, ()):
+			return self
+		pool = dict(self.complications)
+		if len(suggested) > 0:
+			pool[uuid] = suggested
+		else:
+			pool.pop(uuid, None)
+		return Dicepool(self.resolutions, pool, rolled=self.rolled)
+
+	def resolution(self, uuid):
+		"""the player's resolution with the complications the other players suggest"""
+		resolution = self.resolutions.get(uuid)
+		if resolution is None:
+			return None
+		dice = resolution.get('dice')
+		complications = [
+			die for source, suggested in self.complications.items() if source != uuid
+			for die in suggested
+		]
+		if len(complications) == 0:
+			return resolution
+		ids = set(die.get('id') for die in dice)
+		return { **resolution, 'dice': dice + [die for die in complications if die.get('id') not in ids] }
+
+	def clear_resolutions(self):
+		return Dicepool({}, self.complications)
+
+	def to_document(self):
+		# pairs instead of objects, the database doesn't keep the order of attributes
+		return {
+			'resolutions': [[uuid, resolution] for uuid, resolution in self.resolutions.items()],
+			'complications': [[uuid, complications] for uuid, complications in self.complications.items()],
+			'rolled': [[uuid, [[die, result] for die, result in results.items()]] for uuid, results in self.rolled.items()],
+			'rev': self.rev
+		}
+
+	@classmethod
+	def from_document(cls, document):
+		return cls(
+			dict(document.get('resolutions')),
+			{ uuid: tuple(complications) for uuid, complications in document.get('complications') },
+			document.get('rev'),
+			{ uuid: dict(results) for uuid, results in document.get('rolled') or [] }
+		)
+
+	def results(self):
+		"""
+		Determines the winner of the resolving dicepools.
+
+		Only dicepools in the resolving phase take part, the ones with the highest sum of result dice win.
+
+		Returns:
+			dict: The resolutions with their `result` and `winner`, `heroic` and `highest_sum`.
+		"""
+		resolutions = [self.resolution(uuid) for uuid in self.resolutions]
+		results = [
+			sum(die.get('result') or 0 for die in r.get('dice') if die.get('isResultDie'))
+			if r.get('player').get('phase') == "resolving dicepools" else None
+			for r in resolutions
+		]
+		sums = sorted([result for result in results if result is not None], reverse=True)
+		highest_sum = sums[0] if len(sums) > 0 else 0
+		second_highest_sum = sums[1] if len(sums) > 1 else 0
+		return {
+			'resolutions': [{
+				**r,
+				'result': result or 0,
+				'winner': result is not None and result == highest_sum
+			} for r, result in zip(resolutions, results)],
+			'heroic': math.floor((highest_sum - second_highest_sum) / 5),
+			'highest_sum': highest_sum
+		}
+
 class Session:
-	players = [] # active players in this session
-	entities = [] # entities in this session that have temporary stat changes
-	# queues = [] # [{ trigger: string, target: string, description: string }]
-	# end_of_session_queue = [] # a reference to entities and functions to execute at end of session
-	def __init__(self):
-		self.phase = SessionPhase.START
+	"""
+		Snapshot of a game session, it never changes once created.
+
+		Readers can hold on to a snapshot without locking, `SessionState` replaces it on every write.
+	"""
+	def __init__(self,
+			players=None,
+			dicepool=None,
+			dicepool_limit=-1,
+			result_limit=2,
+			effect_limit=1,
+			session=None,
+			scene=None,
+			beat=None,
+			phase=SessionPhase.START,
+			seed=None,
+			rolls=0):
+		self.players = MappingProxyType(dict(players or {})) # player uuid -> { uuid, character }
+		self.characters = MappingProxyType({ player.get('character'): uuid for uuid, player in self.players.items() }) # character key -> player uuid
+		self.dicepool = dicepool or Dicepool()
+		self.dicepool_limit = dicepool_limit
+		self.result_limit = result_limit
+		self.effect_limit = effect_limit
+		self.session = session or str(uuid4())
+		self.scene = scene or str(uuid4())
+		self.beat = beat or str(uuid4())
+		self.phase = phase
+		self.seed = seed or rolls_module.new_seed() # secret, see `rolls`
+		self.rolls = rolls # number of rolls made with the seed
+		self._payload = None
+		self._encoded = None
+
+	def replace(self, **changes):
+		"""returns a new snapshot with the given attributes changed"""
+		return Session(**{
+			'players': self.players,
+			'dicepool': self.dicepool,
+			'dicepool_limit': self.dicepool_limit,
+			'result_limit': self.result_limit,
+			'effect_limit': self.effect_limit,
+			'session': self.session,
+			'scene': self.scene,
+			'beat': self.beat,
+			'phase': self.phase,
+			'seed': self.seed,
+			'rolls': self.rolls,
+			**changes
+		})
+
+	def to_document(self):
+		return {
+			'players': [[uuid, player] for uuid, player in self.players.items()],
+			'dicepool': self.dicepool.to_document(),
+			'dicepool_limit': self.dicepool_limit,
+			'result_limit': self.result_limit,
+			'effect_limit': self.effect_limit,
+			'session': self.session,
+			'scene': self.scene,
+			'beat': self.beat,
+			'phase': self.phase.name,
+			'seed': self.seed,
+			'rolls': self.rolls
+		}
+
+	@classmethod
+	def from_document(cls, document):
+		return cls(
+			players=dict(document.get('players')),
+			dicepool=Dicepool.from_document(document.get('dicepool')),
+			dicepool_limit=document.get('dicepool_limit'),
+			result_limit=document.get('result_limit'),
+			effect_limit=document.get('effect_limit'),
+			session=document.get('session'),
+			scene=document.get('scene'),
+			beat=document.get('beat'),
+			phase=SessionPhase[document.get('phase')],
+			seed=document.get('seed'),
+			rolls=document.get('rolls') or 0
+		)
+
+	# the changes below are the events of the session journal, replaying them gives the same session
+
+	def pick_character(self, uuid, character):
+		if character in self.characters:
+			return self
+		return self.replace(players={ **self.players, uuid: { 'uuid': uuid, 'character': character } })
+
+	def deactivate_character(self, character):
+		if character not in self.characters:
+			return self
+		uuid = self.characters.get(character)
+		return self.replace(players={ key: player for key, player in self.players.items() if key != uuid })
+
+	def set_resolution(self, uuid, resolution):
+		return self.replace(dicepool=self.dicepool.set_resolution(uuid, resolution))
+
+	def roll(self, uuid, resolution, explode=False):
+		"""rolls the dice of a resolution with the seed, the dice need ids"""
+		rolled, sizes, results = rolls_module.roll_dice(self.seed, self.rolls, resolution.get('dice'), explode)
+		return self.replace(
+			dicepool=self.dicepool.set_rolled(uuid, { **resolution, 'dice': rolled }),
+			rolls=self.rolls + 1
+		)
+
+	def set_complications(self, uuid, complications):
+		dicepool = self.dicepool.set_complications(uuid, complications)
+		return self if dicepool is self.dicepool else self.replace(dicepool=dicepool)
+
+	def clear_resolutions(self):
+		return self.replace(dicepool=self.dicepool.clear_resolutions())
+
+	def update(self, dicepool_limit=None, session=None, scene=None, beat=None, seed=None):
+		"""changes the dicepool limit, or starts the given session, scene or beat, a new session takes a new seed"""
+		changes = {}
+		if dicepool_limit is not None:
+			changes['dicepool_limit'] = dicepool_limit
+		if session is not None:
+			changes.update(session=session, players={}, seed=seed, rolls=0)
+		if scene is not None:
+			changes['scene'] = scene
+		if beat is not None:
+			changes['beat'] = beat
+			changes['dicepool'] = self.dicepool.clear_resolutions()
+		return self.replace(**changes)
+
 	def start_playing(self):
-		self.phase = SessionPhase.MIDDLE
+		return self.replace(phase=SessionPhase.MIDDLE)
+
 	def end_session(self):
-		self.phase = SessionPhase.END
-		# for queue_item in self.end_of_session_queue:
-		# 	queue_item[0](queue_item[1]) # execute function queue_item[0] with arguments queue_item[1]
+		return self.replace(phase=SessionPhase.END)
+
+	def revisions(self):
+		return {
+			'session': self.session,
+			'scene': self.scene,
+			'beat': self.beat,
+			'resolutions': self.dicepool.rev
+		}
+
+	def payload(self):
+		"""the resolutions with their winner, the complication pool, and the revisions, computed once per snapshot"""
+		if self._payload is None:
+			self._payload = self._build_payload()
+		return self._payload
+
+	def _build_payload(self):
+		return {
+			**self.dicepool.results(),
+			'complication_pool': [
+				{ 'player': uuid, 'complications': list(complications) }
+				for uuid, complications in self.dicepool.complications.items()
+			],
+			'resolutions_rev': self.dicepool.rev,
+			'session': self.session,
+			'scene': self.scene,
+			'beat': self.beat
+		}
+
+	def encoded(self):
+		"""the payload as JSON, encoded only once per snapshot"""
+		if self._encoded is None:
+			self._encoded = json.dumps(self.payload()).encode()
+		return self._encoded
+
+class Revisions:
+	"""
+		The revisions of the session, scene, beat and resolutions.
+
+		Writers publish every new revision, clients that are waiting for a change
+		are woken up by the condition instead of polling for it.
+	"""
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.revisions = {}
+
+	def publish(self, **revisions):
+		with self.condition:
+			self.revisions = { **self.revisions, **{ key: str(value) for key, value in revisions.items() } }
+			self.condition.notify_all()
+
+	def current(self):
+		return self.revisions
+
+	def wait(self, revisions, timeout):
+		"""
+		Blocks until any of the revisions differs from the given ones.
+
+		Args:
+			revisions (dict): The revisions the client already has, missing keys are ignored.
+			timeout (float): Seconds to wait at most.
+
+		Returns:
+			dict: The current revisions, unchanged if the timeout passed.
+		"""
+		def changed():
+			return any(self.revisions.get(key) != str(value) for key, value in revisions.items() if value is not None)
+		with self.condition:
+			self.condition.wait_for(changed, timeout)
+			return self.revisions
+
+def diff(previous, current):
+	"""
+	Compares the payloads of two sessions.
+
+	Resolutions are identified by player uuid, dice by id. A resolution with dice
+	without a unique id is replaced as a whole.
+
+	Args:
+		previous (dict): The payload the client has.
+		current (dict): The new payload.
+
+	Returns:
+		list: The ops that turn the previous payload into the current one, applied in order:
+			{ op: set, key, value } for other payload keys,
+			{ op: add|replace, player, resolution }, { op: remove, player },
+			{ op: set, player, key, value } and { op: remove, player, key } for resolution keys other than dice,
+			{ op: add|replace, player, die }, { op: remove, player, die: id },
+			{ op: order, player, dice: [ids] } and { op: order, players: [uuids] } when the order differs
+			from the one the other ops leave.
+	"""
+	ops = []
+	for key in ['heroic', 'highest_sum', 'complication_pool']:
+		if previous.get(key) != current.get(key):
+			ops.append({ 'op': 'set', 'key': key, 'value': current.get(key) })
+	before = { r.get('player').get('uuid'): r for r in previous.get('resolutions') }
+	after = { r.get('player').get('uuid'): r for r in current.get('resolutions') }
+	for player in before:
+		if player not in after:
+			ops.append({ 'op': 'remove', 'player': player })
+	for player, resolution in after.items():
+		old = before.get(player)
+		if old is None:
+			ops.append({ 'op': 'add', 'player': player, 'resolution': resolution })
+		elif old != resolution:
+			ops.extend(_diff_resolution(player, old, resolution))
+	order = [player for player in before if player in after] + [player for player in after if player not in before]
+	if order != list(after):
+		ops.append({ 'op': 'order', 'players': list(after) })
+	return ops
+
+def _diff_resolution(player, previous, current):
+	previous_ids = [die.get('id') for die in previous.get('dice')]
+	current_ids = [die.get('id') for die in current.get('dice')]
+	if None in previous_ids + current_ids or len(set(previous_ids)) < len(previous_ids) or len(set(current_ids)) < len(current_ids):
+		return [{ 'op': 'replace', 'player': player, 'resolution': current }]
+	ops = [
+		{ 'op': 'set', 'player': player, 'key': key, 'value': value }
+		for key, value in current.items() if key != 'dice' and previous.get(key) != value
+	]
+	ops += [{ 'op': 'remove', 'player': player, 'key': key } for key in previous if key not in current]
+	before = dict(zip(previous_ids, previous.get('dice')))
+	after = dict(zip(current_ids, current.get('dice')))
+	ops += [{ 'op': 'remove', 'player': player, 'die': id } for id in previous_ids if id not in after]
+	for id, die in after.items():
+		if id not in before:
+			ops.append({ 'op': 'add', 'player': player, 'die': die })
+		elif before[id] != die:
+			ops.append({ 'op': 'replace', 'player': player, 'die': die })
+	order = [id for id in previous_ids if id in after] + [id for id in current_ids if id not in before]
+	if order != current_ids:
+		ops.append({ 'op': 'order', 'player': player, 'dice': current_ids })
+	return ops
+
+class Deltas:
+	"""
+		Ring buffer of the changes between the last resolution revisions.
+
+		A client that passes the revision it has gets the ops since then instead of the whole payload,
+		as long as the revision is still in the buffer.
+	"""
+	def __init__(self, size=64):
+		self.lock = threading.Lock()
+		self.entries = deque(maxlen=size) # (previous rev, rev, ops)
+		self.encoded = {} # previous rev -> encoded delta to the latest rev
+
+	def record(self, previous, snapshot):
+		if previous is None or previous.dicepool.rev == snapshot.dicepool.rev:
+			return
+		ops = diff(previous.payload(), snapshot.payload())
+		with self.lock:
+			self.entries.append((previous.dicepool.rev, snapshot.dicepool.rev, ops))
+			self.encoded = {}
+
+	def since(self, rev, snapshot):
+		"""
+		Returns the delta from a revision to the snapshot.
+
+		Args:
+			rev (str): The resolutions revision the client has.
+			snapshot (Session): The current snapshot.
+
+		Returns:
+			bytes: The encoded delta, or None if the revision isn't in the buffer
+				or the delta isn't smaller than the whole payload.
+		"""
+		with self.lock:
+			if rev in self.encoded:
+				return self.encoded[rev]
+			entries = list(self.entries)
+		starts = [i for i, entry in enumerate(entries) if entry[0] == rev]
+		if len(starts) == 0 or entries[-1][1] != snapshot.dicepool.rev:
+			return None
+		ops = [op for entry in entries[starts[-1]:] for op in entry[2]]
+		encoded = json.dumps({
+			'delta': rev,
+			'ops': ops,
+			'resolutions_rev': snapshot.dicepool.rev,
+			'session': snapshot.session,
+			'scene': snapshot.scene,
+			'beat': snapshot.beat
+		}).encode()
+		if len(encoded) >= len(snapshot.encoded()):
+			encoded = None
+		with self.lock:
+			if len(self.entries) > 0 and self.entries[-1][1] == snapshot.dicepool.rev:
+				self.encoded[rev] = encoded
+		return encoded
+
+class MemoryBackend:
+	"""keeps the session state of every table in this process only"""
+	shared = False
+
+	def load(self, table):
+		return None, None
+
+	def swap(self, table, rev, session):
+		# the state's lock already serializes the writes, there is nothing to compete with
+		return (rev or 0) + 1
+
+	def watch(self, tables):
+		pass
+
+	def share(self, name, cache, clear):
+		pass
+
+class ArangoBackend:
+	"""
+		Keeps the session state of every table in an ArangoDB collection, shared by all worker processes.
+
+		Every write is a compare-and-swap on the `_rev` of the table's document.
+		A watcher thread polls the revisions of the open tables, and applies the changes
+		other workers made, which wakes up the clients waiting in this worker.
+		The process-wide caches are shared the same way, a worker that changes a cache
+		writes its `cache:<name>` document, and the watchers of the other workers clear theirs.
+	"""
+	shared = True
+
+	def __init__(self, database, collection='Tables', interval=0.25):
+		self.lock = threading.Lock()
+		self.db = database
+		self.name = collection
+		self.interval = interval
+		self.watcher = None
+		self.caches = {} # cache name -> function that clears it
+		self.cache_revs = {} # cache document key -> revision, as last seen
+		if not database.has_collection(collection):
+			try:
+				database.create_collection(collection)
+			except CollectionCreateError:
+				pass # another worker created it first
+		self.tables = database.collection(collection)
+
+	def load(self, table):
+		"""returns the table's session and its revision, or None if the table isn't stored yet"""
+		document = self.tables.get(table)
+		if document is None:
+			return None, None
+		return Session.from_document(document.get('state')), document.get('_rev')
+
+	def swap(self, table, rev, session):
+		"""
+		Stores a session if the table's document is still at the given revision.
+
+		Args:
+			table (str): The table id, used as document key.
+			rev (str): The revision the session was derived from, None for a new table.
+			session (Session): The new session.
+
+		Returns:
+			str: The new revision, or None if another worker wrote first.
+		"""
+		try:
+			if rev is None:
+				result = self.tables.insert({ '_key': table, 'state': session.to_document() })
+			else:
+				result = self.tables.replace({ '_key': table, '_rev': rev, 'state': session.to_document() }, check_rev=True)
+		except DocumentRevisionError:
+			return None
+		except DocumentInsertError as e:
+			if e.error_code == UNIQUE_CONSTRAINT_VIOLATED:
+				return None # another worker stored the table first
+			raise
+		return result.get('_rev')
+
+	def share(self, name, cache, clear):
+		"""
+		Clears a process-wide cache when another worker changes it.
+
+		Args:
+			name (str): Name of the cache, the key of its document is `cache:<name>`.
+			cache (object): The cache, its `changed` is called after every change this worker makes.
+			clear (function): Clears the cache of this worker.
+		"""
+		self.caches[CACHE_PREFIX + name] = clear
+		cache.changed = lambda: self.invalidate(CACHE_PREFIX + name)
+
+	def invalidate(self, key):
+		"""writes the document of a cache, so the other workers clear theirs"""
+		try:
+			result = self.tables.insert({ '_key': key }, overwrite=True)
+			with self.lock:
+				self.cache_revs[key] = result.get('_rev')
+		except Exception as e:
+			logging.error(f"session backend\tcould not invalidate { key }: { e }")
+
+	def _revisions(self, tables):
+		keys = tables.ids() + list(self.caches)
+		revs = { key: None for key in self.caches } # a cache document that doesn't exist yet
+		for document in query(TABLE_REVISIONS, tables=keys):
+			revs[document.get('_key')] = document.get('_rev')
+		return revs
+
+	def watch(self, tables):
+		"""starts polling the revisions of the open tables and of the shared caches, once per process"""
+		with self.lock:
+			if self.watcher is not None:
+				return
+			# the caches are only cleared for changes after this
+			revs = self._revisions(tables)
+			self.cache_revs = { key: revs[key] for key in self.caches }
+			self.watcher = threading.Thread(target=self._watch, args=(tables,), daemon=True)
+			self.watcher.start()
+
+	def _watch(self, tables):
+		while True:
+			time.sleep(self.interval)
+			try:
+				for key, rev in self._revisions(tables).items():
+					if key in self.caches:
+						with self.lock:
+							changed = self.cache_revs.get(key) != rev
+							self.cache_revs[key] = rev
+						if changed:
+							self.caches[key]()
+						continue
+					state = tables[key]
+					if state.rev != rev:
+						state.refresh()
+			except Exception as e:
+				logging.error(f"session backend\twatching tables failed: { e }")
+
+def session_backend(name):
+	"""the session backend named by the SESSION_BACKEND environment variable, `memory` or `arango`"""
+	if name == 'arango':
+		return ArangoBackend(db)
+	if name in [None, '', 'memory']:
+		return MemoryBackend()
+	raise Exception("unknown session backend: ", name)
+
+CACHE_PREFIX = 'cache:' # table ids can't contain a colon
+
+TABLE_REVISIONS = queries.register('table_revisions', """FOR t IN Tables
+	FILTER t._key IN @tables
+	RETURN { _key: t._key, _rev: t._rev }""")
+
+class SessionState:
+	"""
+		The state of the game session running at a table.
+
+		Writes are serialized by a lock, each one replaces the snapshot and publishes its revisions.
+		Readers take the current snapshot with `current()`, they never wait for a writer.
+		The backend decides where the state lives, a shared backend lets several processes serve the same table.
+		With a journal every change is written to it, and the session is recovered from it after a restart.
+	"""
+	ATTEMPTS = 16 # writes that lost to another process before a write gives up
+	EVENTS = ['pick_character', 'deactivate_character', 'set_resolution', 'roll', 'set_complications', 'clear_resolutions', 'update']
+
+	def __init__(self, table, backend=None, journal=None, revisions=None):
+		self.table = table
+		self.lock = threading.Lock()
+		self.backend = backend or MemoryBackend()
+		self.journal = journal
+		self.revisions = revisions or Revisions()
+		self.deltas = Deltas()
+		self.snapshot, self.rev = self.backend.load(table)
+		if self.snapshot is None:
+			recovered = self.recover() if self.journal is not None else None
+			adopted = False
+			def create(session):
+				nonlocal adopted
+				# another worker stored the table first, its session is live
+				adopted = session is not None
+				return session or recovered or Session()
+			self.write(create)
+			if self.journal is not None and recovered is None and not adopted:
+				self.journal.snapshot(self.snapshot.to_document())
+		else:
+			self.revisions.publish(**self.snapshot.revisions())
+
+	def recover(self):
+		"""replays the journal from its last snapshot, returns None if there is no snapshot"""
+		start = time.perf_counter()
+		document, events = self.journal.recover()
+		if document is None:
+			return None
+		session = Session.from_document(document)
+		for event in events:
+			if event.get('event') not in self.EVENTS:
+				raise Exception("unknown session event: ", event)
+			session = getattr(session, event.get('event'))(*event.get('args'))
+		logging.warning(f"session journal\trecovered table { self.table }, { len(events) } events in { (time.perf_counter() - start) * 1000:.1f} ms")
+		return session
+
+	def current(self):
+		return self.snapshot
+
+	def since(self, rev, snapshot=None):
+		"""the encoded changes of the resolutions since a revision up to the snapshot, the whole payload if the revision is too old"""
+		snapshot = snapshot or self.snapshot
+		return self.deltas.since(rev, snapshot) or snapshot.encoded()
+
+	def refresh(self):
+		"""takes over the session another process stored"""
+		with self.lock:
+			snapshot, rev = self.backend.load(self.table)
+			if snapshot is not None and rev != self.rev:
+				self._replace(snapshot, rev)
+
+	def _replace(self, snapshot, rev):
+		# encode before publishing, so every client that wakes up gets the prebuilt payload
+		snapshot.encoded()
+		self.deltas.record(self.snapshot, snapshot)
+		self.snapshot = snapshot
+		self.rev = rev
+		self.revisions.publish(**snapshot.revisions())
+
+	def write(self, change, event=None):
+		"""
+		Replaces the snapshot.
+
+		Args:
+			change (function): Gets the current snapshot and returns the new one,
+				it's called again if another process changed the session in the meantime.
+			event (tuple): The name of the `Session` method the change calls and its arguments,
+				written to the journal.
+
+		Returns:
+			Session: The new snapshot.
+		"""
+		with self.lock:
+			for _ in range(self.ATTEMPTS):
+				snapshot = change(self.snapshot)
+				if snapshot is self.snapshot:
+					return snapshot
+				rev = self.backend.swap(self.table, self.rev, snapshot)
+				if rev is not None:
+					self._replace(snapshot, rev)
+					if self.journal is not None and event is not None:
+						if self.journal.append(*event):
+							self.journal.snapshot(snapshot.to_document())
+					return snapshot
+				# another process wrote first, start over from its session
+				current, current_rev = self.backend.load(self.table)
+				if current is not None:
+					self._replace(current, current_rev)
+			raise Exception("session write kept losing to other processes: ", self.table)
+
+	def pick_character(self, uuid, character):
+		"""lets a player play a character nobody else plays, returns whether the character was picked"""
+		picked = False
+		def change(session):
+			nonlocal picked
+			picked = character not in session.characters
+			return session.pick_character(uuid, character)
+		self.write(change, ('pick_character', [uuid, character]))
+		return picked
+
+	def deactivate_character(self, character):
+		"""removes the player of the character from the session, returns whether it was played"""
+		deactivated = False
+		def change(session):
+			nonlocal deactivated
+			deactivated = character in session.characters
+			return session.deactivate_character(character)
+		self.write(change, ('deactivate_character', [character]))
+		return deactivated
+
+	def set_resolution(self, uuid, resolution):
+		return self.write(lambda session: session.set_resolution(uuid, resolution), ('set_resolution', [uuid, resolution]))
+
+	def roll(self, uuid, resolution, explode=False):
+		"""
+		Rolls the dice of a player's resolution with the seed of the table, and writes the roll to the audit log.
+
+		Args:
+			uuid (str): The player's uuid.
+			resolution (dict): The player and their dice, dice without an id get one.
+			explode (bool): Whether the dice explode, see `rolls.roll`.
+
+		Returns:
+			dict: The resolution with the results.
+		"""
+		resolution = {
+			**resolution,
+			'dice': [die if die.get('id') else { **die, 'id': str(uuid4()) } for die in resolution.get('dice') or []]
+		}
+		rolled_by = {}
+		def change(session):
+			rolled_by['session'] = session
+			return session.roll(uuid, resolution, explode)
+		self.write(change, ('roll', [uuid, resolution, explode]))
+		session = rolled_by['session']
+		dice, sizes, results = rolls_module.roll_dice(session.seed, session.rolls, resolution.get('dice'), explode)
+		rolls_module.roll_log.rolled(self.table, session.beat, uuid, session.seed, session.rolls, sizes, results, explode)
+		return { **resolution, 'dice': dice }
+
+	def set_complications(self, uuid, complications):
+		return self.write(lambda session: session.set_complications(uuid, complications), ('set_complications', [uuid, complications]))
 
-class Dicepool:
-	resolutions = [] # [{ player: ID, dice: Die[], effect: Trait }]
-	def add_resolution(self, resolution):
-		self.resolutions.append(resolution)
-	def get_winner(self):
-		return max(self.resolutions, key=lambda r: r.result)
 	def clear_resolutions(self):
-		self.resolutions = []
+		return self.write(lambda session: session.clear_resolutions(), ('clear_resolutions', []))
+
+	def update(self, dicepool_limit=None, new_session=False, next_scene=False, next_beat=False):
+		"""changes the dicepool limit, or starts a new session, scene or beat"""
+		args = [
+			dicepool_limit,
+			str(uuid4()) if new_session else None,
+			str(uuid4()) if new_session or next_scene else None,
+			str(uuid4()) if new_session or next_scene or next_beat else None,
+			rolls_module.new_seed() if new_session else None
+		]
+		previous = {}
+		def change(session):
+			previous['seed'] = session.seed
+			return session.update(*args)
+		session = self.write(change, ('update', args))
+		if new_session:
+			# from now on everyone can verify the rolls made with the old seed
+			rolls_module.roll_log.reveal(self.table, previous['seed'])
+		return session
+
+class Tables:
+	"""the session state of every table this process hosts, by table id"""
+	DEFAULT = 'default'
+
+	def __init__(self, backend=None, journal=None):
+		self.lock = threading.Lock()
+		self.backend = backend or MemoryBackend()
+		# a shared backend keeps the sessions itself, the journal is only used by one process
+		self.journal = journal if not self.backend.shared else None
+		self.tables = {}
+
+	def __getitem__(self, table):
+		"""returns the session state of a table, only tables that were created are opened"""
+		table = table or self.DEFAULT
+		state = self.tables.get(table)
+		if state is None:
+			if table != self.DEFAULT and not self.exists(table):
+				raise Exception("unknown table: ", table)
+			state = self._open(table)
+		return state
+
+	def exists(self, table):
+		"""whether a table was created, by this process, in its journal or in the shared backend"""
+		if not re.fullmatch(r'[A-Za-z0-9_\-]{1,64}', table):
+			return False
+		if table in self.tables:
+			return True
+		if self.journal:
+			return os.path.isdir(os.path.join(self.journal, table))
+		return self.backend.load(table)[0] is not None
+
+	def create(self, table):
+		"""opens a table, creating its session if it does not exist yet"""
+		table = table or self.DEFAULT
+		if not re.fullmatch(r'[A-Za-z0-9_\-]{1,64}', table):
+			raise Exception("invalid table id: ", table)
+		return self.tables.get(table) or self._open(table)
+
+	def _open(self, table):
+		with self.lock:
+			state = self.tables.get(table)
+			if state is None:
+				state = SessionState(
+					table,
+					self.backend,
+					journal_module.Journal(self.journal, table) if self.journal else None
+				)
+				self.tables[table] = state
+		self.backend.watch(self)
+		return state
+
+	def ids(self):
+		return list(self.tables)
+
+	def watch(self):
+		"""starts following the changes of the other workers, before any table is used"""
+		self.backend.watch(self)
+
+tables = Tables(session_backend(os.environ.get("SESSION_BACKEND")), os.environ.get("SESSION_JOURNAL"))
 
 class Node:
 	id = ""
@@ -96,12 +934,318 @@ class Location(Entity):
 	characters = [] # list of characters in this location
 	assets = [] # list of assets in this location
 
+SUPER_RELATIONS = queries.register('super_relations', """FOR r IN Relations
+	FILTER r.type == 'super'
+	RETURN { _id: r._id, _from: r._from, _to: r._to }""")
+
+class LocationHierarchy:
+	"""
+		Process-wide index of the `super` relations between locations.
+
+		All `super` edges are read once, the first time the index is used, and kept as
+		parent and child pointers. Mutations that change the hierarchy update the index
+		in place, so ancestor chains and subtrees never need a graph traversal.
+		With a shared session backend the other workers read the index again after a change.
+	"""
+	def __init__(self, max_depth=20):
+		self.max_depth = max_depth
+		self.lock = threading.RLock()
+		self.edges = None # relation id -> (from, to)
+		self.parents = {} # location id -> [parent location ids]
+		self.children = {} # location id -> [zone ids]
+		self.changed = lambda: None # replaced when the cache is shared with other workers
+
+	def _load(self):
+		if self.edges is not None:
+			return
+		self.edges = {}
+		self.parents = {}
+		self.children = {}
+		for relation in query(SUPER_RELATIONS):
+			self._add(relation.get('_id'), relation.get('_from'), relation.get('_to'))
+
+	def _add(self, relation_id, from_id, to_id):
+		self.edges[relation_id] = (from_id, to_id)
+		self.parents.setdefault(from_id, []).append(to_id)
+		self.children.setdefault(to_id, []).append(from_id)
+
+	def _remove(self, relation_id):
+		if relation_id not in self.edges:
+			return
+		from_id, to_id = self.edges.pop(relation_id)
+		self.parents[from_id].remove(to_id)
+		self.children[to_id].remove(from_id)
+
+	def ancestors(self, location_id):
+		"""
+		Returns the location and its parents, up to the root location.
+
+		Args:
+			location_id (str): The ID of the location.
+
+		Returns:
+			list: Location IDs, starting with the location itself, in the order a
+				`0..20 OUTBOUND` traversal over `super` relations would visit them.
+		"""
+		with self.lock:
+			self._load()
+			result = []
+			stack = [(location_id, 0)]
+			while stack:
+				current, depth = stack.pop()
+				result.append(current)
+				if depth < self.max_depth:
+					stack.extend((parent, depth + 1) for parent in reversed(self.parents.get(current, [])))
+			return result
+
+	def descendants(self, location_id):
+		"""returns the ids of the location and all zones below it"""
+		with self.lock:
+			self._load()
+			result = {location_id}
+			stack = [location_id]
+			while stack:
+				for zone in self.children.get(stack.pop(), []):
+					if zone not in result:
+						result.add(zone)
+						stack.append(zone)
+			return result
+
+	def is_within(self, location_id, ancestor_id):
+		"""checks if a location is the given location or one of its zones"""
+		return ancestor_id in self.ancestors(location_id)
+
+	def add_relation(self, relation):
+		"""adds a new relation document, ignored if it isn't a super relation"""
+		if relation.get('type') != 'super':
+			return
+		with self.lock:
+			if self.edges is not None:
+				self._remove(relation.get('_id'))
+				self._add(relation.get('_id'), relation.get('_from'), relation.get('_to'))
+		self.changed()
+
+	def remove_relation(self, relation_id):
+		with self.lock:
+			if self.edges is not None:
+				self._remove(relation_id)
+		self.changed()
+
+	def move_zones(self, location_id, parent_id):
+		"""re-parents all zones of a location, like an `update_match` on their super relations"""
+		with self.lock:
+			if self.edges is not None:
+				for relation_id, (from_id, to_id) in list(self.edges.items()):
+					if to_id == location_id:
+						self._remove(relation_id)
+						self._add(relation_id, from_id, parent_id)
+		self.changed()
+
+	def remove_location(self, location_id):
+		"""drops every super relation from or to a deleted entity"""
+		with self.lock:
+			if self.edges is not None:
+				for relation_id, (from_id, to_id) in list(self.edges.items()):
+					if location_id in (from_id, to_id):
+						self._remove(relation_id)
+		self.changed()
+
+	def invalidate(self):
+		"""forgets the index, it's read again when next used"""
+		with self.lock:
+			self.edges = None
+
+location_hierarchy = LocationHierarchy()
+
 def retrieve_hierarchy(location_id):
-	query = f"""FOR v, e, p IN 0..20 OUTBOUND "{ location_id }" Relations
-				FILTER p.edges[*].type ALL == 'super'
-				RETURN v"""
-	cursor = db.aql.execute(query)
-	return [doc for doc in cursor]
+	"""
+	Retrieves a location and its parent locations.
+
+	Args:
+		location_id (str): The ID of the location.
+
+	Returns:
+		list: Location documents, starting with the location itself and ending with the root location.
+	"""
+	ids = location_hierarchy.ancestors(location_id)
+	documents = {doc.get('_id'): doc for doc in db.collection('Entities').get_many(list(set(ids)))}
+	if location_id not in documents:
+		# the traversal doesn't start from a location that doesn't exist
+		return []
+	return [documents[id] for id in ids if id in documents]
+
+class LocationEnablement:
+	"""
+		Decides which trait settings are enabled at a location.
+
+		The location's ancestor chain is interned once into ranks, the position of each
+		location in the chain. A setting's `locations_enabled` and `locations_disabled`
+		lists then reduce to the lowest rank they contain, and the first location in
+		the chain that mentions the setting wins, with enabled before disabled.
+		Undetermined settings fall back to their trait default, then their traitset
+		default, which are retrieved for the whole batch at once.
+	"""
+	def __init__(self, hierarchy_ids):
+		self.ranks = {}
+		for rank, location_id in enumerate(hierarchy_ids):
+			self.ranks.setdefault(location_id, rank)
+
+	def _rank(self, locations):
+		if not locations:
+			return None
+		if isinstance(locations, (list, tuple)):
+			return min((self.ranks[location] for location in locations if isinstance(location, str) and location in self.ranks), default=None)
+		# anything else is checked the way `in` checks it
+		return min((rank for location_id, rank in self.ranks.items() if location_id in locations), default=None)
+
+	def decide(self, setting):
+		"""returns True if enabled, False if disabled and None if the setting doesn't decide"""
+		if setting is None:
+			return None
+		enabled = self._rank(setting.get('locations_enabled'))
+		disabled = self._rank(setting.get('locations_disabled'))
+		if enabled is None and disabled is None:
+			return None
+		return disabled is None or (enabled is not None and enabled <= disabled)
+
+	def filter(self, trait_settings):
+		"""
+		Filters out the trait settings that are disabled at the location.
+
+		Args:
+			trait_settings (list): A list of TraitSettings documents.
+
+		Returns:
+			list: The enabled trait settings, in their original order.
+		"""
+		decisions = [self.decide(trait_setting) for trait_setting in trait_settings]
+		undetermined = [
+			trait_setting for trait_setting, decision in zip(trait_settings, decisions)
+			if decision is None and (
+				(trait_setting.get('_to') is not None and trait_setting.get('_to') != 'Traits/1')
+				or (trait_setting.get('_from') is not None and not trait_setting.get('_from').startswith('Traitsets'))
+			)
+		]
+		if len(undetermined) > 0:
+			default_settings.prefetch([trait_setting.get('_to') for trait_setting in undetermined])
+			for n, trait_setting in enumerate(trait_settings):
+				if decisions[n] is not None:
+					continue
+				trait_id = trait_setting.get('_to')
+				if trait_id is not None and trait_id != 'Traits/1':
+					decisions[n] = self.decide(default_settings.trait_default(trait_id))
+				if decisions[n] is None and trait_setting.get('_from') is not None and not trait_setting.get('_from').startswith('Traitsets'):
+					decisions[n] = self.decide(default_settings.traitset_default(default_settings.traitset_of(trait_id)))
+		return [trait_setting for trait_setting, decision in zip(trait_settings, decisions) if decision is not False]
+
+# the given traits with their traitsets, and the default settings of both
+DEFAULT_SETTINGS = queries.register('default_settings', """LET traits = DOCUMENT('Traits', @traits)
+	LET traitsets = UNIQUE(APPEND(traits[* FILTER CURRENT.traitset != null RETURN CURRENT.traitset], @traitsets))
+	LET defaults = (
+		FOR setting IN TraitSettings
+			FILTER setting._from IN APPEND(@traits, traitsets)
+			FILTER setting._to == 'Traits/1'
+			RETURN setting
+	)
+	RETURN {
+		traits: traits[* RETURN { _id: CURRENT._id, traitset: CURRENT.traitset }],
+		traitsets: traitsets,
+		defaults: defaults
+	}""")
+
+class DefaultSettings:
+	"""
+		Process-wide cache of the default setting chain: trait default, traitset default, global default.
+
+		A default setting is the TraitSettings document from a trait, a traitset or
+		`Traits/1` itself to `Traits/1`. Lookups that miss are read from the database
+		together in one query, documents that don't exist are cached as None.
+		Mutations that write a default, or move a trait to another traitset, invalidate
+		the entries they touch, with a shared session backend the other workers clear their cache.
+	"""
+	GLOBAL = 'Traits/1'
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.defaults = {} # trait, traitset or global id -> default setting or None
+		self.traitsets = {} # trait id -> traitset id
+		self.changed = lambda: None # replaced when the cache is shared with other workers
+
+	def prefetch(self, trait_ids=(), traitset_ids=()):
+		"""reads every default that isn't cached yet for the given traits and traitsets in one query"""
+		trait_ids = [trait_id for trait_id in set(trait_ids) if trait_id and trait_id not in self.traitsets]
+		traitset_ids = [traitset_id for traitset_id in set(traitset_ids) if traitset_id and traitset_id not in self.defaults]
+		if self.GLOBAL not in self.defaults:
+			traitset_ids.append(self.GLOBAL)
+		if len(trait_ids) == 0 and len(traitset_ids) == 0:
+			return
+		result = query(DEFAULT_SETTINGS, traits=trait_ids, traitsets=traitset_ids)[0]
+		defaults = {}
+		for default in result.get('defaults'):
+			# the first default found is the one used, like `find` would return it
+			defaults.setdefault(default.get('_from'), default)
+		with self.lock:
+			for trait_id in trait_ids:
+				self.traitsets[trait_id] = None
+			for trait in result.get('traits'):
+				self.traitsets[trait.get('_id')] = trait.get('traitset')
+			for from_id in trait_ids + result.get('traitsets'):
+				if from_id not in self.defaults:
+					self.defaults[from_id] = defaults.get(from_id)
+
+	def _get(self, from_id):
+		if from_id not in self.defaults:
+			self.prefetch(traitset_ids=[from_id])
+		return self.defaults.get(from_id)
+
+	def traitset_of(self, trait_id):
+		if trait_id not in self.traitsets:
+			self.prefetch(trait_ids=[trait_id])
+		return self.traitsets.get(trait_id)
+
+	def trait_default(self, trait_id):
+		"""returns the default setting of the trait itself, or None"""
+		if trait_id not in self.traitsets:
+			self.prefetch(trait_ids=[trait_id])
+		return self.defaults.get(trait_id)
+
+	def traitset_default(self, traitset_id):
+		"""returns the default setting of the traitset, or None"""
+		return self._get(traitset_id) if traitset_id else None
+
+	def global_default(self):
+		return self._get(self.GLOBAL)
+
+	def resolve(self, trait_id):
+		"""
+		Resolves the default setting that applies to a trait.
+
+		Args:
+			trait_id (str): The ID of the trait.
+
+		Returns:
+			dict: The trait default, or else the default of its traitset, or else the global default, or None.
+		"""
+		return self.trait_default(trait_id) \
+			or self.traitset_default(self.traitset_of(trait_id)) \
+			or self.global_default()
+
+	def invalidate(self, from_id):
+		"""forgets the default of a trait, a traitset or the global default after it was written"""
+		with self.lock:
+			self.defaults.pop(from_id, None)
+			self.traitsets.pop(from_id, None)
+		self.changed()
+
+	def clear(self):
+		with self.lock:
+			self.defaults = {}
+			self.traitsets = {}
+
+default_settings = DefaultSettings()
+
+tables.backend.share('location_hierarchy', location_hierarchy, location_hierarchy.invalidate)
+tables.backend.share('default_settings', default_settings, default_settings.clear)
 
 class Asset(Entity):
 	"""Complex asset, can be vehicles, weapons, etc."""
@@ -58,6 +58,10 @@ export function useCharacter(init?: Character, character_key?: string) {
 					image {
 						path
 						ext
+						sources {
+							type
+							srcset(prefix: "${API_URL}media/")
+						}
 					}
 					imagened
 					entityType
@@ -14,6 +14,12 @@ import _ from "lodash"
 import { useTrait } from "./Trait"
 
 
+// one push channel per page, shared by every component using the dicepool
+let resolutions_stream: EventSource | undefined = undefined
+let long_polling = false
+// the last whole payload of resolutions, the server sends the changes since its revision
+let last_payload: any = undefined
+
 export const placeholder_dicepool: Dicepool = {
 	player: "",
 	dice: [placeholder_die]
@@ -22,7 +28,7 @@ export const placeholder_dicepool: Dicepool = {
 export function useDicepool() {
 	const dicepool = useDicepoolStore()
 	const player = usePlayer()
-	const { get_session, get_dicepool_limit } = useSession()
+	const { get_dicepool_limit } = useSession()
 
 	const resolutions_count = computed(() => dicepool.resolutions.length)
 
@@ -142,29 +148,68 @@ export function useDicepool() {
 				change_type(2)
 				add_die(die.value)
 			}
-			dicepool.dice.forEach(d => {
-				const { roll: rollSwade } = useDie(d, undefined)
-				rollSwade(true)
-				d.raises = Math.floor(((d.result ?? 4) - 4) / 4)
-				d.isResultDie = true
-				d.isResolved = true
+			dicepool.phase = dicepool.phases.ROLLING
+			roll_on_server(true, () => {
+				dicepool.dice.forEach(d => {
+					d.raises = Math.floor(((d.result ?? 4) - 4) / 4)
+					d.isResultDie = true
+					d.isResolved = true
+				})
+				dicepool.dice.sort((d1, d2) => d2.result - d1.result)
+				dicepool.phase = dicepool.phases.SWADE_RESULT
 			})
-			dicepool.dice.sort((d1, d2) => d2.result - d1.result)
-			dicepool.phase = dicepool.phases.SWADE_RESULT
 		}
 
 		// cortex roll
 		else if(dicepool.dice.length > 1) {
 			dicepool.phase = dicepool.phases.ROLLING
-			dicepool.dice.forEach(d => {
-				const { die, roll } = useDie(d, undefined)
-				roll()
-				d.result = die.value.result
+			roll_on_server(false, () => {
+				dicepool.phase = dicepool.phases.RESULT
 			})
-			dicepool.phase = dicepool.phases.RESULT
 		}
 	}
 
+	/**
+	 * The server rolls the dicepool and keeps the results, results rolled anywhere else aren't accepted.
+	 * When the server can't roll, the dicepool goes back to adding dice and the error is shown.
+	 * @param explode - whether the dice explode, for SWADE rolls
+	 * @param rolled - called once the results are in the dicepool
+	 */
+	function roll_on_server(explode: boolean, rolled: () => void) {
+		dicepool.roll_error = ""
+		dicepool.dice.forEach(d => {
+			if(!d.id) useDie(d, undefined)
+		})
+		const resolution: Resolution = {
+			player: {
+				uuid: player.uuid || "",
+				player_name: player.player_name || "",
+				is_gm: player.is_gm,
+				phase: dicepool.phases.RESULT.toString()
+			},
+			dice: dicepool.dice
+		}
+		const url = API_URL + "roll-dicepool/" + player.uuid + (explode ? "?explode=true" : "")
+		const { data, error } = useFetch(url).post(resolution).json()
+		watch([data, error], ([newData, newError]) => {
+			if(newData && newData.resolution) {
+				newData.resolution.dice.forEach((die: Die) => {
+					const d = dicepool.dice.find(d => d.id == die.id)
+					if(d && die.result) {
+						d.result = die.result
+						d.isHitch = die.isHitch
+					}
+				})
+				rolled()
+			}
+			else {
+				console.error("server roll failed: ", newError ?? newData)
+				dicepool.roll_error = "the server couldn't roll the dicepool, try again"
+				dicepool.phase = dicepool.phases.ADDING
+			}
+		})
+	}
+
 	/**
 	 * Check if a trait is in the dicepool
 	 * @param traitSettingId - the id of the traitsetting
@@ -293,11 +338,14 @@ export function useDicepool() {
 			},
 			dice: dicepool.dice
 		}
-		const url = API_URL + "set-dicepool/" + player.uuid
+		const url = API_URL + "set-dicepool/" + player.uuid + (last_payload ? "?rev=" + last_payload.resolutions_rev : "")
 		const { data } = useFetch(url).post(resolution).json()
 		watch(data, (newData) => {
 			console.log("resolution data set update: ", newData)
-			if(newData && newData.resolutions) {
+			if(newData && last_payload) {
+				apply_update(newData)
+			}
+			else if(newData && newData.resolutions) {
 				dicepool.resolutions = newData.resolutions
 			}
 			else {
@@ -330,101 +378,209 @@ export function useDicepool() {
 		mutate_trait_setting({teachTo: _character_id})
 	}
 	
-	//	this function pulls the active dicepools from the server
-	function pull_dicepools() {
-		get_session()
-		const url = API_URL + "get-resolutions/" + dicepool.resolutions_rev
-		const { data } = useFetch(url).get().json()
-		watch(data, (newData) => {
-			if(newData.resolutions_rev != dicepool.resolutions_rev) {
-				console.log("dicepool polling: dicepool changed")
-				
-				// update resolutions
-				if(newData.resolutions && newData.resolutions.length > 0) {
-					console.log("resolution data get update: ", newData.resolutions)
-					dicepool.resolutions = newData.resolutions.filter((r: Resolution) => !r.winner)
-
-					if(newData.resolutions.some((r: Resolution) => r.winner)) {
-						let winner: Resolution = newData.resolutions.splice(
-							newData.resolutions.findIndex((r: Resolution) => r.winner), 1)[0]
-						winner.heroic = newData.heroic
-						dicepool.resolutions.push(winner)
-					}
+	//	this function applies the resolutions sent by the server, pushed or pulled
+	function apply_resolutions(newData: any) {
+		if(!newData) {
+			return
+		}
 
-					// make sure encountered traits are henceforth known to characters
-					// only after resolution
-					console.error("teaching")
-					console.log("resolutions: ", newData.resolutions)
-					dicepool.resolutions.filter((r: Resolution) => r.player.phase == dicepool.phases.RESOLVE.toString() && r.player.uuid != player.uuid)
-							.forEach((r: Resolution) => {
-						console.log("resolution: ", r)
-						new Set(r.dice.map((d: Die) => d.traitsettingId)).forEach((trait_setting_id) => {
-							console.log("trait_id: ", trait_setting_id)
-							dicepool.dice.map((d: Die) => d.entityId)
-								.forEach((entity_id) => {
-									console.log("character: ", entity_id)
-									trait_setting_id && trait_setting_id != 'traitSettings/1' && entity_id ? teach_character(trait_setting_id, entity_id) : null
-							})
-						})
-					})
-				}
-				else if(newData.resolutions && newData.resolutions.length == 0) {
-					dicepool.resolutions = []
-				}
+		// the revisions of the session, scene and beat come along with the resolutions
+		if(newData.session) {
+			player.session_id = newData.session
+			player.scene_id = newData.scene
+			player.beat_id = newData.beat
+		}
 
-				let complication_dice: Die[] = []
-				if(newData.complication_pool) {
-					console.log("complication data get update: complications detected, flattening complication pool:", newData.complication_pool)
-					// complications are grouped by player
-					// here the dice are extracted and put into a flat array
-					complication_dice = newData.complication_pool
-						.filter((cp: any) => cp.player != player.uuid)
-						.map((cp: any) => cp.complications).flat()
+		if(newData.resolutions_rev != dicepool.resolutions_rev) {
+			console.log("dicepool polling: dicepool changed")
+			
+			// update resolutions
+			if(newData.resolutions && newData.resolutions.length > 0) {
+				console.log("resolution data get update: ", newData.resolutions)
+				dicepool.resolutions = newData.resolutions.filter((r: Resolution) => !r.winner)
+
+				if(newData.resolutions.some((r: Resolution) => r.winner)) {
+					let winner: Resolution = newData.resolutions.splice(
+						newData.resolutions.findIndex((r: Resolution) => r.winner), 1)[0]
+					winner.heroic = newData.heroic
+					dicepool.resolutions.push(winner)
 				}
 
-				if(complication_dice.length > 0) {
-					// here the array of complication dice are added to the dicepool store
-					// as suggestions, the player can then choose which to add to their dicepool
-					console.log("complication data get update: adding complication suggestions: ", complication_dice)
-					complication_dice.forEach((c: Die) => {
-						if(!dicepool.suggested_complications.map((sc: Die) => sc.id).includes(c.id)) {
-							console.log("adding complication suggestion: ", c,
-								" to suggested_complications: ", dicepool.suggested_complications)
-							// dicepool.suggested_complications.push(_.cloneDeep(c))
-							dicepool.suggested_complications = [...dicepool.suggested_complications, _.clone(c)]
-							console.log("new suggested_complications: ", dicepool.suggested_complications)
-						}
+				// make sure encountered traits are henceforth known to characters
+				// only after resolution
+				console.error("teaching")
+				console.log("resolutions: ", newData.resolutions)
+				dicepool.resolutions.filter((r: Resolution) => r.player.phase == dicepool.phases.RESOLVE.toString() && r.player.uuid != player.uuid)
+						.forEach((r: Resolution) => {
+					console.log("resolution: ", r)
+					new Set(r.dice.map((d: Die) => d.traitsettingId)).forEach((trait_setting_id) => {
+						console.log("trait_id: ", trait_setting_id)
+						dicepool.dice.map((d: Die) => d.entityId)
+							.forEach((entity_id) => {
+								console.log("character: ", entity_id)
+								trait_setting_id && trait_setting_id != 'traitSettings/1' && entity_id ? teach_character(trait_setting_id, entity_id) : null
+						})
 					})
-				}
-				else {
-					console.log("complication data get update: no complications detected, emptying suggested_complications.")
-					dicepool.suggested_complications = []
-				}
+				})
+			}
+			else if(newData.resolutions && newData.resolutions.length == 0) {
+				dicepool.resolutions = []
+			}
 
-				// finally the suggested complications in the dicepool that have been removed
-				// from the complication pool online, should also be removed from the suggestions
-				console.log("complication data get update: removing complication suggestions not in complication pool.")
-				dicepool.suggested_complications = dicepool.suggested_complications.filter((sc: Die) => {
-					return complication_dice.map((c: Die) => c.id).includes(sc.id)
+			let complication_dice: Die[] = []
+			if(newData.complication_pool) {
+				console.log("complication data get update: complications detected, flattening complication pool:", newData.complication_pool)
+				// complications are grouped by player
+				// here the dice are extracted and put into a flat array
+				complication_dice = newData.complication_pool
+					.filter((cp: any) => cp.player != player.uuid)
+					.map((cp: any) => cp.complications).flat()
+			}
+
+			if(complication_dice.length > 0) {
+				// here the array of complication dice are added to the dicepool store
+				// as suggestions, the player can then choose which to add to their dicepool
+				console.log("complication data get update: adding complication suggestions: ", complication_dice)
+				complication_dice.forEach((c: Die) => {
+					if(!dicepool.suggested_complications.map((sc: Die) => sc.id).includes(c.id)) {
+						console.log("adding complication suggestion: ", c,
+							" to suggested_complications: ", dicepool.suggested_complications)
+						// dicepool.suggested_complications.push(_.cloneDeep(c))
+						dicepool.suggested_complications = [...dicepool.suggested_complications, _.clone(c)]
+						console.log("new suggested_complications: ", dicepool.suggested_complications)
+					}
 				})
+			}
+			else {
+				console.log("complication data get update: no complications detected, emptying suggested_complications.")
+				dicepool.suggested_complications = []
+			}
+
+			// finally the suggested complications in the dicepool that have been removed
+			// from the complication pool online, should also be removed from the suggestions
+			console.log("complication data get update: removing complication suggestions not in complication pool.")
+			dicepool.suggested_complications = dicepool.suggested_complications.filter((sc: Die) => {
+				return complication_dice.map((c: Die) => c.id).includes(sc.id)
+			})
+
+			dicepool.resolutions_rev = newData.resolutions_rev
+		}
+	}
 
-				dicepool.resolutions_rev = newData.resolutions_rev
+	//	applies the changes the server sent to the last whole payload
+	function apply_delta(base: any, delta: any) {
+		const payload = _.cloneDeep(base)
+		let resolutions = new Map<string, any>(payload.resolutions.map((r: Resolution) => [r.player.uuid, r]))
+		for(const op of delta.ops) {
+			const r = resolutions.get(op.player)
+			if(op.player === undefined) {
+				if(op.op == 'set') payload[op.key] = op.value
+				else if(op.op == 'order') resolutions = new Map(op.players.map((p: string) => [p, resolutions.get(p)]))
 			}
-		})
+			else if(op.resolution) resolutions.set(op.player, op.resolution)
+			else if(op.die !== undefined) {
+				if(op.op == 'add') r.dice.push(op.die)
+				else if(op.op == 'replace') r.dice = r.dice.map((d: Die) => d.id == op.die.id ? op.die : d)
+				else if(op.op == 'remove') r.dice = r.dice.filter((d: Die) => d.id != op.die)
+			}
+			else if(op.op == 'order') r.dice = op.dice.map((id: string) => r.dice.find((d: Die) => d.id == id))
+			else if(op.op == 'set') r[op.key] = op.value
+			else if(op.op == 'remove' && op.key !== undefined) delete r[op.key]
+			else if(op.op == 'remove') resolutions.delete(op.player)
+		}
+		payload.resolutions = [...resolutions.values()]
+		for(const key of ['resolutions_rev', 'session', 'scene', 'beat']) {
+			payload[key] = delta[key]
+		}
+		return payload
+	}
+
+	//	takes a whole payload or the changes since the last one
+	function apply_update(newData: any) {
+		if(!newData) {
+			return
+		}
+		if(newData.delta !== undefined) {
+			if(!last_payload || last_payload.resolutions_rev != newData.delta) {
+				// the changes don't fit what this page has, fetch everything again
+				last_payload = undefined
+				pull_dicepools()
+				return
+			}
+			newData = apply_delta(last_payload, newData)
+		}
+		if(newData.resolutions) {
+			last_payload = newData
+		}
+		apply_resolutions(_.cloneDeep(newData))
+	}
+
+	function resolutions_url() {
+		return API_URL + "get-resolutions/" + (last_payload ? last_payload.resolutions_rev : "")
+	}
+
+	//	this function pulls the active dicepools from the server once
+	function pull_dicepools() {
+		const { data } = useFetch(resolutions_url() + "?delta=1").get().json()
+		watch(data, (newData) => apply_update(newData))
+	}
+
+	//	fallback when server-sent events aren't available:
+	//	the server holds every request until the resolutions change
+	async function long_poll() {
+		while(!stop_clock.value && !resolutions_stream) {
+			const url = resolutions_url() + "?delta=1"
+				+ "&wait=25&session=" + player.session_id + "&scene=" + player.scene_id + "&beat=" + player.beat_id
+			const { data, error } = await useFetch(url).get().json()
+			if(error.value) {
+				await new Promise(r => setTimeout(r, interval.value))
+			}
+			else {
+				apply_update(data.value)
+			}
+		}
 	}
 
+	function start_long_polling() {
+		long_polling = true
+		long_poll().finally(() => long_polling = false)
+	}
+
+	//	this function subscribes to the resolutions the server pushes whenever they change
 	function pull_clock() {
-		pull_dicepools()
-		if(!stop_clock.value) {
-			setTimeout(pull_clock, interval.value)
+		if(resolutions_stream || long_polling) {
+			return
+		}
+		if(typeof EventSource == 'undefined') {
+			start_long_polling()
+			return
 		}
-		else {
-			console.log("stopping dicepool pull polling")
+		// the first event holds everything, the ones after it only the changes
+		last_payload = undefined
+		resolutions_stream = new EventSource(API_URL + "resolutions-stream?delta=1")
+		resolutions_stream.addEventListener('resolutions', (event) => {
+			apply_update(JSON.parse((event as MessageEvent).data))
+		})
+		resolutions_stream.onerror = () => {
+			// the browser reconnects by itself, unless the stream was closed for good
+			if(resolutions_stream?.readyState == EventSource.CLOSED) {
+				console.log("resolutions stream closed, falling back to long polling")
+				resolutions_stream = undefined
+				start_long_polling()
+			}
 		}
 	}
 
 	const stop_clock = ref(false)
 
+	watch(stop_clock, (stopped) => {
+		if(stopped) {
+			console.log("stopping dicepool updates")
+			resolutions_stream?.close()
+			resolutions_stream = undefined
+		}
+	})
+
 	function clear_dicepool() {
 		console.log("clearing dicepool")
 		dicepool.dice = []
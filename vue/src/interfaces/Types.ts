@@ -152,11 +152,31 @@ export interface Relation {
     favorite?: boolean
 }
 
+export interface ImageSize {
+    size: string
+    width?: number
+    height?: number
+    bytes?: number
+    format?: string
+    hash?: string
+    file?: string
+    url?: string
+}
+
+export interface ImageSource {
+    format?: string
+    type: string
+    srcset: string
+    files?: ImageSize[]
+}
+
 export interface Image {
     path: string
     ext: string
     width?: number
     height?: number
+    sizes?: ImageSize[]
+    sources?: ImageSource[]
 }
 
 export interface Entity {
@@ -37,6 +37,8 @@ export const useDicepoolStore = defineStore('dicepool', () => {
 	const resolutions: Ref<Array<Resolution>> = ref([])
 	const resolutions_rev: Ref<string> = ref("")
 	const pull_resolutions: Ref<boolean> = ref(true)
+	// why the server couldn't roll the dicepool, the dice are only ever rolled on the server
+	const roll_error: Ref<string> = ref("")
 
 	const dice: Ref<Array<Die>> = ref([])
 	const dicepool_limit: Ref<number> = ref(0)
@@ -123,6 +125,7 @@ export const useDicepoolStore = defineStore('dicepool', () => {
 		resolutions,
 		resolutions_rev,
 		pull_resolutions,
+		roll_error,
 		dice,
 		dicepool_limit,
 		result_limit,